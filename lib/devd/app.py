@@ -52,4 +52,9 @@ class App:
 
         if self.args == ["rbac", "api", "run"]:
             return api.main(*self.args, **self.opts)
+        if self.args == ["rbac", "api", "serve"]:
+            # pylint: disable-next=import-outside-toplevel
+            from .rbac import server
+
+            return server.serve(**self.opts)
         return None, f"Invalid command: {self.args}", 1
@@ -26,6 +26,8 @@ defaults = {
     "log_format": "json",
     "output_format": "json",  # "yaml", "none"
     "capture_logs": True,
+    # Write log records from a background thread:
+    "log_queue": False,
 }
 
 
@@ -64,7 +66,7 @@ class Main:
         return app.App(args=args, opts=opts, main_opts=self.opts)
 
     def run_app(self):
-        setup_logging(formatter=self.opts["log_format"])
+        setup_logging(formatter=self.opts["log_format"], queue=self.opts["log_queue"])
 
         def execute_app():
             return process_result(with_timing(self.make_app().run))
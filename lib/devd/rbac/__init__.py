@@ -6,10 +6,12 @@ from .rbac import (
     Resources,
     Role,
     Roles,
+    RoleSet,
     Membership,
     Memberships,
     Rule,
     Rules,
+    RuleSet,
 )
 from .domain import (
     SubjectDomain,
@@ -17,8 +19,12 @@ from .domain import (
     RuleDomain,
     PasswordDomain,
     Domain,
+    EffectiveRoles,
+    ResourceFilter,
     Solver,
 )
 from .subject import User, Group, Subject
 from .credential import UserPass, BearerToken, Cookie, Credential
 from .loader import DomainFileLoader, TextLoader
+from .rule_tree import RuleTree
+from .rule_index import RuleIndex, IndexedRuleDomain
@@ -0,0 +1,65 @@
+"""
+Structured access and audit log: one record per request.
+
+Records go to the "devd.rbac.access" logger, with their fields
+as LogRecord attributes, so that a JsonFormatter emits them as keys.
+Nothing is built unless the logger is enabled for INFO.
+Denials are always logged; allowed requests are sampled.
+"""
+
+from typing import Any, Callable, Dict
+import logging
+import random
+
+ACCESS_LOGGER = "devd.rbac.access"
+
+
+class AccessLog:
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        logger: logging.Logger | None = None,
+        rand: Callable[[], float] = random.random,
+    ):
+        # Fraction of allowed requests logged:
+        self.sample_rate = sample_rate
+        self.logger = logger or logging.getLogger(ACCESS_LOGGER)
+        self.rand = rand
+
+    def enabled(self, allowed: bool) -> bool:
+        if not self.logger.isEnabledFor(logging.INFO):
+            return False
+        return not allowed or self.sample_rate >= 1.0 or self.rand() < self.sample_rate
+
+    def record(
+        self,
+        action: str,
+        resource: str,
+        username: str,
+        status: int,
+        *,
+        info: Dict[str, Any] | None = None,
+        **fields: Any,
+    ) -> None:
+        """
+        Log one request, with the decision info and any other fields.
+        The field allowed defaults to whether status is a success.
+        """
+        allowed = fields.pop("allowed", status < 400)
+        if not self.enabled(allowed):
+            return
+        extra = {
+            "access_action": action,
+            "access_resource": resource,
+            "access_user": username,
+            "access_status": status,
+            "access_allowed": allowed,
+        }
+        if info:
+            extra["access_permission"] = info.get("permission")
+            extra["access_role"] = info.get("role")
+        for name, value in fields.items():
+            extra[f"access_{name}"] = value
+        self.logger.info(
+            "access %s %s %s %s", action, resource, username or "-", status, extra=extra
+        )
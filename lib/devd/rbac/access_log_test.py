@@ -0,0 +1,38 @@
+import logging
+from . import access_log as sut
+
+
+def make_access_log(caplog, sample_rate, draws):
+    caplog.set_level(logging.INFO, logger=sut.ACCESS_LOGGER)
+    return sut.AccessLog(sample_rate=sample_rate, rand=iter(draws).__next__)
+
+
+def test_record_fields(caplog):
+    access_log = make_access_log(caplog, 1.0, [])
+    info = {"permission": "allow", "role": "read-role"}
+    access_log.record("GET", "/a/f1.txt", "bob", 200, info=info, bytes=3)
+    (record,) = caplog.records
+    assert record.getMessage() == "access GET /a/f1.txt bob 200"
+    assert record.access_allowed is True
+    assert record.access_role == "read-role"
+    assert record.access_bytes == 3
+
+
+def test_denials_are_not_sampled(caplog):
+    access_log = make_access_log(caplog, 0.5, [0.7, 0.2])
+    access_log.record("GET", "/a", "bob", 200)
+    access_log.record("GET", "/b", "bob", 401)
+    access_log.record("GET", "/c", "bob", 200)
+    access_log.record("POST", "/__/access", "bob", 200, allowed=False)
+    assert [record.access_resource for record in caplog.records] == [
+        "/b",
+        "/c",
+        "/__/access",
+    ]
+
+
+def test_disabled_logger_builds_nothing(caplog):
+    caplog.set_level(logging.WARNING, logger=sut.ACCESS_LOGGER)
+    access_log = sut.AccessLog(sample_rate=0.5, rand=iter([]).__next__)
+    access_log.record("GET", "/a", "bob", 200)
+    assert not caplog.records
@@ -1,29 +1,67 @@
 from typing import Literal, Annotated, Callable
+import asyncio
 import re
+import time
+from contextlib import asynccontextmanager
 import logging
 import uvicorn
 from fastapi import FastAPI, Path, Form, status
 from fastapi.responses import RedirectResponse, Response, HTMLResponse
 from fastapi.requests import Request
-from asgiref.sync import async_to_sync
-from .app import App, AuthRequest, ResourceRequest, UserPass, AuthTokenRequest
+from starlette.concurrency import iterate_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .app import (
+    App,
+    AuthRequest,
+    ResourceRequest,
+    UserPass,
+    AuthTokenRequest,
+    AccessCheckBatch,
+)
+from .stream import StreamBody, FileSegment
+from . import metrics
 from ..util import setup_logging
 
 ####################################################
 
-app = App(
-    resource_root="tests/data/rbac/root",
-    domain_root="tests/data/rbac/domain",
-)
+# The App served: installed by its server before serving,
+# else made by get_app() from the demo data, relative to the working directory.
+# pylint: disable-next=invalid-name
+app: App | None = None
+DEMO_RESOURCE_ROOT = "tests/data/rbac/root"
+DEMO_DOMAIN_ROOT = "tests/data/rbac/domain"
+
+
+def get_app() -> App:
+    # pylint: disable-next=global-statement
+    global app
+    if app is None:
+        app = App(resource_root=DEMO_RESOURCE_ROOT, domain_root=DEMO_DOMAIN_ROOT)
+    return app
+
 
 ####################################################
 
 UserName = Annotated[str, Path(pattern=re.compile(r"^[a-z][a-z0-9_]*$"))]
 ActionName = Literal["GET", "HEAD", "PUT", "DELETE"]
 
+
+@asynccontextmanager
+async def lifespan(_api: FastAPI):
+    served = get_app()
+    reloader = served.start_reloader() if served.watch_files else None
+    sweeper = served.start_sweeper()
+    yield
+    if sweeper:
+        sweeper.stop()
+    if reloader:
+        reloader.stop()
+
+
 api = FastAPI(
     docs_url="/__/docs",
     openapi_url="/__/openapi.json",
+    lifespan=lifespan,
 )
 
 
@@ -65,8 +103,8 @@ def post_login(
     response: Response,
 ):
     userpass = UserPass(username, password)
-    cookie = app.login(userpass)
-    logging.info("post_login %s", f"{cookie=}")
+    cookie = get_app().login(userpass)
+    logging.info("post_login: username=%r success=%s", username, bool(cookie))
     if cookie:
         response = HTMLResponse(content="OK", status_code=200)
         response.set_cookie(cookie.name, cookie.value)
@@ -79,8 +117,12 @@ def post_login(
 def post_auth_token(
     request: AuthTokenRequest,
 ):
-    token = app.auth_token(request)
-    logging.info("post_auth_token %s", f"{token=}")
+    token = get_app().auth_token(request)
+    logging.info(
+        "post_auth_token: username=%r success=%s",
+        request.userpass.username,
+        bool(token),
+    )
     if token:
         return {
             "token": token,
@@ -92,15 +134,23 @@ def post_auth_token(
 
 
 @api.get("/__/logout")
-def get_logout():
+def get_logout(request: Request):
+    served = get_app()
+    served.logout(request.cookies.get(served.auth_cookie_name))
     response = HTMLResponse(content="OK", status_code=200)
-    response.delete_cookie(app.auth_cookie_name)
+    response.delete_cookie(served.auth_cookie_name)
     return response
 
 
+# The metrics of this process only; see metrics:
+@api.get("/__/metrics")
+def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @api.get("/__/whoami")
 def get_whoami(request: Request):
-    username = app.authenticate(auth_request(request))
+    username = get_app().authenticate(auth_request(request))
     return HTMLResponse(content=username, status_code=200)
 
 
@@ -109,33 +159,47 @@ def get_whoami(request: Request):
 
 @api.get("/__/access/{action}/{resource:path}")
 def check_get_access(action: ActionName, resource: str, request: Request):
-    return resource_request(action, resource, request, app.check_access)
+    return resource_request(action, resource, request, get_app().check_access)
+
+
+@api.post("/__/access")
+def post_access_batch(batch: AccessCheckBatch, request: Request):
+    code, headers, body = get_app().check_access_batch(
+        auth_request(request), batch.checks
+    )
+    return Response(content=body, status_code=code, headers=headers)
 
 
 ######################################
+# Handlers that authenticate, authorize or stat are not async,
+# so that FastAPI runs them in its threadpool, off the event loop.
 
 
 @api.get("/{resource:path}")
 def get_resource(resource: str, request: Request):
-    return resource_request("GET", resource, request, app.resource_get)
+    req = ResourceRequest(
+        "GET", resource, auth_request(request), b"", dict(request.headers)
+    )
+    code, headers, body = get_app().resource_get_stream(req)
+    return StreamBodyResponse(body, status_code=code, headers=headers)
 
 
 @api.head("/{resource:path}")
 def head_resource(resource: str, request: Request):
-    return resource_request("HEAD", resource, request, app.resource_head)
+    return resource_request("HEAD", resource, request, get_app().resource_head)
 
 
 @api.put("/{resource:path}")
-def put_resource(resource: str, request: Request):
-    return resource_request(
-        "PUT", resource, request, app.resource_put, async_to_sync(request.body)()
-    )
+async def put_resource(resource: str, request: Request):
+    req = ResourceRequest("PUT", resource, auth_request(request), b"")
+    code, headers, body = await get_app().resource_put_stream(req, request.stream())
+    return Response(content=body, headers=headers, status_code=code)
 
 
 def auth_request(request: Request) -> AuthRequest:
     return AuthRequest(
         request.headers.get("Authorization"),
-        request.cookies.get(app.auth_cookie_name),
+        request.cookies.get(get_app().auth_cookie_name),
     )
 
 
@@ -146,11 +210,95 @@ def resource_request(
     func: Callable,
     body: bytes = b"",
 ) -> Response:
-    req = ResourceRequest(action, resource, auth_request(request), body)
+    req = ResourceRequest(
+        action, resource, auth_request(request), body, dict(request.headers)
+    )
     code, headers, body = func(req)
     return Response(content=body, headers=headers, status_code=code)
 
 
+class StreamBodyResponse(Response):
+    """
+    Sends a StreamBody in chunks read in the threadpool,
+    or FileSegments by the server's zero-copy extension, if available.
+    """
+
+    def __init__(self, body: StreamBody, status_code: int, headers: dict):
+        super().__init__(content=b"", status_code=status_code, headers=headers)
+        self.stream_body = body
+        if status_code not in (204, 304) and "content-length" not in {
+            key.lower() for key in headers
+        }:
+            self.headers["content-length"] = str(body.content_length())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            await self.send_zero_copy(send)
+        else:
+            async for chunk in iterate_in_threadpool(iter(self.stream_body)):
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def send_zero_copy(self, send: Send) -> None:
+        for part in self.stream_body.parts:
+            if isinstance(part, FileSegment):
+                io = await asyncio.to_thread(open, part.path, "rb")
+                with io:
+                    await send(
+                        {
+                            "type": "http.response.zerocopysend",
+                            "file": io.fileno(),
+                            "offset": part.offset,
+                            "count": part.length,
+                            "more_body": True,
+                        }
+                    )
+            else:
+                await send(
+                    {"type": "http.response.body", "body": part, "more_body": True}
+                )
+
+
+class RequestMetrics:
+    """Records the time of each HTTP request by method, route and status."""
+
+    def __init__(self, asgi_app: ASGIApp):
+        self.app = asgi_app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router adds the matched route to scope:
+            route = getattr(scope.get("route"), "path", "")
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - started, scope["method"], route, str(status_code)
+            )
+
+
+api.add_middleware(RequestMetrics)
+
 ######################################
 
 
@@ -167,5 +315,5 @@ def main(*_args, **kwargs):
 
 
 if __name__ == "__main__":
-    setup_logging(level=logging.INFO, formatter="json")
+    setup_logging(level=logging.INFO, formatter="json", queue=True)
     main()
@@ -0,0 +1,125 @@
+from pathlib import Path
+import asyncio
+import base64
+import shutil
+import time
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from . import api as sut
+from .app import App
+
+data_dir = Path("tests/data/rbac")
+
+
+@pytest.fixture(name="client")
+def fixture_client(tmp_path, monkeypatch):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    app = App(
+        resource_root=str(tmp_path / "root"),
+        domain_root=str(tmp_path / "domain"),
+    )
+    app.stream_chunk_size = 7
+    monkeypatch.setattr(sut, "app", app)
+    return TestClient(sut.api)
+
+
+def test_get_resource_streams_file(client):
+    response = client.get("/a/f1.txt", auth=("bob", "b0b3r7"))
+    assert response.status_code == 200
+    expected = (data_dir / "root/a/f1.txt").read_bytes()
+    assert response.content == expected
+    assert response.headers["content-length"] == str(len(expected))
+    assert client.get("/a/f1.txt").status_code == 401
+    assert client.get("/a/nope.txt", auth=("bob", "b0b3r7")).status_code == 404
+
+
+def test_put_resource_streams_to_file(client):
+    content = b"frank was here!\n" * 100
+    response = client.put("/a/b/frank.txt", content=content, auth=("frank", "crick"))
+    assert response.status_code == 201
+    assert response.content == f"OK : {len(content)} bytes".encode()
+    assert sut.app.resource_root.joinpath("a/b/frank.txt").read_bytes() == content
+    assert sorted(p.name for p in sut.app.resource_root.joinpath("a/b").iterdir()) == [
+        ".rbac.txt",
+        "frank.txt",
+    ]
+    response = client.put("/a/b/bob.txt", content=content, auth=("bob", "b0b3r7"))
+    assert response.status_code == 401
+    assert not sut.app.resource_root.joinpath("a/b/bob.txt").exists()
+
+
+def test_post_access_batch(client):
+    checks = [
+        {"action": "PUT", "resource": "/a/b/x.txt"},
+        {"action": "GET", "resource": "a/b/y.txt"},
+        {"action": "PUT", "resource": "/pub/z.txt"},
+    ]
+    response = client.post(
+        "/__/access", json={"checks": checks}, auth=("frank", "crick")
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["user"] == "frank"
+    assert [result["allowed"] for result in body["results"]] == [True, True, False]
+    assert [result["resource"] for result in body["results"]] == [
+        "/a/b/x.txt",
+        "a/b/y.txt",
+        "/pub/z.txt",
+    ]
+    response = client.post("/__/access", json={"checks": checks})
+    assert [result["allowed"] for result in response.json()["results"]] == [False] * 3
+
+
+def test_get_metrics(client):
+    client.get("/a/f1.txt", auth=("bob", "b0b3r7"))
+    response = client.get("/__/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert 'devd_rbac_authentications_total{credential="basic",result="success"}' in (
+        text
+    )
+    assert 'devd_rbac_phase_seconds_count{phase="file.read"}' in text
+    assert (
+        'devd_rbac_request_seconds_count{method="GET",route="/{resource:path}",'
+        'status="200"}'
+    ) in text
+
+
+@pytest.mark.usefixtures("client")
+@pytest.mark.parametrize("method", ["GET", "HEAD", "PUT"])
+def test_slow_request_does_not_block_others(monkeypatch, method):
+    authenticate = sut.app.authenticate
+
+    slow_header = "Basic " + base64.b64encode(b"frank:crick").decode()
+
+    def slow_authenticate(auth_request):
+        if auth_request.header == slow_header:
+            # As a blocking scrypt hash or LDAP bind would:
+            time.sleep(0.5)
+        return authenticate(auth_request)
+
+    monkeypatch.setattr(sut.app, "authenticate", slow_authenticate)
+
+    async def request(http, *args, **kwargs):
+        response = await http.request(*args, **kwargs)
+        return response.status_code, time.perf_counter()
+
+    path = "/a/b/frank.txt" if method == "PUT" else "/a/f1.txt"
+    body = {"content": b"frank"} if method == "PUT" else {}
+
+    async def run():
+        transport = httpx.ASGITransport(app=sut.api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as http:
+            started = time.perf_counter()
+            slow, fast = await asyncio.gather(
+                request(http, method, path, auth=("frank", "crick"), **body),
+                request(http, "GET", "/a/f1.txt", auth=("bob", "b0b3r7")),
+            )
+            return started, slow, fast
+
+    started, (slow_status, slow_done), (fast_status, fast_done) = asyncio.run(run())
+    assert slow_status in (200, 201) and fast_status == 200
+    assert slow_done - started >= 0.5
+    assert fast_done - started < 0.4
@@ -1,24 +1,52 @@
-from typing import Any, Iterable, Dict, Tuple, Callable
+from typing import Any, AsyncIterable, Iterable, Dict, List, Tuple, Callable
 from pathlib import Path
+import asyncio
+import functools
 import logging
 import os
 import re
 import json
 from datetime import datetime, timezone
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import tabulate
-from .loader import DomainFileLoader
+from .util import getter
+from .loader import DomainFileLoader, FileSystemLoader
+from .rule_tree import RuleTree, FileCache, file_key
+from .reload import Reloader
+from .rule_index import IndexedRuleDomain
+from .cache import LRUCache
+from .access_log import AccessLog
+from .metrics import PHASE_SECONDS, DECISION_CACHE
+from .snapshot import DomainSnapshot, load_snapshot
+from .stream import StreamBody, FileSegment, AtomicFileWriter
+from .conditional import (
+    not_modified,
+    request_ranges,
+    content_range,
+    byteranges_body,
+    http_date,
+)
 from .credential import UserPass, Cookie, BearerToken
 from .auth import Authenticator, AuthTokenRequest
+from .session import SessionStore, SqliteSessionBackend, Sweeper
+from .session_token import TokenCodec
 from ..rbac import (
     Domain,
+    EffectiveRoles,
+    SubjectDomain,
+    PasswordDomain,
+    RoleDomain,
+    RuleDomain,
     Solver,
     Request,
     Permission,
     Action,
     Resource,
     Rule,
+    Rules,
     Role,
+    RoleSet,
+    User,
 )
 
 
@@ -34,30 +62,106 @@ class ResourceRequest:
     resource: str
     auth_request: AuthRequest  #  | None
     body: bytes
+    # HTTP request headers, with lower-case names:
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class AccessCheck:
+    action: str
+    resource: str
+
+
+@dataclass
+class AccessCheckBatch:
+    checks: List[AccessCheck]
 
 
 ResourceResponse = Tuple[int, dict, bytes]
+ResourceStreamResponse = Tuple[int, dict, StreamBody]
 
+LOAD_DOMAIN_SECONDS = PHASE_SECONDS.labels("load.domain")
+MATCH_SECONDS = PHASE_SECONDS.labels("match")
+DECISION_CACHE_HITS = DECISION_CACHE.labels("hit")
+DECISION_CACHE_MISSES = DECISION_CACHE.labels("miss")
 
-class App:
+
+@dataclass(frozen=True)
+class DomainState:
+    """
+    The domains loaded from domain_root, replaced as a whole on reload.
+    A published DomainState is not mutated.
+    """
+
+    subject_domain: SubjectDomain
+    password_domain: PasswordDomain
+    effective_roles: EffectiveRoles
     authenticator: Authenticator
 
-    def __init__(self, resource_root: str, domain_root: str):
+
+class App:
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        resource_root: str,
+        domain_root: str,
+        *,
+        ldap_config: dict | None = None,
+        snapshot_path: str | None = None,
+        token_format: str = "compact",
+        session_path: str | None = None,
+    ):
         self.verbose = False
+        # If set, users and passwords are looked up in LDAP:
+        self.ldap_config = ldap_config
         self.resource_root = Path(resource_root)
         self.domain_root = Path(domain_root)
         self.environ: Dict[str, str] = {}
+        # A compiled snapshot of the domain and rule files, used where current:
+        self.snapshot_path = snapshot_path
+        self.snapshot: DomainSnapshot | None = None
+        if snapshot_path:
+            self.snapshot = load_snapshot(Path(snapshot_path))
         self.start_response = None
         self.auth_cookie_name = "authsession"
         self.cipher_key = "123"
-        self.authenticator = self.make_authenticator()
+        # "compact": TokenCodec tokens, without passwords;
+        # "cipher": Cipher-enciphered tokens, as before;
+        # "session": ids of sessions in a SessionStore, revoked on logout:
+        self.token_format = token_format
+        # If set, sessions are also kept in this SQLite file:
+        self.session_path = session_path
+        self.session_sweep_interval = 60.0
+        # Key id => key, for compact tokens. New tokens use the highest id:
+        self.token_keys: Dict[int, str] = {1: self.cipher_key}
         self.default_cookie_lifetime = 60
+        self.rule_check_interval = 1.0
+        # "indexed" or "linear":
+        self.rule_matcher = "indexed"
+        self.ldap_domains: Tuple[SubjectDomain, PasswordDomain] | None = None
+        # Copied with the domains of each DomainState:
+        self.authenticator_prototype = self.make_authenticator()
+        self.state_cache = self.make_state_cache()
+        self.rule_tree = self.make_rule_tree()
+        # A decision_cache_size of 0 disables the decision cache:
+        self.decision_cache_size = 10000
+        self.decision_cache_ttl: float | None = 60.0
+        self.decision_cache = self.make_decision_cache()
+        self.stream_chunk_size = 64 * 1024
+        self.max_access_checks = 1000
+        # List only the directory entries a user may GET:
+        self.authorized_listing = True
+        # One record per request on the "devd.rbac.access" logger:
+        self.access_log = AccessLog()
+        # While serving, reload changed files in a background thread.
+        # A PreforkServer reloads in its master, and replaces its workers instead:
+        self.watch_files = True
 
     ######################################
 
     def login(self, request: UserPass) -> Cookie | None:
         userpass = self.authenticator.auth_userpass(request)
-        logging.info("%s", f"login: {request.username=}")
+        logging.info("login: username=%r success=%s", request.username, bool(userpass))
         if userpass:
             auth_request = AuthTokenRequest(
                 userpass,
@@ -67,6 +171,10 @@ class App:
             return self.authenticator.auth_request_cookie(auth_request)
         return None
 
+    def logout(self, cookie_value: str | None) -> None:
+        if cookie_value:
+            self.authenticator.revoke_secret(cookie_value)
+
     def auth_token(self, auth_request: AuthTokenRequest) -> BearerToken | None:
         userpass = self.authenticator.auth_userpass(auth_request.userpass)
         if userpass:
@@ -76,38 +184,119 @@ class App:
     ######################################
 
     def resource_get(self, request: ResourceRequest) -> ResourceResponse:
-        def read_file(path: Path):
-            if path.is_dir():
-                return self.dir_index(path)
-            size = os.stat(str(path)).st_size
-            logging.info("resource_get: %s", f"{request.action} {size} bytes <= {path}")
-            with open(path, "rb") as io:
-                return 200, file_headers(path), io.read()
-
-        return self.resource_request(request, read_file)
+        status, headers, body = self.resource_get_stream(request)
+        return status, headers, b"".join(body)
 
     def resource_head(self, request: ResourceRequest) -> ResourceResponse:
         def head_file(path: Path):
-            return 200, file_headers(path), b""
+            if path.is_dir():
+                return 200, {"Content-Type": "text/plain"}, b""
+            status, headers, _ = self.file_response(request, path, head=True)
+            return status, headers, b""
 
         return self.resource_request(request, head_file)
 
     def resource_put(self, request: ResourceRequest) -> ResourceResponse:
         def put_file(path: Path):
-            logging.info(
-                "resource_put: %s",
-                f"{request.action} {len(request.body)} bytes => {path}",
-            )
-            with open(str(path), "wb") as io:
-                io.write(request.body)
-            return (
-                201,
-                {"Content-Type": "text/plain"},
-                f"OK : {len(request.body)} bytes".encode(),
+            logging.debug(
+                "resource_put: %s %d bytes => %s",
+                request.action,
+                len(request.body),
+                path,
             )
+            with AtomicFileWriter(path) as writer:
+                writer.write(request.body)
+            return put_result(writer.size)
 
         return self.resource_request(request, put_file, must_exist=False)
 
+    ######################################
+    # Streaming variants:
+    # Authorization is checked before any file content is read or written.
+
+    def resource_get_stream(self, request: ResourceRequest) -> ResourceStreamResponse:
+        path, username, denied = self.authorize(request)
+        if denied:
+            return stream_result(denied)
+        if path.is_dir():
+            json_output = "application/json" in request.headers.get("accept", "")
+            if not self.authorized_listing:
+                return stream_result(self.dir_index(path, json_output=json_output))
+            return stream_result(
+                self.dir_index(path, request.resource, username, json_output)
+            )
+        return self.file_response(request, path)
+
+    def file_response(
+        self, request: ResourceRequest, path: Path, head: bool = False
+    ) -> ResourceStreamResponse:
+        """
+        Respond with the file at path:
+        - 304 if If-None-Match or If-Modified-Since match
+        - 206 with one or multipart/byteranges for a GET Range
+        - 416 if no range is satisfiable
+        - otherwise 200 with the whole file
+        """
+        stat = os.stat(str(path))
+        size, headers = stat.st_size, stat_headers(stat)
+        if not_modified(request.headers, headers["ETag"], stat.st_mtime):
+            headers = {key: headers[key] for key in ("ETag", "Last-Modified")}
+            return 304, headers, StreamBody([])
+        ranges = None
+        if not head:
+            ranges = request_ranges(
+                request.headers, headers["ETag"], stat.st_mtime, size
+            )
+        if ranges is None:
+            status, parts = 200, [FileSegment(path, 0, size)]
+            body = StreamBody(parts, self.stream_chunk_size)
+        elif not ranges:
+            headers = {"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+            return 416, headers, StreamBody([])
+        elif len(ranges) == 1:
+            (first, last), status = ranges[0], 206
+            body = StreamBody(
+                [FileSegment(path, first, last - first + 1)], self.stream_chunk_size
+            )
+            headers["Content-Range"] = content_range(ranges[0], size)
+        else:
+            status = 206
+            headers["Content-Type"], body = byteranges_body(
+                path, ranges, size, headers["Content-Type"]
+            )
+            body.chunk_size = self.stream_chunk_size
+        headers["Content-Length"] = str(body.content_length())
+        logging.debug(
+            "resource_get: %s %s %s bytes <= %s",
+            request.action,
+            status,
+            headers["Content-Length"],
+            path,
+        )
+        return status, headers, body
+
+    async def resource_put_stream(
+        self, request: ResourceRequest, chunks: AsyncIterable[bytes]
+    ) -> ResourceResponse:
+        # Authentication and rule solving can block:
+        path, denied = await asyncio.to_thread(
+            self.authorize_resource, request, must_exist=False
+        )
+        if denied:
+            return denied
+        writer = await asyncio.to_thread(AtomicFileWriter, path)
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(writer.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        await asyncio.to_thread(writer.commit)
+        logging.debug(
+            "resource_put: %s %d bytes => %s", request.action, writer.size, path
+        )
+        return put_result(writer.size)
+
     ######################################
 
     def resource_request(
@@ -116,21 +305,89 @@ class App:
         with_path: Callable[[Path], ResourceResponse],
         must_exist: bool = True,
     ) -> ResourceResponse:
+        path, denied = self.authorize_resource(request, must_exist)
+        if denied:
+            return denied
+        return with_path(path)
+
+    def authorize_resource(
+        self, request: ResourceRequest, must_exist: bool = True
+    ) -> Tuple[Path, ResourceResponse | None]:
+        """Return the resource's file path, and a response if access is denied."""
+        path, _, denied = self.authorize(request, must_exist)
+        return path, denied
+
+    def authorize(
+        self, request: ResourceRequest, must_exist: bool = True
+    ) -> Tuple[Path, str, ResourceResponse | None]:
+        """
+        Return the resource's file path, the authenticated username,
+        and a response if access is denied.
+        """
         path = Path(str(self.resource_root) + normalize_path(request.resource))
         exists = os.access(str(path), os.R_OK)
-        logging.info("resource_request: %s", f"{request.action} {path=} {exists=}")
+        logging.debug("resource_request: %s %s exists=%s", request.action, path, exists)
         if must_exist and not exists:
-            return status_result(404)
-        status, _, body = self.check_access(request)
-        logging.info("resource_request:::\n%s", body.decode())
-        if status == 200:
-            return with_path(path)
-        return status_result(401)
+            self.access_log.record(request.action, request.resource, "", 404)
+            return path, "", status_result(404)
+        username = self.authenticate(request.auth_request)
+        success, info = self.is_allowed(request.action, request.resource, username)
+        status = 200 if success else 401
+        self.access_log.record(
+            request.action, request.resource, username, status, info=info
+        )
+        if success:
+            return path, username, None
+        return path, username, status_result(status)
 
     ######################################
 
     def is_allowed(self, action: str, resource: str, username: str) -> Tuple[bool, Any]:
+        """
+        Decisions are cached by (action, normalized resource, username).
+        A cached decision is used only while the user, role and rule domains
+        it was made with are current for the resource.
+        """
+        if self.decision_cache is None:
+            return self.decide(action, resource, username)
+        resource_path = normalize_path(resource)
+        key = (action, resource_path, username)
+        stamp = self.decision_stamp(resource_path)
+        if cached := self.cached_decision(key, stamp, resource):
+            return cached
+        success, info = self.decide(action, resource, username)
+        self.decision_cache.put(key, (stamp, (success, info)))
+        return success, info
+
+    def cached_decision(
+        self, key: tuple, stamp: tuple, resource: str
+    ) -> Tuple[bool, Any] | None:
+        """The decision cached for key with stamp, or None."""
+        if self.decision_cache is None:
+            return None
+        valid = functools.partial(has_stamp, stamp)
+        if cached := self.decision_cache.get(key, valid=valid):
+            DECISION_CACHE_HITS.inc()
+            success, info = cached[1]
+            return success, info | {"resource": resource}
+        DECISION_CACHE_MISSES.inc()
+        return None
+
+    def decision_stamp(self, resource_path: str) -> tuple:
+        state = self.state
+        return (
+            state,
+            state.subject_domain.current(),
+            self.rule_tree.rule_domain_for_resource(Path(resource_path)),
+        )
+
+    def decide(self, action: str, resource: str, username: str) -> Tuple[bool, Any]:
         rule: Rule = self.solve(action, resource, username)
+        return self.decision(rule, action, resource, username)
+
+    def decision(
+        self, rule: Rule, action: str, resource: str, username: str
+    ) -> Tuple[bool, Any]:
         result = {
             "permission": rule.permission.name,
             "action": action,
@@ -140,12 +397,95 @@ class App:
         }
         return rule.permission.name == "allow", result
 
+    def is_allowed_batch(
+        self, checks: List[AccessCheck], username: str
+    ) -> List[Tuple[bool, Any]]:
+        """
+        Decide many checks for one user, as is_allowed would.
+        The domain state, the user and their roles are looked up once,
+        and the RuleDomain once for each directory.
+        """
+        state = self.state
+        user = state.subject_domain.user_by_name(username) if username else None
+        roles = state.effective_roles.roles_for_user(user) if user else RoleSet()
+        subject_domain = state.subject_domain.current()
+        rule_domain_for_directory = functools.cache(
+            lambda directory: self.rule_tree.rule_domain_for_resource(directory / "_")
+        )
+        results = []
+        for check in checks:
+            resource_path = normalize_path(check.resource)
+            rule_domain = rule_domain_for_directory(Path(resource_path).parent)
+            stamp = (state, subject_domain, rule_domain)
+            key = (check.action, resource_path, username)
+            if (decision := self.cached_decision(key, stamp, check.resource)) is None:
+                decision = self.decision(
+                    self.first_rule(
+                        rule_domain, check.action, resource_path, user, roles
+                    ),
+                    check.action,
+                    check.resource,
+                    username,
+                )
+                if self.decision_cache is not None:
+                    self.decision_cache.put(key, (stamp, decision))
+            results.append(decision)
+        return results
+
+    def first_rule(
+        self,
+        rule_domain: RuleDomain,
+        action: str,
+        resource_path: str,
+        user: User | None,
+        roles: RoleSet,
+    ) -> Rule:
+        """The first rule of rule_domain that applies, or the default rule."""
+        request = Request(
+            action=Action(action), resource=Resource(resource_path), user=user
+        )
+        rules: Rules = []
+        if action and user:
+            with MATCH_SECONDS.time():
+                rules = rule_domain.find_rules(request, roles, max_rules=1)
+        return rules[0] if rules else self.default_rule(request)
+
     ######################################
 
+    def check_access_batch(
+        self, auth_request: AuthRequest, checks: List[AccessCheck]
+    ) -> ResourceResponse:
+        """Authenticate once, and decide each check. Denials are not errors."""
+        if len(checks) > self.max_access_checks:
+            return status_result(413)
+        username = self.authenticate(auth_request)
+        results = [
+            {"allowed": success} | info
+            for success, info in self.is_allowed_batch(checks, username)
+        ]
+        denied = sum(not result["allowed"] for result in results)
+        self.access_log.record(
+            "POST",
+            "/__/access",
+            username,
+            200,
+            allowed=not denied,
+            checks=len(results),
+            denied=denied,
+        )
+        return (
+            200,
+            {"Content-Type": "application/json"},
+            json.dumps({"user": username, "results": results}, indent=2).encode(),
+        )
+
     def check_access(self, request: ResourceRequest) -> ResourceResponse:
         username = self.authenticate(request.auth_request)
         success, info = self.is_allowed(request.action, request.resource, username)
         status = 200 if success else 401
+        self.access_log.record(
+            request.action, request.resource, username, status, info=info, check=True
+        )
         return (
             status,
             {"Content-Type": "application/json"},
@@ -153,11 +493,10 @@ class App:
         )
 
     def authenticate(self, auth_request: AuthRequest) -> str:
-        logging.debug("%s", f"authenticate: {auth_request=}")
         userpass = self.authenticator.authenticate(
             None, auth_request.header, auth_request.cookie
         )
-        logging.info("%s", f"authenticate: {userpass and userpass.username=}")
+        logging.debug("authenticate: username=%r", userpass and userpass.username)
         if userpass:
             return userpass.username
         return ""
@@ -176,7 +515,8 @@ class App:
 
         rules: Iterable = []
         if action_name and username and user:
-            rules = solver.find_rules(request)
+            with MATCH_SECONDS.time():
+                rules = solver.find_rules(request)
 
         if self.verbose:
             logging.info("  action        : %s", repr(request.action.name))
@@ -214,77 +554,297 @@ class App:
             description="<<DEFAULT>>",
         )
 
-    def make_authenticator(self):
-        self.subject_domain, self.password_domain = self.make_auth_domains()
+    def make_authenticator(self) -> Authenticator:
+        if self.token_format not in ("compact", "cipher", "session"):
+            raise ValueError(f"App: invalid token_format {self.token_format!r}")
         authenticator = Authenticator(
-            subject_domain=self.subject_domain,
-            password_domain=self.password_domain,
+            subject_domain=SubjectDomain(),
+            password_domain=PasswordDomain(),
             cipher_key=self.cipher_key,
             cookie_name=self.auth_cookie_name,
+            token_codec=(
+                TokenCodec(self.token_keys) if self.token_format == "compact" else None
+            ),
+            session_store=self.make_session_store(),
         )
         return authenticator
 
+    def make_session_store(self) -> SessionStore | None:
+        if self.token_format != "session":
+            return None
+        backend = None
+        if self.session_path:
+            backend = SqliteSessionBackend(self.session_path)
+        return SessionStore(backend=backend)
+
+    def add_token_key(self, key_id: int, key: str) -> None:
+        """
+        Issue compact tokens with a new key.
+        Tokens issued with previous keys remain valid until they expire.
+        """
+        self.token_keys[key_id] = key
+        if token_codec := self.authenticator_prototype.token_codec:
+            token_codec.add_key(key_id, key)
+            token_codec.key_id = key_id
+
+    ##########################################################
+    # Domain files are reloaded together, into a new DomainState.
+    # Without a Reloader, they are checked on requests
+    # at most once every rule_check_interval seconds.
+
+    @property
+    def state(self) -> DomainState:
+        return self.state_cache.get()
+
+    @property
+    def authenticator(self) -> Authenticator:
+        return self.state.authenticator
+
+    @property
+    def subject_domain(self) -> SubjectDomain:
+        return self.state.subject_domain
+
+    @property
+    def password_domain(self) -> PasswordDomain:
+        return self.state.password_domain
+
+    def domain_files(self) -> List[Path]:
+        return [self.domain_root / name for name in DOMAIN_FILE_NAMES]
+
+    def domain_files_key(self, _domain_root: Path) -> tuple:
+        return tuple(file_key(path) for path in self.domain_files())
+
+    def make_state_cache(self) -> FileCache:
+        state_cache = FileCache(
+            self.domain_root, self.load_state, check_interval=self.rule_check_interval
+        )
+        state_cache.file_key = self.domain_files_key
+        state_cache.get()
+        return state_cache
+
+    def load_state(self, _domain_root: Path) -> DomainState:
+        with LOAD_DOMAIN_SECONDS.time():
+            subject_domain, password_domain = self.make_auth_domains()
+            role_domain = self.load_role_domain(self.domain_root / "role.txt")
+            return DomainState(
+                subject_domain=subject_domain,
+                password_domain=password_domain,
+                effective_roles=EffectiveRoles(subject_domain, role_domain),
+                authenticator=self.authenticator_prototype.with_domains(
+                    subject_domain, password_domain
+                ),
+            )
+
+    def reload_snapshot(self) -> bool:
+        """
+        Load snapshot_path again and swap in its domains,
+        and the rule nodes whose auth files changed.
+        Returns False if the snapshot cannot be loaded.
+        """
+        if not self.snapshot_path:
+            return False
+        if (snapshot := load_snapshot(Path(self.snapshot_path))) is None:
+            return False
+        self.snapshot = snapshot
+        rule_tree, seeded = self.rule_tree, set()
+        for directory, key, rule_set in snapshot.rule_sets():
+            seeded.add(directory)
+            node = rule_tree.nodes.get(directory)
+            if node is None or node.file_key != key:
+                rule_tree.seed(directory, key, rule_set)
+        # Directories whose auth file is gone, or changed since the snapshot:
+        for directory in set(rule_tree.directories()) - seeded:
+            rule_tree.refresh(directory)
+        self.state_cache.refresh()
+        return True
+
+    def warm_up(self) -> None:
+        """Load the domain state, and the RuleDomain of each directory with rules."""
+        _ = self.state
+        for directory in self.rule_tree.directories():
+            self.rule_tree.rule_domain_for_resource(directory / "_")
+
+    def start_sweeper(self) -> Sweeper | None:
+        """Remove expired sessions in a background thread."""
+        if (session_store := self.authenticator_prototype.session_store) is None:
+            return None
+        sweeper = Sweeper(session_store, self.session_sweep_interval)
+        sweeper.start()
+        return sweeper
+
+    def start_reloader(self, **kwargs: Any) -> Reloader:
+        """
+        Reload domain and rule files in a background thread when they change,
+        instead of checking them on requests.
+        """
+        reloader = Reloader(self, **kwargs)
+        reloader.start()
+        return reloader
+
     ##########################################################
     # This can be overridden to use a different domain loader.
 
     def make_auth_domains(self):
+        if self.ldap_config:
+            if self.ldap_domains is None:
+                # pylint: disable-next=import-outside-toplevel
+                from .ldap import make_ldap_auth_domains
+
+                self.ldap_domains = make_ldap_auth_domains(self.ldap_config)
+            return self.ldap_domains
         root = self.domain_root
         loader = DomainFileLoader()
-        subject_domain = loader.load_user_file(root / "user.txt")
-        password_domain = loader.load_password_file(root / "password.txt")
+        subject_domain = password_domain = None
+        if self.snapshot:
+            subject_domain = self.snapshot.subject_domain(root / "user.txt")
+            password_domain = self.snapshot.password_domain(root / "password.txt")
+        if not subject_domain:
+            subject_domain = loader.load_user_file(root / "user.txt")
+        if not password_domain:
+            password_domain = loader.load_password_file(root / "password.txt")
         return subject_domain, password_domain
 
+    def make_decision_cache(self) -> LRUCache | None:
+        if not self.decision_cache_size:
+            return None
+        return LRUCache(self.decision_cache_size, ttl=self.decision_cache_ttl)
+
+    def make_rule_tree(self) -> RuleTree:
+        loader = FileSystemLoader(resource_root=self.resource_root)
+        rule_domain_class = (
+            IndexedRuleDomain if self.rule_matcher == "indexed" else RuleDomain
+        )
+        rule_tree = RuleTree(
+            loader,
+            check_interval=self.rule_check_interval,
+            rule_domain_class=rule_domain_class,
+        )
+        if self.snapshot:
+            self.snapshot.seed_rule_tree(rule_tree)
+        return rule_tree
+
+    def load_role_domain(self, role_file: Path) -> RoleDomain:
+        role_domain = self.snapshot and self.snapshot.role_domain(role_file)
+        if not role_domain:
+            role_domain = DomainFileLoader().load_membership_file(role_file)
+        return role_domain
+
     def make_domain(self, resource: Resource) -> Domain:
-        root = self.domain_root
-        loader = DomainFileLoader()
+        state = self.state
         domain = Domain(
-            subject_domain=self.subject_domain,
-            role_domain=loader.load_membership_file(root / "role.txt"),
-            rule_domain=loader.load_rules_for_resource(
-                self.resource_root, Path(resource.name)
-            ),
-            password_domain=self.password_domain,
+            subject_domain=state.subject_domain,
+            role_domain=state.effective_roles.role_domain,
+            rule_domain=self.rule_tree.rule_domain_for_resource(Path(resource.name)),
+            password_domain=state.password_domain,
+            effective_roles=state.effective_roles,
         )
         return domain
 
-    def dir_index(self, path: Path) -> ResourceResponse:
-        files = sorted(os.listdir(str(path)))
-        files = [f for f in files if not f.startswith(".")]
+    def dir_index(
+        self,
+        path: Path,
+        resource: str | None = None,
+        username: str | None = None,
+        json_output: bool = False,
+    ) -> ResourceResponse:
+        """
+        List the non-hidden entries of path.
+        If resource is given, only entries that username may GET are listed.
+        """
+        with os.scandir(str(path)) as scan:
+            entries = sorted(
+                (entry for entry in scan if not entry.name.startswith(".")),
+                key=getter("name"),
+            )
+        if resource is not None:
+            entries = self.authorized_entries(resource, entries, username or "")
 
-        def row(f):
-            stat = os.stat(path / f)
+        def row(entry: os.DirEntry) -> list:
+            stat = entry.stat()
             mtime = (
                 datetime.fromtimestamp(stat.st_mtime)
                 .replace(tzinfo=timezone.utc)
                 .isoformat()
             )
-            return [f, stat.st_size, mtime]
+            return [entry.name, stat.st_size, mtime]
 
-        rows = [row(f) for f in files]
+        rows = [row(entry) for entry in entries]
+        if json_output:
+            body = json.dumps(
+                [dict(zip(("name", "size", "mtime"), row)) for row in rows], indent=2
+            )
+            return 200, {"Content-Type": "application/json"}, body.encode()
         tabulate.PRESERVE_WHITESPACE = True
         table = tabulate.tabulate(
             rows, headers=["name", "size", "mtime"], tablefmt="pipe"
         )
         return 200, {"Content-Type": "text/plain"}, (table + "\n").encode()
 
+    def authorized_entries(
+        self, resource: str, entries: List[os.DirEntry], username: str
+    ) -> List[os.DirEntry]:
+        """
+        The entries of the directory resource that username may GET.
+        The directory's rules are filtered by action and roles once;
+        each entry is then decided by one MultiRegex match.
+        """
+        state = self.state
+        user = state.subject_domain.user_by_name(username) if username else None
+        if not user:
+            return []
+        directory = normalize_path(resource).rstrip("/")
+        # Any child of directory has the same rule domain:
+        rule_domain = self.rule_tree.rule_domain_for_resource(Path(f"{directory}/_"))
+        resource_filter = rule_domain.resource_filter(
+            Action("GET"), state.effective_roles.roles_for_user(user)
+        )
+        return [
+            entry
+            for entry in entries
+            if resource_filter.allows(f"{directory}/{entry.name}")
+        ]
+
+
+DOMAIN_FILE_NAMES = ("user.txt", "password.txt", "role.txt")
+
 
 def normalize_path(path: str) -> str:
-    path = re.sub(r"//+", "/", f"/{path}")
-    logging.info("%s", f"{path=}")
-    return path
+    return re.sub(r"//+", "/", f"/{path}")
+
+
+def has_stamp(stamp: tuple, cached: tuple) -> bool:
+    return same_objects(cached[0], stamp)
+
+
+def same_objects(a: tuple, b: tuple) -> bool:
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
 
 
 def status_result(status: int) -> ResourceResponse:
     return status, {"Content-Type": "text/plain"}, f"{status}\n".encode()
 
 
+def put_result(size: int) -> ResourceResponse:
+    return 201, {"Content-Type": "text/plain"}, f"OK : {size} bytes".encode()
+
+
+def stream_result(response: ResourceResponse) -> ResourceStreamResponse:
+    status, headers, body = response
+    return status, headers, StreamBody([body])
+
+
 def file_headers(path: Path) -> dict:
     if stat := os.stat(str(path)):
-        etag = f"{stat.st_dev}-{stat.st_ino}-{stat.st_size}-{stat.st_mtime}"
-        return {
-            "Content-Length": str(stat.st_size),
-            "Content-Type": "application/binary",
-            "ETag": etag,
-            # "Last-Modified":
-        }
+        return stat_headers(stat)
     return {}
+
+
+def stat_headers(stat: os.stat_result) -> dict:
+    etag = f"{stat.st_dev}-{stat.st_ino}-{stat.st_size}-{stat.st_mtime}"
+    return {
+        "Content-Length": str(stat.st_size),
+        "Content-Type": "application/binary",
+        "ETag": f'"{etag}"',
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+    }
@@ -0,0 +1,194 @@
+from pathlib import Path
+import json
+import logging
+import os
+import base64
+import shutil
+import pytest
+from . import app as sut
+
+data_dir = Path("tests/data/rbac")
+
+
+@pytest.fixture(name="app")
+def fixture_app(tmp_path):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    app = sut.App(
+        resource_root=str(tmp_path / "root"),
+        domain_root=str(tmp_path / "domain"),
+    )
+    app.rule_tree.check_interval = app.state_cache.check_interval = 0
+    return app
+
+
+def auth_request(username: str, password: str) -> sut.AuthRequest:
+    basic = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return sut.AuthRequest(f"Basic {basic}", None)
+
+
+def test_decision_cache(app):
+    assert app.is_allowed("PUT", "a/b/x.txt", "frank")[0] is True
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank") == (
+        True,
+        {
+            "permission": "allow",
+            "action": "PUT",
+            "resource": "/a/b/x.txt",
+            "user": "frank",
+            "role": "write-role",
+        },
+    )
+    assert app.decision_cache.stats()["hits"] == 1
+    auth_file = app.resource_root / "a/b/.rbac.txt"
+    auth_file.write_text("rule deny PUT write-role *.txt\n", encoding="utf-8")
+    assert app.is_allowed("PUT", "a/b/x.txt", "frank")[0] is False
+    assert app.decision_cache.stats()["hits"] == 1
+
+
+def resource_request(headers: dict, action: str = "GET") -> sut.ResourceRequest:
+    return sut.ResourceRequest(
+        action, "/a/f1.txt", auth_request("bob", "b0b3r7"), b"", headers
+    )
+
+
+def test_resource_get_conditional(app):
+    content = (app.resource_root / "a/f1.txt").read_bytes()
+    status, headers, body = app.resource_get(resource_request({}))
+    assert (status, body) == (200, content)
+    assert headers["Accept-Ranges"] == "bytes"
+    etag, last_modified = headers["ETag"], headers["Last-Modified"]
+    status, headers, body = app.resource_get(resource_request({"if-none-match": etag}))
+    assert (status, headers, body) == (
+        304,
+        {"ETag": etag, "Last-Modified": last_modified},
+        b"",
+    )
+    request = resource_request({"if-modified-since": last_modified}, "HEAD")
+    assert app.resource_head(request)[0] == 304
+
+
+def test_resource_get_range(app):
+    content = (app.resource_root / "a/f1.txt").read_bytes()
+    size = len(content)
+    status, headers, body = app.resource_get(resource_request({"range": "bytes=2-5"}))
+    assert (status, body) == (206, content[2:6])
+    assert headers["Content-Range"] == f"bytes 2-5/{size}"
+    assert headers["Content-Length"] == "4"
+    request = resource_request({"range": "bytes=0-1,-3"})
+    status, headers, body = app.resource_get(request)
+    assert status == 206
+    boundary = headers["Content-Type"].split("boundary=")[1]
+    assert body.startswith(f"--{boundary}\r\n".encode())
+    assert f"Content-Range: bytes 0-1/{size}\r\n\r\n".encode() + content[:2] in body
+    assert body.endswith(content[-3:] + f"\r\n--{boundary}--\r\n".encode())
+    assert headers["Content-Length"] == str(len(body))
+    status, headers, body = app.resource_get(
+        resource_request({"range": f"bytes={size}-"})
+    )
+    assert (status, headers["Content-Range"]) == (416, f"bytes */{size}")
+
+
+def test_is_allowed_batch(app):
+    checks = [
+        sut.AccessCheck(action, resource)
+        for action in ["GET", "PUT", "DELETE"]
+        for resource in ["/a/b/x.txt", "a/b/y.txt", "/a/f1.txt", "/pub/p", "/.rbac.txt"]
+    ]
+    for username in ["alice", "bob", "frank", "unknown", "nobody", ""]:
+        expected = [app.decide(c.action, c.resource, username) for c in checks]
+        assert app.is_allowed_batch(checks, username) == expected
+        assert app.is_allowed_batch(checks, username) == expected
+    app.max_access_checks = 2
+    assert app.check_access_batch(auth_request("bob", "b0b3r7"), checks)[0] == 413
+
+
+def test_dir_index_is_authorized(app):
+    (app.resource_root / "a/.hidden").write_text("x")
+    auth_file = app.resource_root / "a/.rbac.txt"
+    auth_file.write_text("rule deny GET read-role one*\n" + auth_file.read_text())
+    for name in ["one.txt", "writable.txt", "b2"]:
+        (app.resource_root / "a" / name).write_text("x")
+    names = sorted(
+        name for name in os.listdir(app.resource_root / "a") if not name.startswith(".")
+    )
+    for username in ["alice", "bob", "frank", "tim", "unknown", "nobody"]:
+        expected = [
+            name for name in names if app.decide("GET", f"/a/{name}", username)[0]
+        ]
+        _, _, body = app.dir_index(
+            app.resource_root / "a", "/a/", username, json_output=True
+        )
+        assert [entry["name"] for entry in json.loads(body)] == expected
+        if username == "bob":
+            assert "one.txt" not in expected and "b2" in expected
+    _, headers, body = app.dir_index(app.resource_root / "a")
+    assert headers["Content-Type"] == "text/plain"
+    assert body.decode().splitlines()[0].split() == [
+        "|",
+        "name",
+        "|",
+        "size",
+        "|",
+        "mtime",
+        "|",
+    ]
+    request = sut.ResourceRequest(
+        "GET", "/a", auth_request("tim", "t1mm3rs"), b"", {"accept": "application/json"}
+    )
+    status, headers, body = app.resource_get(request)
+    assert (status, headers["Content-Type"]) == (200, "application/json")
+    assert [entry["name"] for entry in json.loads(body)] == names
+
+
+def test_access_log(app, caplog):
+    caplog.set_level(logging.INFO, logger="devd.rbac.access")
+    request = sut.ResourceRequest(
+        "GET", "/a/f1.txt", auth_request("bob", "b0b3r7"), b""
+    )
+    assert app.resource_get(request)[0] == 200
+    request.auth_request = auth_request("bob", "wrong")
+    assert app.resource_get(request)[0] == 401
+    records = [r for r in caplog.records if r.name == "devd.rbac.access"]
+    assert [(r.access_user, r.access_status) for r in records] == [
+        ("bob", 200),
+        ("", 401),
+    ]
+    assert "wrong" not in caplog.text
+
+
+def test_token_key_rotation(app):
+    old_cookie = app.login(sut.UserPass("bob", "b0b3r7"))
+    assert app.authenticate(sut.AuthRequest(None, old_cookie.value)) == "bob"
+    app.add_token_key(2, "456")
+    new_cookie = app.login(sut.UserPass("bob", "b0b3r7"))
+    assert len(new_cookie.value) < 80
+    assert app.authenticate(sut.AuthRequest(None, old_cookie.value)) == "bob"
+    assert app.authenticate(sut.AuthRequest(None, new_cookie.value)) == "bob"
+    app.authenticator.token_codec.remove_key(1)
+    app.authenticator.revoke_user("bob")
+    assert app.authenticate(sut.AuthRequest(None, old_cookie.value)) == ""
+    assert app.authenticate(sut.AuthRequest(None, new_cookie.value)) == "bob"
+
+
+def test_sessions(tmp_path):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    app = sut.App(
+        resource_root=str(tmp_path / "root"),
+        domain_root=str(tmp_path / "domain"),
+        token_format="session",
+        session_path=str(tmp_path / "sessions.db"),
+    )
+    cookie = app.login(sut.UserPass("bob", "b0b3r7"))
+    assert app.authenticate(sut.AuthRequest(None, cookie.value)) == "bob"
+    app.logout(cookie.value)
+    assert app.authenticate(sut.AuthRequest(None, cookie.value)) == ""
+    cookie = app.login(sut.UserPass("bob", "b0b3r7"))
+    app.authenticator.session_store.close()
+    restarted = sut.App(
+        resource_root=str(tmp_path / "root"),
+        domain_root=str(tmp_path / "domain"),
+        token_format="session",
+        session_path=str(tmp_path / "sessions.db"),
+    )
+    assert restarted.authenticate(sut.AuthRequest(None, cookie.value)) == "bob"
+    restarted.authenticator.session_store.close()
@@ -1,10 +1,15 @@
-from typing import cast
+from typing import Any, Callable, Tuple, cast
 import logging
 import re
 import time
 import base64
+import copy
 from dataclasses import dataclass
 from .cipher import Cipher
+from .session import SessionStore
+from .session_token import TokenCodec
+from . import metrics
+from .cache import LRUCache
 from .credential import BearerToken, UserPass, Cookie
 from .domain import SubjectDomain, PasswordDomain
 
@@ -22,16 +27,44 @@ class Authenticator:
     cipher_key: str
     cookie_name: str
 
+    # pylint: disable-next=too-many-arguments
     def __init__(
         self,
         subject_domain: SubjectDomain,
         password_domain: PasswordDomain,
         cipher_key: str,
         cookie_name: str,
+        *,
+        token_cache_size: int = 10000,
+        token_cache_ttl: float | None = 300.0,
+        token_codec: TokenCodec | None = None,
+        session_store: SessionStore | None = None,
     ):
         self.subject_domain, self.password_domain = subject_domain, password_domain
         self.cipher_key, self.cookie_name = cipher_key, cookie_name
+        self.cipher = Cipher(cipher_key)
+        # If set, secrets are compact tokens, without passwords.
+        # Otherwise they are enciphered by self.cipher:
+        self.token_codec = token_codec
+        # If set, secrets are ids of sessions held here, instead of tokens:
+        self.session_store = session_store
         self.clock = time.time
+        # Verified secrets: secret -> (UserPass, expiry):
+        self.token_cache: LRUCache | None = None
+        if token_cache_size:
+            self.token_cache = LRUCache(token_cache_size, ttl=token_cache_ttl)
+
+    def with_domains(
+        self, subject_domain: SubjectDomain, password_domain: PasswordDomain
+    ) -> "Authenticator":
+        """
+        A copy using other domains,
+        sharing the Cipher, the TokenCodec, the SessionStore and the token cache.
+        """
+        authenticator = copy.copy(self)
+        authenticator.subject_domain = subject_domain
+        authenticator.password_domain = password_domain
+        return authenticator
 
     def authenticate(
         self,
@@ -48,34 +81,39 @@ class Authenticator:
         """
         result = None
         if userpass is not None and not result:
-            result = self.auth_userpass(userpass)
+            result = self.timed_auth("userpass", self.auth_userpass, userpass)
 
         if auth is not None and not result:
             userpass = self.parse_basic(auth)
             if userpass is not None:
-                return self.auth_userpass(userpass)
+                return self.timed_auth("basic", self.auth_userpass, userpass)
             if not result:
                 token = self.parse_bearer(auth)
                 if token is not None:
-                    return self.auth_token(token)
+                    return self.timed_auth("bearer", self.auth_token, token)
 
         if cookie is not None and not result:
-            result = self.auth_cookie(Cookie(self.cookie_name, cookie))
+            result = self.timed_auth(
+                "cookie", self.auth_cookie, Cookie(self.cookie_name, cookie)
+            )
+        return result
+
+    def timed_auth(
+        self, credential: str, func: Callable[[Any], UserPass | None], arg: Any
+    ) -> UserPass | None:
+        """Call func(arg), recording its time and result by credential type."""
+        with metrics.AUTHENTICATION_SECONDS.time(credential):
+            result = func(arg)
+        metrics.AUTHENTICATIONS.inc(credential, "success" if result else "failure")
         return result
 
     def auth_userpass(self, userpass: UserPass) -> UserPass | None:
         """Verify username and password."""
-        logging.debug("%s", f"auth_userpass: {userpass.username=}")
         if not (user := self.subject_domain.user_by_name(userpass.username)):
+            logging.debug("auth_userpass: unknown username=%r", userpass.username)
             return None
-        logging.debug("%s", f"auth_userpass: {user=}")
-        if not (password := self.password_domain.password_for_user(user)):
-            return None
-        matches = (
-            password.username == userpass.username
-            and password.password == userpass.password
-        )
-        logging.debug("%s", f"auth_userpass: {password.username=} {matches=}")
+        matches = self.password_domain.verify_password(user, userpass.password)
+        logging.debug("auth_userpass: username=%r matches=%s", user.name, matches)
         if matches:
             return userpass
         return None
@@ -103,24 +141,87 @@ class Authenticator:
     ###################################################
 
     def auth_request_to_secret(self, auth_request: AuthTokenRequest) -> str:
-        logging.debug("userpass_to_secret %s", f"{auth_request.userpass.username=}")
-        cipher = Cipher(self.cipher_key)
         issued = int(self.clock())
         if auth_request.lifetime:
             expiry = int(issued + auth_request.lifetime)
         else:
             expiry = 0
         logging.info(
-            "userpass_to_secret %s",
-            f"{auth_request.userpass.username=} {issued=} {auth_request.lifetime=} {expiry=}",
+            "userpass_to_secret: username=%r issued=%d lifetime=%r expiry=%d",
+            auth_request.userpass.username,
+            issued,
+            auth_request.lifetime,
+            expiry,
         )
+        if self.session_store is not None:
+            username = auth_request.userpass.username
+            return self.session_store.create(username, expiry).session_id
+        if self.token_codec:
+            return self.token_codec.encode(
+                auth_request.userpass.username, issued, expiry
+            )
         plaintext = f"5:{auth_request.userpass.username}:{issued}:{auth_request.lifetime}:{expiry}:{auth_request.userpass.password}"
-        return cast(str, cipher.encipher(plaintext))
+        return cast(str, self.cipher.encipher(plaintext))
 
     def secret_to_userpass(self, secret: str) -> UserPass | None:
-        logging.info("secret_to_userpass %s", f"{secret=}")
-        cipher = Cipher(self.cipher_key)
-        secret = cast(str, cipher.decipher(secret))
+        """
+        Decode a secret, using the cache of verified secrets.
+        Cached secrets are dropped when their embedded expiry passes.
+        Session ids are looked up in the SessionStore.
+        """
+        if self.session_store is not None:
+            if session := self.session_store.get(secret):
+                return UserPass(session.username, "")
+            return None
+        if self.token_cache is None:
+            return self.decode_secret(secret)[0]
+        if cached := self.token_cache.get(secret):
+            userpass, expiry = cached
+            if not expiry or self.clock() < expiry:
+                return userpass
+            self.token_cache.pop(secret)
+            return None
+        userpass, expiry = self.decode_secret(secret)
+        if userpass:
+            ttl = self.token_cache.ttl
+            if expiry:
+                remaining = max(expiry - self.clock(), 0)
+                ttl = remaining if ttl is None else min(ttl, remaining)
+            self.token_cache.put(secret, (userpass, expiry), ttl=ttl)
+        return userpass
+
+    def revoke_secret(self, secret: str) -> None:
+        """Revoke a session, or evict a secret from the cache of verified secrets."""
+        if self.session_store is not None:
+            self.session_store.revoke(secret)
+        if self.token_cache is not None:
+            self.token_cache.pop(secret)
+
+    def revoke_user(self, username: str) -> int:
+        """Revoke all sessions, and evict all cached secrets, for username."""
+        count = 0
+        if self.session_store is not None:
+            count += self.session_store.revoke_user(username)
+        if self.token_cache is not None:
+            count += self.token_cache.pop_if(
+                lambda _secret, cached: cached[0].username == username
+            )
+        return count
+
+    def decode_secret(self, secret: str) -> Tuple[UserPass | None, int]:
+        """
+        Decipher a secret into its UserPass and expiry (0 if none).
+        The UserPass of a compact token has an empty password.
+        """
+        if self.token_codec:
+            if not (claims := self.token_codec.decode(secret)):
+                return None, 0
+            username, issued, expiry = claims
+            if expiry and self.clock() >= expiry:
+                logging.debug("decode_secret: expired username=%r", username)
+                return None, 0
+            return UserPass(username, ""), expiry
+        secret = cast(str, self.cipher.decipher(secret))
         try:
             n_fields, username, issued_s, lifetime_s, expiry_s, password = secret.split(
                 ":", 5
@@ -131,14 +232,18 @@ class Authenticator:
             expiry = int(expiry_s)
         # pylint: disable-next=bare-except
         except:
-            return None
-        if expiry and lifetime and self.clock() >= expiry:
-            logging.info(
-                "secret_to_userpass %s",
-                f"expired {username=} {issued=} {lifetime=} {expiry=}",
+            return None, 0
+        if not lifetime:
+            expiry = 0
+        if expiry and self.clock() >= expiry:
+            logging.debug(
+                "secret_to_userpass: expired username=%r issued=%d expiry=%d",
+                username,
+                issued,
+                expiry,
             )
-            return None
-        return UserPass(username, password)
+            return None, 0
+        return UserPass(username, password), expiry
 
     ###################################################
 
@@ -146,13 +251,10 @@ class Authenticator:
         if m := re.match(r"^Basic +(\S+)$", auth_header):
             basic_auth = base64.b64decode(m[1]).decode()
             username, password = basic_auth.split(":", 1)
-            logging.debug("%s", f"parse_basic: {username=}")
             return UserPass(username, password)
         return None
 
     def parse_bearer(self, auth_header: str) -> BearerToken | None:
         if m := re.match(r"^Bearer +(\S+)$", auth_header):
-            token = m[1]
-            logging.debug("%s", f"parse_bearer {token=}")
-            return BearerToken(token, "")
+            return BearerToken(m[1], "")
         return None
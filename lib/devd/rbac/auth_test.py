@@ -0,0 +1,55 @@
+from .subject import User
+from .credential import UserPass
+from .domain import SubjectDomain, PasswordDomain
+from .session_token import TokenCodec
+from . import auth as sut
+
+
+def make_authenticator() -> sut.Authenticator:
+    return sut.Authenticator(
+        subject_domain=SubjectDomain(users=[User("bob")]),
+        password_domain=PasswordDomain(passwords=[UserPass("bob", "b0b3r7")]),
+        cipher_key="key",
+        cookie_name="authsession",
+    )
+
+
+def test_token_cache():
+    now = 1000.0
+    authenticator = make_authenticator()
+    authenticator.clock = lambda: now
+    decoded = []
+    decode_secret = authenticator.decode_secret
+
+    def counting_decode_secret(secret):
+        decoded.append(secret)
+        return decode_secret(secret)
+
+    authenticator.decode_secret = counting_decode_secret
+    auth_request = sut.AuthTokenRequest(UserPass("bob", "b0b3r7"), "test", 60)
+    token = authenticator.auth_request_token(auth_request)
+    assert authenticator.auth_token(token) == UserPass("bob", "b0b3r7")
+    assert authenticator.auth_token(token) == UserPass("bob", "b0b3r7")
+    assert len(decoded) == 1
+    authenticator.revoke_secret(token.value)
+    assert authenticator.auth_token(token) == UserPass("bob", "b0b3r7")
+    assert len(decoded) == 2
+    assert authenticator.revoke_user("bob") == 1
+    now += 61
+    assert authenticator.auth_token(token) is None
+    assert len(decoded) == 3
+
+
+def test_compact_tokens():
+    now = 1000.0
+    authenticator = make_authenticator()
+    authenticator.token_codec = TokenCodec({1: "key"})
+    authenticator.clock = lambda: now
+    auth_request = sut.AuthTokenRequest(UserPass("bob", "b0b3r7"), "test", 60)
+    token = authenticator.auth_request_token(auth_request)
+    assert authenticator.token_codec.decode(token.value) == ("bob", 1000, 1060)
+    assert authenticator.decode_secret(token.value) == (UserPass("bob", ""), 1060)
+    assert authenticator.auth_token(token) == UserPass("bob", "")
+    now += 61
+    assert authenticator.decode_secret(token.value) == (None, 0)
+    assert authenticator.auth_token(token) is None
@@ -0,0 +1,558 @@
+"""
+Benchmarks of authorization checks.
+
+  python -m devd.rbac.bench run [--users N ...] [--output results.json]
+  python -m devd.rbac.bench compare BASELINE.json RESULTS.json [--threshold 0.1]
+  python -m devd.rbac.bench memory [--users N ...]
+
+run generates a synthetic domain and resource tree,
+times the hot functions and an end-to-end ASGI load,
+and writes the results as JSON.
+compare reports the change in throughput between two results,
+and fails if any benchmark is slower than the threshold.
+memory reports the bytes held by the loaded domain and rules.
+"""
+
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+import argparse
+import asyncio
+import base64
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from .app import App, AuthRequest, ResourceRequest, AccessCheck
+from .auth import AuthTokenRequest
+from .credential import UserPass
+from .domain import EffectiveRoles
+from .loader import DomainFileLoader, FileSystemLoader
+from .rbac import Request, Action, Resource
+
+ACTIONS = ("GET", "HEAD", "PUT", "DELETE")
+
+
+@dataclass
+class TreeSpec:
+    users: int = 100_000
+    groups: int = 1000
+    roles: int = 200
+    directories: int = 10_000
+    max_depth: int = 12
+    rules_per_directory: int = 4
+    files: int = 1000
+    seed: int = 0
+
+
+@dataclass
+class RunSpec:
+    # Seconds per micro benchmark:
+    min_time: float = 1.0
+    # Requests in the generated workload:
+    requests: int = 1000
+    # Requests of the ASGI load test, and how many are in flight:
+    load_requests: int = 5000
+    concurrency: int = 32
+
+
+@dataclass
+class Workload:
+    """A generated tree, and requests against it."""
+
+    domain_root: Path
+    resource_root: Path
+    # (action, resource path, username, password):
+    requests: List[Tuple[str, str, str, str]] = field(default_factory=list)
+
+
+def generate_tree(root: Path, spec: TreeSpec, n_requests: int = 1000) -> Workload:
+    """
+    Write user.txt, password.txt, role.txt under root/domain
+    and directories with .rbac.txt files under root/root.
+    """
+    rnd = random.Random(spec.seed)
+    domain_root, resource_root = root / "domain", root / "root"
+    users, roles = generate_domain(domain_root, spec, rnd)
+    files = generate_resources(resource_root, spec, rnd, roles)
+    workload = Workload(domain_root, resource_root)
+    for _ in range(n_requests):
+        user = rnd.choice(users)
+        workload.requests.append(
+            (rnd.choice(ACTIONS[:3]), rnd.choice(files), user, f"pw-{user}")
+        )
+    return workload
+
+
+def generate_domain(
+    domain_root: Path, spec: TreeSpec, rnd: random.Random
+) -> Tuple[List[str], List[str]]:
+    """Write the domain files. Returns the user names and role names."""
+    domain_root.mkdir(parents=True, exist_ok=True)
+    groups = [f"group{i}" for i in range(spec.groups)]
+    roles = [f"role{i}" for i in range(spec.roles)]
+    users = [f"user{i}" for i in range(spec.users)]
+    with open(domain_root / "user.txt", "w", encoding="utf-8") as io:
+        for user in users:
+            io.write(f"user {user} {','.join(rnd.sample(groups, rnd.randint(1, 3)))}\n")
+    with open(domain_root / "password.txt", "w", encoding="utf-8") as io:
+        for user in users:
+            io.write(f"password {user} pw-{user}\n")
+    with open(domain_root / "role.txt", "w", encoding="utf-8") as io:
+        for role in roles:
+            members = rnd.sample(groups, min(len(groups), 5))
+            members += [f"@{user}" for user in rnd.sample(users, min(len(users), 2))]
+            io.write(f"member {role} {','.join(members)}\n")
+    return users, roles
+
+
+def generate_resources(
+    resource_root: Path, spec: TreeSpec, rnd: random.Random, roles: List[str]
+) -> List[str]:
+    """Write directories with auth files, and files. Returns the file paths."""
+    resource_root.mkdir(parents=True, exist_ok=True)
+    directories = ["/"]
+    depths = {"/": 0}
+    for i in range(spec.directories):
+        parent = rnd.choice(directories)
+        if depths[parent] >= spec.max_depth:
+            parent = "/"
+        directory = f"{parent.rstrip('/')}/d{i}"
+        directories.append(directory)
+        depths[directory] = depths[parent] + 1
+    for directory in directories:
+        path = resource_root / directory.lstrip("/")
+        path.mkdir(parents=True, exist_ok=True)
+        lines = [
+            random_rule(rnd, roles)
+            for _ in range(rnd.randint(1, spec.rules_per_directory))
+        ]
+        (path / ".rbac.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    files = []
+    for i in range(spec.files):
+        resource = (
+            f"{rnd.choice(directories).rstrip('/')}/f{i}.{rnd.choice(['txt', 'dat'])}"
+        )
+        (resource_root / resource.lstrip("/")).write_bytes(b"x" * rnd.randint(0, 4096))
+        files.append(resource)
+    return files
+
+
+def random_rule(rnd: random.Random, roles: List[str]) -> str:
+    permission = rnd.choice(["allow", "allow", "deny"])
+    action = rnd.choice(["GET,HEAD", "PUT", "*", "GET"])
+    role = rnd.choice(roles + ["*"])
+    resource = rnd.choice(["*", "*.txt", "f1*", "**", "!*.dat", "d*/*"])
+    return f"rule {permission} {action} {role} {resource}"
+
+
+###################################
+
+
+def measure(
+    func: Callable[[Any], Any], args: Sequence[Any], min_time: float = 1.0
+) -> Dict[str, float]:
+    """
+    Call func on each of args, cycling, for at least min_time seconds.
+    One untimed pass first, so that cold caches are not measured.
+    """
+    for arg in args:
+        func(arg)
+    latencies: List[int] = []
+    clock = time.perf_counter_ns
+    deadline = clock() + int(min_time * 1e9)
+    while clock() < deadline or not latencies:
+        for arg in args:
+            start = clock()
+            func(arg)
+            latencies.append(clock() - start)
+    return summarize(latencies)
+
+
+def summarize(latencies: List[int]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    total = sum(latencies)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] / 1e3
+
+    return {
+        "calls": len(latencies),
+        "ops_per_sec": len(latencies) / (total / 1e9) if total else 0.0,
+        "mean_us": total / len(latencies) / 1e3,
+        "p50_us": percentile(0.50),
+        "p90_us": percentile(0.90),
+        "p99_us": percentile(0.99),
+        "max_us": latencies[-1] / 1e3,
+    }
+
+
+def basic_auth(username: str, password: str) -> str:
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+
+
+def micro_benchmarks(app: App, workload: Workload, min_time: float) -> Dict[str, Any]:
+    sample = workload.requests
+    return (
+        find_rules_benchmarks(app, sample, min_time)
+        | authenticate_benchmarks(app, sample, min_time)
+        | access_benchmarks(app, sample, min_time)
+    )
+
+
+def find_rules_benchmarks(
+    app: App, sample: List[Tuple[str, str, str, str]], min_time: float
+) -> Dict[str, Any]:
+    state = app.state
+
+    def find_rules_args(matcher: str) -> Callable[[Any], Any]:
+        def find_rules(arg):
+            request, roles = arg
+            rule_domain = app.rule_tree.rule_domain_for_resource(
+                Path(request.resource.name)
+            )
+            if matcher == "linear" and hasattr(rule_domain, "linear_find_rules"):
+                return rule_domain.linear_find_rules(request, roles)
+            return rule_domain.find_rules(request, roles)
+
+        return find_rules
+
+    find_rules_sample = []
+    for action, resource, user_name, _ in sample:
+        user = state.subject_domain.user_by_name(user_name)
+        find_rules_sample.append(
+            (
+                Request(action=Action(action), resource=Resource(resource), user=user),
+                state.effective_roles.roles_for_user(user),
+            )
+        )
+    return {
+        "find_rules.indexed": measure(
+            find_rules_args("indexed"), find_rules_sample, min_time
+        ),
+        "find_rules.linear": measure(
+            find_rules_args("linear"), find_rules_sample, min_time
+        ),
+    }
+
+
+def authenticate_benchmarks(
+    app: App, sample: List[Tuple[str, str, str, str]], min_time: float
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    authenticator = app.authenticator
+    tokens = [
+        authenticator.auth_request_token(
+            AuthTokenRequest(UserPass(user, password), "bench", None)
+        ).value
+        for _, _, user, password in sample
+    ]
+    results["authenticate.basic"] = measure(
+        lambda arg: authenticator.authenticate(None, basic_auth(*arg), None),
+        [(user, password) for _, _, user, password in sample],
+        min_time,
+    )
+    results["authenticate.bearer"] = measure(
+        lambda token: authenticator.authenticate(None, f"Bearer {token}", None),
+        tokens,
+        min_time,
+    )
+    results["authenticate.bearer.uncached"] = measure(
+        authenticator.decode_secret, tokens, min_time
+    )
+    plaintexts = [f"5:{user}:0:0:0:{password}" for _, _, user, password in sample]
+    results["cipher.encipher"] = measure(
+        authenticator.cipher.encipher, plaintexts, min_time
+    )
+    ciphertexts = [authenticator.cipher.encipher(text) for text in plaintexts]
+    results["cipher.decipher"] = measure(
+        authenticator.cipher.decipher, ciphertexts, min_time
+    )
+    return results
+
+
+def access_benchmarks(
+    app: App, sample: List[Tuple[str, str, str, str]], min_time: float
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+
+    def check_access(arg):
+        action, resource, user, password = arg
+        return app.check_access(
+            ResourceRequest(
+                action, resource, AuthRequest(basic_auth(user, password), None), b""
+            )
+        )
+
+    results["check_access"] = measure(check_access, sample, min_time)
+    decision_cache, app.decision_cache = app.decision_cache, None
+    results["check_access.uncached"] = measure(check_access, sample, min_time)
+    app.decision_cache = decision_cache
+    checks = [AccessCheck(action, resource) for action, resource, _, _ in sample]
+    batches = [(user, checks[i : i + 50]) for i, (_, _, user, _) in enumerate(sample)]
+    results["is_allowed_batch.50"] = measure(
+        lambda arg: app.is_allowed_batch(arg[1], arg[0]), batches, min_time
+    )
+    return results
+
+
+###################################
+
+
+async def asgi_get(api: Any, path: str, headers: List[Tuple[str, str]]) -> int:
+    """Call an ASGI app directly, without a server. Returns the status."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8888),
+    }
+    status = 0
+    sent_request = False
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await api(scope, receive, send)
+    return status
+
+
+def load_test(
+    app: App, workload: Workload, n_requests: int, concurrency: int
+) -> Dict[str, Any]:
+    """GET /__/access/... through the FastAPI app, with Bearer tokens."""
+    # pylint: disable-next=import-outside-toplevel
+    from . import api as api_module
+
+    api_module.app = app
+    tokens: Dict[str, str] = {}
+    for _, _, user, password in workload.requests:
+        if user not in tokens:
+            tokens[user] = app.auth_token(
+                AuthTokenRequest(UserPass(user, password), "bench", None)
+            ).value
+    requests = [
+        (
+            f"/__/access/{action}{resource}",
+            [("authorization", f"Bearer {tokens[user]}")],
+        )
+        for action, resource, user, _ in workload.requests
+    ]
+    latencies: List[int] = []
+    statuses: Dict[int, int] = {}
+
+    async def worker(queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            path, headers = queue.get_nowait()
+            start = time.perf_counter_ns()
+            status = await asgi_get(api_module.api, path, headers)
+            latencies.append(time.perf_counter_ns() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def run() -> float:
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(n_requests):
+            queue.put_nowait(requests[i % len(requests)])
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(queue) for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    result = summarize(latencies)
+    result["ops_per_sec"] = n_requests / elapsed
+    result["concurrency"] = concurrency
+    result["statuses"] = {str(k): v for k, v in sorted(statuses.items())}
+    return result
+
+
+def measure_memory(workload: Workload) -> Dict[str, int]:
+    """
+    Bytes allocated, and still held, by loading each domain file,
+    building EffectiveRoles, and loading all auth files.
+    """
+    domain_root, resource_root = workload.domain_root, workload.resource_root
+    loader = DomainFileLoader()
+    rule_loader = FileSystemLoader(resource_root)
+    auth_dirs = [
+        Path("/") / path.parent.relative_to(resource_root)
+        for path in sorted(resource_root.rglob(rule_loader.auth_file_name))
+    ]
+    held: Dict[str, Any] = {}
+    steps: Dict[str, Callable[[], Any]] = {
+        "users": lambda: loader.load_user_file(domain_root / "user.txt"),
+        "memberships": lambda: loader.load_membership_file(domain_root / "role.txt"),
+        "passwords": lambda: loader.load_password_file(domain_root / "password.txt"),
+        "effective_roles": lambda: EffectiveRoles(held["users"], held["memberships"]),
+        "rules": lambda: [rule_loader.load_rule_set(path) for path in auth_dirs],
+    }
+    result: Dict[str, int] = {}
+    tracemalloc.start()
+    try:
+        for name, step in steps.items():
+            before = tracemalloc.get_traced_memory()[0]
+            held[name] = step()
+            result[name] = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    result["total"] = sum(result.values())
+    return result
+
+
+###################################
+
+
+def run_benchmarks(
+    spec: TreeSpec, run_spec: RunSpec | None = None, work_dir: Path | None = None
+) -> Dict[str, Any]:
+    run_spec = run_spec or RunSpec()
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        start = time.perf_counter()
+        workload = generate_tree(Path(tmp), spec, run_spec.requests)
+        generate_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        app = App(str(workload.resource_root), str(workload.domain_root))
+        startup_seconds = time.perf_counter() - start
+        results = micro_benchmarks(app, workload, run_spec.min_time)
+        results["asgi.access"] = load_test(
+            app, workload, run_spec.load_requests, run_spec.concurrency
+        )
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "spec": asdict(spec),
+            "run_spec": asdict(run_spec),
+            "generate_seconds": generate_seconds,
+            "startup_seconds": startup_seconds,
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    baseline: Dict[str, Any], results: Dict[str, Any], threshold: float = 0.1
+) -> Tuple[List[List[Any]], List[str]]:
+    """
+    Rows of (name, baseline ops/s, ops/s, ratio),
+    and the names of benchmarks slower than baseline by more than threshold.
+    """
+    rows, regressions = [], []
+    for name, result in results["results"].items():
+        if not (base := baseline["results"].get(name)):
+            continue
+        ratio = result["ops_per_sec"] / base["ops_per_sec"]
+        rows.append([name, base["ops_per_sec"], result["ops_per_sec"], ratio])
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv: List[str]) -> int:
+    args = make_parser().parse_args(argv[1:])
+    commands = {
+        "run": run_command,
+        "compare": compare_command,
+        "memory": memory_command,
+    }
+    return commands[args.command](args)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="devd.rbac.bench")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    add_spec_arguments(run, TreeSpec())
+    add_spec_arguments(run, RunSpec())
+    run.add_argument("--output", default="-")
+    cmp = commands.add_parser("compare")
+    cmp.add_argument("baseline")
+    cmp.add_argument("results")
+    cmp.add_argument("--threshold", type=float, default=0.1)
+    memory = commands.add_parser("memory")
+    add_spec_arguments(memory, TreeSpec())
+    return parser
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser, spec: Any) -> None:
+    """An option for each field of the dataclass spec, e.g. --max-depth."""
+    for name, default in asdict(spec).items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=type(default), default=default
+        )
+
+
+def spec_from_args(spec_class: Any, args: argparse.Namespace) -> Any:
+    return spec_class(**{name: getattr(args, name) for name in asdict(spec_class())})
+
+
+def run_command(args: argparse.Namespace) -> int:
+    results = run_benchmarks(
+        spec_from_args(TreeSpec, args), spec_from_args(RunSpec, args)
+    )
+    text = json.dumps(results, indent=2) + "\n"
+    if args.output == "-":
+        sys.stdout.write(text)
+    else:
+        Path(args.output).write_text(text, encoding="utf-8")
+    return 0
+
+
+def compare_command(args: argparse.Namespace) -> int:
+    rows, regressions = compare(
+        json.loads(Path(args.baseline).read_text(encoding="utf-8")),
+        json.loads(Path(args.results).read_text(encoding="utf-8")),
+        args.threshold,
+    )
+    for name, base, ops, ratio in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:28} {base:12.1f} {ops:12.1f} {ratio:6.2f}x{flag}")
+    return 1 if regressions else 0
+
+
+def memory_command(args: argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        usage = measure_memory(
+            generate_tree(Path(tmp), spec_from_args(TreeSpec, args), 0)
+        )
+    for name, size in usage.items():
+        print(f"{name:16} {size / 1e6:10.2f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,36 @@
+from . import bench as sut
+
+
+def test_run_and_compare(tmp_path):
+    spec = sut.TreeSpec(users=50, groups=5, roles=4, directories=20, files=10)
+    run_spec = sut.RunSpec(min_time=0.001, requests=10, load_requests=20, concurrency=4)
+    results = sut.run_benchmarks(spec, run_spec, work_dir=tmp_path)
+    assert results["meta"]["spec"]["users"] == 50
+    names = set(results["results"])
+    assert {"find_rules.indexed", "check_access", "asgi.access"} <= names
+    load = results["results"]["asgi.access"]
+    assert sum(load["statuses"].values()) == 20
+    assert set(load["statuses"]) <= {"200", "401"}
+    rows, regressions = sut.compare(results, results)
+    assert len(rows) == len(names) and not regressions
+    slower = {
+        "results": {
+            name: result | {"ops_per_sec": result["ops_per_sec"] / 2}
+            for name, result in results["results"].items()
+        }
+    }
+    assert sut.compare(results, slower)[1] == list(results["results"])
+
+
+def test_measure_memory(tmp_path):
+    spec = sut.TreeSpec(users=50, groups=5, roles=4, directories=20, files=1)
+    usage = sut.measure_memory(sut.generate_tree(tmp_path, spec, 0))
+    assert set(usage) == {
+        "users",
+        "memberships",
+        "passwords",
+        "effective_roles",
+        "rules",
+        "total",
+    }
+    assert all(size > 0 for size in usage.values())
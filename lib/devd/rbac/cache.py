@@ -0,0 +1,91 @@
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+from collections import OrderedDict
+import threading
+import time
+
+Entry = Tuple[Any, float | None]
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded, least-recently-used cache.
+    Entries expire after ttl seconds, if ttl is set.
+    put() can override the ttl of an entry.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float | None = None):
+        self.max_size, self.ttl = max_size, ttl
+        self.clock: Callable[[], float] = time.monotonic
+        self.entries: OrderedDict[Hashable, Entry] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(
+        self,
+        key: Hashable,
+        default: Any = None,
+        valid: Callable[[Any], bool] | None = None,
+    ) -> Any:
+        """
+        Return the value for key, or default.
+        Expired entries, and entries where valid(value) is false, are removed.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if (expires_at is not None and self.clock() >= expires_at) or (
+                valid and not valid(value)
+            ):
+                del self.entries[key]
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = None if ttl is None else self.clock() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        return entry and entry[0]
+
+    def pop_if(self, pred: Callable[[Hashable, Any], bool]) -> int:
+        """Remove entries where pred(key, value) is true."""
+        with self.lock:
+            keys = [key for key, (value, _) in self.entries.items() if pred(key, value)]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def keys(self) -> List[Hashable]:
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,34 @@
+from . import cache as sut
+
+
+def test_lru_cache():
+    cache = sut.LRUCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.pop("c") == 3
+    assert len(cache) == 1
+    assert cache.stats() == {
+        "size": 1,
+        "max_size": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_lru_cache_ttl():
+    now = 100.0
+    cache = sut.LRUCache(max_size=10, ttl=5)
+    cache.clock = lambda: now
+    cache.put("a", 1)
+    cache.put("b", 2, ttl=20)
+    now += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.pop_if(lambda key, value: value == 2) == 1
+    assert cache.get("b") is None
@@ -1,4 +1,4 @@
-from typing import Any, Iterable
+from typing import Any, Callable, Dict, Iterable, Tuple
 import base64
 import hashlib
 import hmac
@@ -7,14 +7,26 @@ import random
 import zlib
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .metrics import PHASE_SECONDS
 
 
 Data = str | bytes
 Step = str
 Steps = Iterable[Step]
+Coder = Callable[[Any], Any]
+Pipeline = Tuple[Coder, ...]
+
+ENCIPHER_SECONDS = PHASE_SECONDS.labels("cipher.encipher")
+DECIPHER_SECONDS = PHASE_SECONDS.labels("cipher.decipher")
 
 
 class Cipher:
+    """
+    Instances are long-lived and thread-safe:
+    padded keys, cipher primitives and step pipelines are built once
+    and cached.
+    """
+
     def __init__(
         self,
         key: str,
@@ -32,6 +44,10 @@ class Cipher:
         self.hash_name = hash_name
         self.salt_length_range = range(0, 16)
         self.field_separator = b"\t"
+        self.coder_table = self.make_coders()
+        self.pipelines: Dict[Tuple[Tuple[Step, ...], int], Pipeline] = {}
+        self.primitives: Dict[Tuple[str, str], Any] = {}
+        self.padded_keys: Dict[Tuple[str, int], bytes] = {}
 
     ###################################################
     # Hashing
@@ -61,11 +77,13 @@ class Cipher:
 
     def encipher(self, data: Data) -> Data:
         """Encipher arbitrary data."""
-        return self.coders_apply(self.cipher_steps(), 0, data)
+        with ENCIPHER_SECONDS.time():
+            return self.coders_apply(self.cipher_steps(), 0, data)
 
     def decipher(self, data: Data) -> Data:
         """Decipher data enciphered above."""
-        return self.coders_apply(self.cipher_steps(), 1, data)
+        with DECIPHER_SECONDS.time():
+            return self.coders_apply(self.cipher_steps(), 1, data)
 
     def cipher_steps(self) -> Steps:
         return (
@@ -81,15 +99,26 @@ class Cipher:
     ###################################################
 
     def coders_apply(self, steps: Iterable[str], direction: int, data: Data) -> Data:
-        if direction == 1:
-            steps = reversed(tuple(steps))
-        coders = self.coders()
         value: Any = data
-        for step in steps:
-            value = coders[step][direction](value)
+        for coder in self.pipeline(tuple(steps), direction):
+            value = coder(value)
         return value
 
+    def pipeline(self, steps: Tuple[Step, ...], direction: int) -> Pipeline:
+        key = (steps, direction)
+        if (pipeline := self.pipelines.get(key)) is None:
+            if direction == 1:
+                steps = tuple(reversed(steps))
+            coders = self.coders()
+            pipeline = self.pipelines[key] = tuple(
+                coders[step][direction] for step in steps
+            )
+        return pipeline
+
     def coders(self):
+        return self.coder_table
+
+    def make_coders(self):
         return {
             "str_encode": (str_encode, str_decode),
             "check_bytes": (is_bytes, is_bytes),
@@ -138,12 +167,12 @@ class Cipher:
         )
         salted_data_len = len(salted_data)
         self.check_cipher_name(cipher_name)
+        if cipher_name != self.cipher_name:
+            raise ValueError(f"Cipher: {cipher_name=} != {self.cipher_name=}")
         if data_length < 0:
             raise ValueError("Cipher: {data_length=} < 0")
         if salted_data_len < data_length:
             raise ValueError("Cipher: {salted_data_len=} < {data_length=}")
-        self.frame_version = frame_version
-        self.cipher_name = cipher_name
         return salted_data[:data_length]
 
     def check_frame_version(self, frame_version: str):
@@ -185,10 +214,10 @@ class Cipher:
             # AESGCM key must be 128, 192, or 256 bits.
             # GCM mode needs 12 nonce bytes:
             nonce = secrets.token_bytes(12)
-            return nonce + AESGCM(self.key_padded(256)).encrypt(nonce, data, b"")
+            return nonce + self.primitive().encrypt(nonce, data, b"")
         if self.cipher_name == "Fernet":
             # Fernet key must be 256 bits.
-            return Fernet(self.key_padded(256)).encrypt(data)
+            return self.primitive().encrypt(data)
         self.check_cipher_name(self.cipher_name)
         return b""
 
@@ -198,12 +227,25 @@ class Cipher:
         Pad self.key as needed.
         """
         if self.cipher_name == "AESGCM-256":
-            return AESGCM(self.key_padded(256)).decrypt(data[:12], data[12:], b"")
+            return self.primitive().decrypt(data[:12], data[12:], b"")
         if self.cipher_name == "Fernet":
-            return Fernet(self.key_padded(256)).decrypt(data)
+            return self.primitive().decrypt(data)
         self.check_cipher_name(self.cipher_name)
         return b""
 
+    def primitive(self) -> Any:
+        """The AESGCM or Fernet object for self.cipher_name and self.key."""
+        key = (self.cipher_name, self.key)
+        if (primitive := self.primitives.get(key)) is None:
+            if self.cipher_name == "AESGCM-256":
+                primitive = AESGCM(self.key_padded(256))
+            elif self.cipher_name == "Fernet":
+                primitive = Fernet(self.key_padded(256))
+            else:
+                self.check_cipher_name(self.cipher_name)
+            self.primitives[key] = primitive
+        return primitive
+
     def key_padded(self, n_bits: int) -> bytes:
         """
         Repeat self.key to fill n_bits.
@@ -212,12 +254,17 @@ class Cipher:
         assert n_bits % 8 == 0
         n_bytes: int = n_bits // 8
         self.check_frame_version(self.frame_version)
-        key = str_encode(self.key)
-        if not key:
-            return b"\0" * n_bytes
-        if len(key) < n_bytes:
-            key += key * n_bytes
-        return key[:n_bytes]
+        cache_key = (self.key, n_bits)
+        if (padded := self.padded_keys.get(cache_key)) is None:
+            key = str_encode(self.key)
+            if not key:
+                padded = b"\0" * n_bytes
+            else:
+                if len(key) < n_bytes:
+                    key += key * n_bytes
+                padded = key[:n_bytes]
+            self.padded_keys[cache_key] = padded
+        return padded
 
     def check_cipher_name(self, cipher_name: str) -> str:
         if cipher_name not in self.valid_cipher_names():
@@ -37,3 +37,13 @@ def test_hash():
     assert data_hash_2 == data_hash_1
     assert data_hash_3 != data_hash_1
     assert data_hash_4 != data_hash_1
+
+
+def test_cipher_reuse():
+    cipher = sut.Cipher("secret-key")
+    data_enc = cipher.encipher("data")
+    primitive = cipher.primitive()
+    assert cipher.decipher(data_enc) == "data"
+    assert cipher.decipher(cipher.encipher("data")) == "data"
+    assert cipher.primitive() is primitive
+    assert len(cipher.pipelines) == 2
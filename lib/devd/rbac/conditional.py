@@ -0,0 +1,134 @@
+"""
+HTTP conditional and range requests: RFC 9110, sections 13 and 14.
+Request header names are expected in lower case.
+"""
+
+from typing import Dict, List, Tuple
+from pathlib import Path
+from email.utils import formatdate, parsedate_to_datetime
+import secrets
+from .stream import StreamBody, FileSegment, BodyPart
+
+Headers = Dict[str, str]
+# Inclusive (first, last) byte positions:
+ByteRange = Tuple[int, int]
+
+MAX_RANGES = 32
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: str) -> float | None:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match or If-Range header with etag."""
+    if header.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def not_modified(headers: Headers, etag: str, mtime: float) -> bool:
+    """True if a GET or HEAD can be answered with 304 Not Modified."""
+    if (if_none_match := headers.get("if-none-match")) is not None:
+        return etag_matches(if_none_match, etag)
+    if (if_modified_since := headers.get("if-modified-since")) is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def request_ranges(
+    headers: Headers, etag: str, mtime: float, size: int
+) -> List[ByteRange] | None:
+    """
+    The satisfiable byte ranges of a Range header.
+    Returns None if the whole representation should be sent:
+    no Range, an If-Range that does not match, or an invalid Range.
+    Returns [] if no range is satisfiable.
+    """
+    if (header := headers.get("range")) is None:
+        return None
+    if (if_range := headers.get("if-range")) is not None:
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # Strong comparison is required for If-Range:
+            if if_range.strip() != etag or etag.startswith("W/"):
+                return None
+        elif parse_http_date(if_range) != int(mtime):
+            return None
+    return parse_range(header, size)
+
+
+def parse_range(header: str, size: int) -> List[ByteRange] | None:
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    ranges: List[ByteRange] = []
+    for spec in specs.split(","):
+        first_s, dash, last_s = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first_s:
+                first = int(first_s)
+                last = int(last_s) if last_s else size - 1
+                if last_s and last < first:
+                    return None
+            else:
+                suffix = int(last_s)
+                first, last = max(size - suffix, 0), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if first < size:
+            ranges.append((first, min(last, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return coalesce_ranges(ranges)
+
+
+def coalesce_ranges(ranges: List[ByteRange]) -> List[ByteRange]:
+    """
+    Ranges in ascending order, with overlapping and adjacent ranges merged,
+    so that no byte is sent twice (RFC 9110, section 14.2).
+    """
+    result: List[ByteRange] = []
+    for first, last in sorted(ranges):
+        if result and first <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], last))
+        else:
+            result.append((first, last))
+    return result
+
+
+def content_range(byte_range: ByteRange, size: int) -> str:
+    return f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+
+
+def byteranges_body(
+    path: Path, ranges: List[ByteRange], size: int, content_type: str
+) -> Tuple[str, StreamBody]:
+    """The Content-Type and body of a multipart/byteranges response."""
+    boundary = secrets.token_hex(16)
+    parts: List[BodyPart] = []
+    for byte_range in ranges:
+        first, last = byte_range
+        parts.append(
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: {content_range(byte_range, size)}\r\n\r\n"
+            ).encode()
+        )
+        parts.append(FileSegment(path, first, last - first + 1))
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return f"multipart/byteranges; boundary={boundary}", StreamBody(parts)
@@ -0,0 +1,46 @@
+from . import conditional as sut
+
+
+def test_parse_range():
+    assert sut.parse_range("bytes=0-9", 100) == [(0, 9)]
+    assert sut.parse_range("bytes=90-", 100) == [(90, 99)]
+    assert sut.parse_range("bytes=-10", 100) == [(90, 99)]
+    assert sut.parse_range("bytes=-200", 100) == [(0, 99)]
+    assert sut.parse_range("bytes=0-0, 50-150", 100) == [(0, 0), (50, 99)]
+    assert sut.parse_range("bytes=100-", 100) == []
+    assert sut.parse_range("bytes=5-1", 100) is None
+    assert sut.parse_range("bytes=a-b", 100) is None
+    assert sut.parse_range("lines=1-2", 100) is None
+
+
+def test_parse_range_coalesces():
+    assert sut.parse_range("bytes=0-9, 5-19, 20-29", 100) == [(0, 29)]
+    assert sut.parse_range("bytes=50-59, 0-9, 2-3", 100) == [(0, 9), (50, 59)]
+    assert sut.parse_range("bytes=-10, 0-", 100) == [(0, 99)]
+    assert sut.parse_range("bytes=0-0, 2-2", 100) == [(0, 0), (2, 2)]
+
+
+def test_not_modified():
+    etag, mtime = '"1-2-3-4.5"', 1700000000.5
+    assert sut.not_modified({"if-none-match": etag}, etag, mtime)
+    assert sut.not_modified({"if-none-match": f'"x", W/{etag}'}, etag, mtime)
+    assert sut.not_modified({"if-none-match": "*"}, etag, mtime)
+    assert not sut.not_modified({"if-none-match": '"x"'}, etag, mtime)
+    since = sut.http_date(mtime)
+    assert sut.not_modified({"if-modified-since": since}, etag, mtime)
+    assert not sut.not_modified(
+        {"if-modified-since": sut.http_date(mtime - 10)}, etag, mtime
+    )
+    assert not sut.not_modified(
+        {"if-none-match": '"x"', "if-modified-since": since}, etag, mtime
+    )
+
+
+def test_request_ranges_if_range():
+    etag, mtime = '"1-2-3-4.5"', 1700000000.5
+    headers = {"range": "bytes=0-9", "if-range": etag}
+    assert sut.request_ranges(headers, etag, mtime, 100) == [(0, 9)]
+    headers["if-range"] = '"other"'
+    assert sut.request_ranges(headers, etag, mtime, 100) is None
+    headers["if-range"] = sut.http_date(mtime)
+    assert sut.request_ranges(headers, etag, mtime, 100) == [(0, 9)]
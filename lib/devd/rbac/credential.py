@@ -7,19 +7,19 @@ CookieName = str
 CookieValue = str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class UserPass:
     username: Username
     password: Password
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BearerToken:
     value: str
     description: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Cookie:
     name: CookieName
     value: CookieValue
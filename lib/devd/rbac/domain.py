@@ -1,32 +1,113 @@
+from typing import Any, Callable, Dict, List, Self, Set, Tuple
 from dataclasses import dataclass, field
+import hmac
+import secrets
 from .subject import User, Users, Group, Groups, Subject
 from .credential import UserPass, UserPasses, BearerTokens
-from .rbac import Role, Roles, Membership, Memberships, Rule, Rules, Request
-from .util import find
+from .rbac import (
+    Action,
+    Role,
+    Roles,
+    RoleSet,
+    Membership,
+    Memberships,
+    Rule,
+    Rules,
+    RuleSet,
+    Request,
+    roles_match,
+)
+from .util import find, getter, mapcat
+from .cache import LRUCache
+from .password_hash import check_password
+from .metrics import PHASE_SECONDS, RULES_EVALUATED
+
+ROLES_COMPUTE_SECONDS = PHASE_SECONDS.labels("roles")
+ROLES_REBUILD_SECONDS = PHASE_SECONDS.labels("roles.rebuild")
 
 
 @dataclass
 class SubjectDomain:
+    """
+    Users and Groups, indexed by name.
+    Use the add_*/remove_* methods to keep the indexes consistent,
+    or call reindex() after mutating users or groups directly.
+    """
+
     users: Users = field(default_factory=list)
     groups: Groups = field(default_factory=list)
+    user_index: Dict[str, User] = field(init=False, repr=False, compare=False)
+    group_index: Dict[str, Group] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.reindex()
+
+    def reindex(self) -> None:
+        self.users, self.groups = list(self.users), list(self.groups)
+        self.user_index = index_by(name_of, self.users)
+        self.group_index = index_by(name_of, self.groups)
 
     def user_by_name(self, name: str) -> User:
-        return find(lambda x: x.name == name, self.users)
+        return self.user_index.get(name)
 
     def group_by_name(self, name: str) -> Group:
-        return find(lambda x: x.name == name, self.groups)
+        return self.group_index.get(name)
 
     def groups_for_user(self, user: User) -> Groups:
         return user.groups
 
+    def current(self) -> "SubjectDomain":
+        """The SubjectDomain in effect: itself, unless it swaps in snapshots."""
+        return self
+
+    def add_user(self, user: User) -> None:
+        add_indexed(self.users, self.user_index, name_of, user)
+
+    def remove_user(self, user: User) -> None:
+        remove_indexed(self.users, self.user_index, name_of, user)
+
+    def add_group(self, group: Group) -> None:
+        add_indexed(self.groups, self.group_index, name_of, group)
+
+    def remove_group(self, group: Group) -> None:
+        remove_indexed(self.groups, self.group_index, name_of, group)
+
+
+SubjectKey = Tuple[type, str]
+
+
+def subject_key(subject: Subject) -> SubjectKey:
+    return type(subject), subject.name
+
 
 @dataclass
 class RoleDomain:
+    """
+    Roles and Memberships, indexed by role name and by member.
+    Use the add_*/remove_* methods to keep the indexes consistent,
+    or call reindex() after mutating memberships or roles directly.
+    """
+
     memberships: Memberships = field(default_factory=list)
     roles: Roles = field(default_factory=list)
+    role_index: Dict[str, Role] = field(init=False, repr=False, compare=False)
+    membership_index: Dict[SubjectKey, Tuple[Membership, ...]] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.reindex()
+
+    def reindex(self) -> None:
+        self.memberships, self.roles = list(self.memberships), list(self.roles)
+        self.role_index = index_by(name_of, self.roles)
+        index: Dict[SubjectKey, List[Membership]] = {}
+        for membership in self.memberships:
+            index.setdefault(subject_key(membership.member), []).append(membership)
+        self.membership_index = {key: tuple(val) for key, val in index.items()}
 
     def role_by_name(self, name: str) -> Role:
-        return find(lambda x: x.name == name, self.roles)
+        return self.role_index.get(name)
 
     def roles_for_user(self, user: User) -> Roles:
         roles = [memb.role for memb in self.memberships_for_subject(user)]
@@ -38,28 +119,52 @@ class RoleDomain:
         return [memb.role for memb in self.memberships_for_subject(group)]
 
     def memberships_for_subject(self, member: Subject) -> Memberships:
-        def pred(membership: Membership) -> bool:
-            return (
-                isinstance(membership.member, type(member))
-                and membership.member.name == member.name
-            )
-
-        return [membership for membership in self.memberships if pred(membership)]
+        return self.membership_index.get(subject_key(member), ())
+
+    def add_role(self, role: Role) -> None:
+        add_indexed(self.roles, self.role_index, name_of, role)
+
+    def remove_role(self, role: Role) -> None:
+        remove_indexed(self.roles, self.role_index, name_of, role)
+
+    def add_membership(self, membership: Membership) -> None:
+        self.memberships.append(membership)
+        key = subject_key(membership.member)
+        self.membership_index[key] = self.membership_index.get(key, ()) + (membership,)
+
+    def remove_membership(self, membership: Membership) -> None:
+        self.memberships.remove(membership)
+        key = subject_key(membership.member)
+        remaining = tuple(
+            memb
+            for memb in self.membership_index.get(key, ())
+            if memb is not membership
+        )
+        if remaining:
+            self.membership_index[key] = remaining
+        else:
+            self.membership_index.pop(key, None)
 
 
 @dataclass
 class RuleDomain:
     rules: Rules = field(default_factory=list)
 
+    @classmethod
+    def from_rule_sets(cls, rule_sets: List[RuleSet]) -> Self:
+        return cls(rules=mapcat(getter("rules"), rule_sets))
+
     def find_rules(
         self, request: Request, roles: Roles, max_rules: int | None = None
     ) -> Rules:
-        rules = []
+        rules, evaluated = [], 0
         for rule in self.rules:
+            evaluated += 1
             if self.rule_matches(request, roles, rule):
                 rules.append(rule)
                 if max_rules and len(rules) >= max_rules:
                     break
+        RULES_EVALUATED.observe(evaluated)
         return rules
 
     def rule_matches(self, request: Request, roles: Roles, rule: Rule) -> bool:
@@ -67,21 +172,196 @@ class RuleDomain:
             return False
         if not rule.resource.matches(request.resource):
             return False
-        for role in roles:
-            if rule.role.matches(role):
-                return True
-        return False
+        return roles_match(rule.role, roles)
+
+    def resource_filter(self, action: Action, roles: Roles) -> "ResourceFilter":
+        return ResourceFilter(
+            [
+                rule
+                for rule in self.rules
+                if rule.action.matches(action) and roles_match(rule.role, roles)
+            ]
+        )
+
+
+class ResourceFilter:
+    """
+    The Rules for one Action and set of Roles, in order.
+    The first Rule matching a resource path is found
+    by one match of the MultiRegex of their Resource patterns.
+    """
+
+    def __init__(self, rules: Rules):
+        self.rule_set = RuleSet(rules=list(rules))
+
+    def first_rule(self, resource_path: str) -> Rule | None:
+        if not (mask := self.rule_set.resource_regex.match_mask(resource_path)):
+            return None
+        return self.rule_set.rules[(mask & -mask).bit_length() - 1]
+
+    def allows(self, resource_path: str) -> bool:
+        rule = self.first_rule(resource_path)
+        return rule is not None and rule.permission.name == "allow"
 
 
 @dataclass
 class PasswordDomain:
+    """
+    UserPasses, indexed by username.
+    Passwords are plaintext or scrypt hashes: see password_hash.
+    Use add_password/remove_password to keep the index consistent,
+    or call reindex() after mutating passwords directly.
+
+    Successful verifications are cached for verified_ttl seconds,
+    so that clients sending Basic auth on each request
+    pay for the hash once per TTL.
+    The cache is keyed by an HMAC of the username and password,
+    with a key that is never stored.
+    Failures are not cached.
+    """
+
     passwords: UserPasses = field(default_factory=list)
+    password_index: Dict[str, UserPass] = field(init=False, repr=False, compare=False)
+    verified_size: int = field(default=10000, repr=False, compare=False)
+    verified_ttl: float = field(default=60.0, repr=False, compare=False)
+    # HMAC(username, password) -> the UserPass verified against:
+    verified: LRUCache | None = field(init=False, repr=False, compare=False)
+    verified_key: bytes = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.verified = None
+        if self.verified_size and self.verified_ttl:
+            self.verified = LRUCache(self.verified_size, ttl=self.verified_ttl)
+        self.verified_key = secrets.token_bytes(32)
+        self.reindex()
+
+    def reindex(self) -> None:
+        self.passwords = list(self.passwords)
+        self.password_index = index_by(username_of, self.passwords)
 
     def password_for_user(self, user: User) -> UserPass | None:
-        for password in self.passwords:
-            if password.username == user.name:
-                return password
-        return None
+        return self.password_index.get(user.name)
+
+    def verify_password(self, user: User, password: str) -> bool:
+        if not (expected := self.password_for_user(user)):
+            return False
+        if self.verified is None:
+            return check_password(expected.password, password)
+        key = hmac.digest(
+            self.verified_key,
+            f"{len(user.name)}:{user.name}:{password}".encode(),
+            "sha256",
+        )
+        # Valid only while the entry it was verified against is current:
+        if self.verified.get(key, valid=lambda verified: verified is expected):
+            return True
+        if not check_password(expected.password, password):
+            return False
+        self.verified.put(key, expected)
+        return True
+
+    def add_password(self, password: UserPass) -> None:
+        add_indexed(self.passwords, self.password_index, username_of, password)
+
+    def remove_password(self, password: UserPass) -> None:
+        remove_indexed(self.passwords, self.password_index, username_of, password)
+
+
+class EffectiveRoles:
+    """
+    Materialized table of each User's Roles,
+    directly and through the User's Groups.
+    Roles are canonicalized by name through the RoleDomain.
+    Use the add_*/remove_* methods to update the domains and
+    the table incrementally, or call rebuild().
+    Users with the same Roles share one RoleSet, interned by its bitset,
+    and users with the same Groups share one tuple of their names.
+    """
+
+    subject_domain: SubjectDomain
+    role_domain: RoleDomain
+    roles_by_user: Dict[str, RoleSet]
+    groups_by_user: Dict[str, Tuple[str, ...]]
+    users_by_group: Dict[str, Set[str]]
+    role_sets: Dict[int, RoleSet]
+    group_names: Dict[Tuple[str, ...], Tuple[str, ...]]
+
+    def __init__(self, subject_domain: SubjectDomain, role_domain: RoleDomain):
+        self.subject_domain, self.role_domain = subject_domain, role_domain
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        self.roles_by_user, self.groups_by_user, self.users_by_group = {}, {}, {}
+        self.role_sets, self.group_names = {}, {}
+        with ROLES_REBUILD_SECONDS.time():
+            for user in self.subject_domain.users:
+                self.user_changed(user)
+
+    def roles_for_user(self, user: User) -> RoleSet:
+        roles = self.roles_by_user.get(user.name)
+        if roles is None or self.subject_domain.user_by_name(user.name) is not user:
+            with ROLES_COMPUTE_SECONDS.time():
+                return self.compute(user)
+        return roles
+
+    def compute(self, user: User) -> RoleSet:
+        role_by_name: Dict[str, Role] = {}
+        for role in self.role_domain.roles_for_user(user):
+            role_by_name.setdefault(role.name, role)
+        roles = RoleSet(
+            self.role_domain.role_by_name(name) or role
+            for name, role in role_by_name.items()
+        )
+        return self.role_sets.setdefault(roles.bits, roles)
+
+    ##############################
+
+    def user_changed(self, user: User) -> None:
+        self.user_removed(user.name)
+        if self.subject_domain.user_by_name(user.name) is not user:
+            return
+        self.roles_by_user[user.name] = self.compute(user)
+        names = tuple(group.name for group in user.groups)
+        self.groups_by_user[user.name] = self.group_names.setdefault(names, names)
+        for group in user.groups:
+            self.users_by_group.setdefault(group.name, set()).add(user.name)
+
+    def user_removed(self, name: str) -> None:
+        self.roles_by_user.pop(name, None)
+        for group_name in self.groups_by_user.pop(name, ()):
+            self.users_by_group.get(group_name, set()).discard(name)
+
+    def membership_changed(self, membership: Membership) -> None:
+        member = membership.member
+        if isinstance(member, Group):
+            names = tuple(self.users_by_group.get(member.name, ()))
+        else:
+            names = (member.name,)
+        for name in names:
+            if user := self.subject_domain.user_by_name(name):
+                self.user_changed(user)
+
+    ##############################
+
+    def add_user(self, user: User) -> None:
+        self.subject_domain.add_user(user)
+        self.user_changed(user)
+
+    def remove_user(self, user: User) -> None:
+        self.subject_domain.remove_user(user)
+        self.user_removed(user.name)
+        if other := self.subject_domain.user_by_name(user.name):
+            self.user_changed(other)
+
+    def add_membership(self, membership: Membership) -> None:
+        if not self.role_domain.role_by_name(membership.role.name):
+            self.role_domain.add_role(membership.role)
+        self.role_domain.add_membership(membership)
+        self.membership_changed(membership)
+
+    def remove_membership(self, membership: Membership) -> None:
+        self.role_domain.remove_membership(membership)
+        self.membership_changed(membership)
 
 
 @dataclass
@@ -102,10 +382,11 @@ class Domain:
     role_domain: RoleDomain
     rule_domain: RuleDomain
     password_domain: PasswordDomain
+    effective_roles: EffectiveRoles | None = field(default=None)
 
     def find_rules(self, request: Request, max_rules: int | None = None) -> Rules:
         return self.rule_domain.find_rules(
-            request, self.role_domain.roles_for_user(request.user), max_rules
+            request, self.roles_for_user(request.user), max_rules
         )
 
     def user_for_name(self, name: str) -> User:
@@ -121,6 +402,8 @@ class Domain:
         return self.role_domain.role_by_name(name)
 
     def roles_for_user(self, user: User) -> Roles:
+        if self.effective_roles:
+            return self.effective_roles.roles_for_user(user)
         roles = [memb.role for memb in self.memberships_for_subject(user)]
         for group in user.groups:
             roles.extend([memb.role for memb in self.memberships_for_subject(group)])
@@ -142,3 +425,41 @@ class Solver:
 
     def find_rules(self, request: Request, max_rules: int | None = None) -> Rules:
         return self.domain.find_rules(request, max_rules)
+
+
+########################################
+# Indexes keep the first item for a key, like util.find.
+
+Key = Callable[[Any], str]
+
+
+def name_of(obj: Any) -> str:
+    return obj.name
+
+
+def username_of(obj: Any) -> str:
+    return obj.username
+
+
+def index_by(key: Key, items: List[Any]) -> Dict[str, Any]:
+    index: Dict[str, Any] = {}
+    for item in items:
+        index.setdefault(key(item), item)
+    return index
+
+
+def add_indexed(items: List[Any], index: Dict[str, Any], key: Key, item: Any) -> None:
+    items.append(item)
+    index.setdefault(key(item), item)
+
+
+def remove_indexed(
+    items: List[Any], index: Dict[str, Any], key: Key, item: Any
+) -> None:
+    items.remove(item)
+    name = key(item)
+    if index.get(name) is item:
+        if other := find(lambda x: key(x) == name, items):
+            index[name] = other
+        else:
+            del index[name]
@@ -0,0 +1,102 @@
+from .subject import User, Group
+from .credential import UserPass
+from .rbac import Role, Membership
+from .password_hash import hash_password, check_password
+from . import domain as sut
+
+
+def test_subject_domain_index():
+    alice, bob = User("alice"), User("bob")
+    subject_domain = sut.SubjectDomain(users=[alice], groups=[Group("Admins")])
+    assert subject_domain.user_by_name("alice") is alice
+    assert subject_domain.user_by_name("bob") is None
+    subject_domain.add_user(bob)
+    assert subject_domain.user_by_name("bob") is bob
+    subject_domain.remove_user(alice)
+    assert subject_domain.user_by_name("alice") is None
+    assert subject_domain.group_by_name("Admins").name == "Admins"
+    subject_domain.groups.append(Group("Readers"))
+    subject_domain.reindex()
+    assert subject_domain.group_by_name("Readers").name == "Readers"
+
+
+def test_role_domain_index():
+    admin, read = Role("admin-role"), Role("read-role")
+    memb_1 = Membership(role=admin, member=Group("Admins"))
+    memb_2 = Membership(role=read, member=User("Admins"))
+    role_domain = sut.RoleDomain(memberships=[memb_1, memb_2], roles=[admin, read])
+    assert role_domain.role_by_name("read-role") is read
+    assert list(role_domain.memberships_for_subject(Group("Admins"))) == [memb_1]
+    assert list(role_domain.memberships_for_subject(User("Admins"))) == [memb_2]
+    memb_3 = Membership(role=read, member=Group("Admins"))
+    role_domain.add_membership(memb_3)
+    assert role_domain.roles_for_group(Group("Admins")) == [admin, read]
+    role_domain.remove_membership(memb_1)
+    assert role_domain.roles_for_group(Group("Admins")) == [read]
+
+
+def test_password_domain_index():
+    password_domain = sut.PasswordDomain(passwords=[UserPass("bob", "1")])
+    password_domain.add_password(UserPass("bob", "2"))
+    assert password_domain.password_for_user(User("bob")).password == "1"
+    password_domain.remove_password(password_domain.passwords[0])
+    assert password_domain.password_for_user(User("bob")).password == "2"
+
+
+def test_password_domain_verified_cache(monkeypatch):
+    hashed = hash_password("s3cret", n=2**4)
+    password_domain = sut.PasswordDomain(passwords=[UserPass("bob", hashed)])
+    calls = []
+
+    def counting_check_password(stored, password):
+        calls.append(password)
+        return check_password(stored, password)
+
+    monkeypatch.setattr(sut, "check_password", counting_check_password)
+    bob = User("bob")
+    assert password_domain.verify_password(bob, "s3cret")
+    assert password_domain.verify_password(bob, "s3cret")
+    assert not password_domain.verify_password(bob, "wrong")
+    assert not password_domain.verify_password(bob, "wrong")
+    assert calls == ["s3cret", "wrong", "wrong"]
+    # A changed entry is verified again:
+    password_domain.remove_password(password_domain.passwords[0])
+    password_domain.add_password(UserPass("bob", "plain"))
+    assert not password_domain.verify_password(bob, "s3cret")
+    assert password_domain.verify_password(bob, "plain")
+
+
+def test_effective_roles():
+    admins, readers = Group("Admins"), Group("Readers")
+    alice, bob = User("alice", groups=[admins]), User("bob", groups=[readers])
+    admin, read = Role("admin-role"), Role("read-role")
+    subject_domain = sut.SubjectDomain(users=[alice, bob], groups=[admins, readers])
+    role_domain = sut.RoleDomain(
+        memberships=[
+            Membership(role=admin, member=admins),
+            Membership(role=Role("admin-role"), member=User("alice")),
+        ],
+        roles=[admin, read],
+    )
+    effective_roles = sut.EffectiveRoles(subject_domain, role_domain)
+    assert effective_roles.roles_for_user(alice) == {admin}
+    assert effective_roles.roles_for_user(alice).names == {"admin-role"}
+    assert effective_roles.roles_for_user(bob) == set()
+    membership = Membership(role=read, member=readers)
+    effective_roles.add_membership(membership)
+    assert effective_roles.roles_for_user(bob) == {read}
+    effective_roles.remove_membership(membership)
+    assert effective_roles.roles_for_user(bob) == set()
+    carol = User("carol", groups=[admins])
+    effective_roles.add_user(carol)
+    assert effective_roles.roles_by_user["carol"] == {admin}
+    # Shared by users with the same roles and groups:
+    assert effective_roles.roles_by_user["carol"] is effective_roles.roles_for_user(
+        alice
+    )
+    assert effective_roles.groups_by_user["carol"] == ("Admins",)
+    assert effective_roles.groups_by_user["carol"] is (
+        effective_roles.groups_by_user["alice"]
+    )
+    effective_roles.remove_user(carol)
+    assert "carol" not in effective_roles.roles_by_user
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 import logging
 import re
 import sys
+import queue
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from pprint import pprint
 from operator import is_not
 from functools import partial
 import urllib.parse
 import ssl
 import ldap3  # type: ignore
+from ldap3.core.exceptions import LDAPException, LDAPBindError  # type: ignore
+from ldap3.utils.conv import escape_filter_chars  # type: ignore
 from .cipher import Cipher
+from .cache import LRUCache
+from .subject import User, Group
+from .domain import SubjectDomain, PasswordDomain
 
 # from icecream import ic
 
@@ -139,12 +149,429 @@ class LDAPService:
         logging.info("%s", msg)
 
 
+GROUP_CN_RX = re.compile(r"^CN=(?P<CN>[^,]+)(?:,|$)")
+
+
 def parse_group_cn(item: bytes) -> str | None:
-    if m := re.search(r"^CN=(?P<CN>[^,]+)(?:,|$)", item.decode(encoding="utf-8")):
+    if m := GROUP_CN_RX.search(item.decode(encoding="utf-8")):
         return m["CN"]
     return None
 
 
+###################################################
+
+
+@dataclass
+class LDAPUserInfo:
+    username: str
+    dn: str
+    groups: List[str]
+
+
+class LDAPPoolTimeout(LDAPException):
+    """No pooled connection became free in time."""
+
+
+class LDAPConnectionPool:
+    """
+    A bounded pool of connections made by connect().
+    Connections are reused most-recently-released first.
+    A connection is discarded if an exception is raised while it is in use.
+    Raises LDAPPoolTimeout if none is free within timeout seconds,
+    so callers treat an exhausted pool like an LDAP outage.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], ldap3.Connection],
+        size: int = 4,
+        timeout: float | None = 10.0,
+    ):
+        self.connect, self.size, self.timeout = connect, size, timeout
+        self.idle: queue.LifoQueue = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[ldap3.Connection]:
+        if not self.slots.acquire(timeout=self.timeout):
+            raise LDAPPoolTimeout(
+                f"LDAPConnectionPool: no connection in {self.timeout}s"
+            )
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.connect()
+            try:
+                yield conn
+            except BaseException:
+                unbind(conn)
+                raise
+            self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                unbind(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def unbind(conn: ldap3.Connection) -> None:
+    try:
+        conn.unbind()
+    # pylint: disable-next=broad-except
+    except Exception:
+        pass
+
+
+@dataclass
+class LDAPPoolOptions:
+    """Connection pool and user cache settings of an LDAPDirectory."""
+
+    client_strategy: Any = ldap3.RESTARTABLE
+    pool_size: int = 4
+    cache_size: int = 10000
+    cache_ttl: float | None = 300.0
+    negative_cache_ttl: float | None = 60.0
+
+
+class LDAPDirectory:
+    """
+    User lookup and password verification against LDAP.
+    Searches use a pool of connections bound as config["bind_user"];
+    password binds use a separate pool.
+    User DNs and group memberships are cached for options.cache_ttl seconds;
+    unknown users for options.negative_cache_ttl seconds.
+    Only the group attribute is requested from the server.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        server: Any = None,
+        options: LDAPPoolOptions | None = None,
+    ):
+        options = options or LDAPPoolOptions()
+        self.config = config
+        self.server = server if server is not None else make_server_pool(config)
+        self.client_strategy = options.client_strategy
+        self.template = config.get("template") or "(sAMAccountName=%(username)s)"
+        self.group_attribute = config.get("group_attribute") or "memberOf"
+        # For load_subject_domain():
+        self.username_attribute = config.get("username_attribute") or "sAMAccountName"
+        self.users_filter = config.get("users_filter") or "(sAMAccountName=*)"
+        self.groups_filter = config.get("groups_filter") or "(objectClass=group)"
+        self.page_size = config.get("page_size") or 500
+        self.search_pool = LDAPConnectionPool(
+            partial(
+                self.connect,
+                config.get("bind_user"),
+                config.get("bind_password"),
+                bind=True,
+            ),
+            options.pool_size,
+        )
+        self.bind_pool = LDAPConnectionPool(
+            partial(self.connect, None, None, bind=False), options.pool_size
+        )
+        # username -> (LDAPUserInfo | None,):
+        self.user_cache = LRUCache(options.cache_size, ttl=options.cache_ttl)
+        self.negative_cache_ttl = options.negative_cache_ttl
+
+    def connect(
+        self, user: str | None, password: str | None, bind: bool
+    ) -> ldap3.Connection:
+        conn = ldap3.Connection(
+            self.server,
+            user=user,
+            password=password,
+            version=3,
+            auto_referrals=self.config.get("referrals", True),
+            client_strategy=self.client_strategy,
+            read_only=True,
+        )
+        if bind and not conn.bind():
+            raise LDAPBindError(f"LDAPDirectory: cannot bind as {user!r}")
+        return conn
+
+    def user_info(self, username: str) -> LDAPUserInfo | None:
+        if cached := self.user_cache.get(username):
+            return cached[0]
+        info = self.search_user(username)
+        ttl = None if info else self.negative_cache_ttl
+        self.user_cache.put(username, (info,), ttl=ttl)
+        return info
+
+    def search_user(self, username: str) -> LDAPUserInfo | None:
+        # pylint: disable-next=consider-using-f-string
+        search_filter = self.template % {"username": escape_filter_chars(username)}
+        with self.search_pool.connection() as conn:
+            conn.search(
+                search_base=self.config["base_dn"],
+                search_filter=search_filter,
+                search_scope=ldap3.SUBTREE,
+                dereference_aliases=ldap3.DEREF_SEARCH,
+                attributes=[self.group_attribute],
+                size_limit=2,
+            )
+            entries = [
+                entry
+                for entry in conn.response or []
+                if entry.get("type") == "searchResEntry"
+            ]
+        if not entries:
+            logging.info("LDAPDirectory: %s", f"no objects found: {username=}")
+            return None
+        if len(entries) > 1:
+            logging.info("LDAPDirectory: %s", f"multiple objects: {username=}")
+        entry = entries[0]
+        member_of = entry["raw_attributes"].get(self.group_attribute, [])
+        groups = sorted(filter(partial(is_not, None), map(parse_group_cn, member_of)))
+        return LDAPUserInfo(username=username, dn=entry["dn"], groups=groups)
+
+    def verify_password(self, username: str, password: str) -> bool:
+        # An empty password would be an unauthenticated bind:
+        if not password:
+            return False
+        try:
+            if not (info := self.user_info(username)):
+                return False
+            with self.bind_pool.connection() as conn:
+                return bool(conn.rebind(user=info.dn, password=password))
+        except LDAPException as exc:
+            logging.error("LDAPDirectory: %s", f"bind failed: {username=} {exc!r}")
+            return False
+
+    def load_subject_domain(self) -> Tuple[SubjectDomain, List[LDAPUserInfo]]:
+        """
+        All users and groups, by paged searches.
+        Each distinct group DN is parsed once and its Group is shared by all members.
+        """
+        groups_by_name: Dict[str, Group] = {}
+        groups_by_dn: Dict[bytes, Group | None] = {}
+
+        def group_for_dn(dn: bytes) -> Group | None:
+            if dn not in groups_by_dn:
+                cn = parse_group_cn(dn)
+                groups_by_dn[dn] = cn and groups_by_name.setdefault(cn, Group(cn))
+            return groups_by_dn[dn]
+
+        users, infos = [], []
+        with self.search_pool.connection() as conn:
+            for entry in self.paged_search(conn, self.groups_filter, []):
+                group_for_dn(entry["raw_dn"])
+            attributes = [self.username_attribute, self.group_attribute]
+            for entry in self.paged_search(conn, self.users_filter, attributes):
+                raw_attributes = entry["raw_attributes"]
+                if not (names := raw_attributes.get(self.username_attribute)):
+                    continue
+                name = names[0].decode("utf-8")
+                member_of = raw_attributes.get(self.group_attribute, [])
+                groups = [group for group in map(group_for_dn, member_of) if group]
+                users.append(User(name, groups=groups))
+                infos.append(
+                    LDAPUserInfo(name, entry["dn"], sorted(g.name for g in groups))
+                )
+        subject_domain = SubjectDomain(users=users, groups=groups_by_name.values())
+        return subject_domain, infos
+
+    def paged_search(
+        self, conn: ldap3.Connection, search_filter: str, attributes: List[str]
+    ) -> Iterator[dict]:
+        for entry in conn.extend.standard.paged_search(
+            search_base=self.config["base_dn"],
+            search_filter=search_filter,
+            search_scope=ldap3.SUBTREE,
+            dereference_aliases=ldap3.DEREF_SEARCH,
+            attributes=attributes or ldap3.NO_ATTRIBUTES,
+            paged_size=self.page_size,
+            generator=True,
+        ):
+            if entry.get("type") == "searchResEntry":
+                yield entry
+
+    def prime_users(self, infos: List[LDAPUserInfo]) -> None:
+        """Replace the user cache, including unknown users, with infos."""
+        self.user_cache.clear()
+        for info in infos:
+            self.user_cache.put(info.username, (info,))
+
+    def forget_user(self, username: str) -> None:
+        self.user_cache.pop(username)
+
+    def close(self) -> None:
+        self.search_pool.close()
+        self.bind_pool.close()
+
+
+def make_server_pool(config: dict) -> ldap3.ServerPool:
+    """
+    A ServerPool of each URL in config["url"]: a list or a space-separated string.
+    Unreachable servers are skipped.
+    """
+    urls = config["url"]
+    if isinstance(urls, str):
+        urls = urls.split()
+    tls = ldap3.Tls(
+        validate=(
+            ssl.CERT_REQUIRED if config.get("ssl_cert_required") else ssl.CERT_OPTIONAL
+        ),
+    )
+    servers = []
+    for url in urls:
+        parsed = urllib.parse.urlparse(url)
+        servers.append(
+            ldap3.Server(
+                host=parsed.hostname,
+                port=parsed.port,
+                use_ssl=config.get("ssl", parsed.scheme == "ldaps"),
+                tls=tls,
+                connect_timeout=config.get("connect_timeout", 5),
+            )
+        )
+    return ldap3.ServerPool(servers, ldap3.ROUND_ROBIN, active=True, exhaust=True)
+
+
+@dataclass
+class LDAPSubjectDomain(SubjectDomain):
+    """
+    Users and Groups from an LDAPDirectory.
+    Statically configured users and groups take precedence.
+    After sync(), users and groups come from the snapshot of the directory
+    without LDAP round trips; sync() swaps in a new snapshot atomically.
+    Before any sync(), users are looked up in the directory on demand,
+    and the same User object is returned while its directory entry is cached.
+    """
+
+    directory: LDAPDirectory | None = field(default=None, repr=False, compare=False)
+    snapshot: SubjectDomain | None = field(default=None, repr=False, compare=False)
+    sync_task: "LDAPSubjectSync | None" = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    ldap_users: Dict[str, Tuple[LDAPUserInfo, User]] = field(
+        init=False, repr=False, compare=False
+    )
+    ldap_groups: Dict[str, Group] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.ldap_users, self.ldap_groups = {}, {}
+
+    def user_by_name(self, name: str) -> User:
+        """
+        The User named name, or None.
+        If the directory cannot be reached, the user is unknown:
+        authentication fails rather than the request.
+        """
+        if user := self.user_index.get(name):
+            return user
+        if (snapshot := self.snapshot) is not None:
+            return snapshot.user_by_name(name)
+        try:
+            info = self.directory.user_info(name)
+        except LDAPException as exc:
+            logging.error("LDAPSubjectDomain: %s", f"lookup failed: {name=} {exc!r}")
+            return None
+        if not info:
+            return None
+        cached = self.ldap_users.get(name)
+        if cached and cached[0] is info:
+            return cached[1]
+        user = User(name, groups=[self.intern_group(cn) for cn in info.groups])
+        self.ldap_users[name] = (info, user)
+        return user
+
+    def group_by_name(self, name: str) -> Group:
+        if group := self.group_index.get(name):
+            return group
+        if (snapshot := self.snapshot) is not None:
+            return snapshot.group_by_name(name)
+        return self.ldap_groups.get(name)
+
+    def current(self) -> SubjectDomain:
+        return self.snapshot if self.snapshot is not None else self
+
+    def sync(self) -> SubjectDomain:
+        snapshot, infos = self.directory.load_subject_domain()
+        self.directory.prime_users(infos)
+        self.snapshot = snapshot
+        logging.info(
+            "LDAPSubjectDomain: %s",
+            f"sync: {len(snapshot.users)} users {len(snapshot.groups)} groups",
+        )
+        return snapshot
+
+    def intern_group(self, name: str) -> Group:
+        if group := self.group_index.get(name):
+            return group
+        return self.ldap_groups.setdefault(name, Group(name))
+
+
+class LDAPSubjectSync:
+    """
+    Calls subject_domain.sync() now and every interval seconds, in a daemon thread.
+    If a sync fails, the previous snapshot stays in effect.
+    """
+
+    def __init__(self, subject_domain: LDAPSubjectDomain, interval: float):
+        self.subject_domain, self.interval = subject_domain, interval
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self.run, name="LDAPSubjectSync", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self) -> None:
+        while True:
+            self.run_once()
+            if self.stopped.wait(self.interval):
+                return
+
+    def run_once(self) -> bool:
+        try:
+            self.subject_domain.sync()
+            return True
+        # pylint: disable-next=broad-except
+        except Exception as exc:
+            logging.error("LDAPSubjectSync: %s", f"sync failed: {exc!r}")
+            return False
+
+
+@dataclass
+class LDAPPasswordDomain(PasswordDomain):
+    """Verifies passwords by binding to an LDAPDirectory as the user."""
+
+    directory: LDAPDirectory | None = field(default=None, repr=False, compare=False)
+
+    def verify_password(self, user: User, password: str) -> bool:
+        return self.directory.verify_password(user.name, password)
+
+
+def make_ldap_auth_domains(
+    config: dict, server: Any = None, options: LDAPPoolOptions | None = None
+) -> Tuple[LDAPSubjectDomain, LDAPPasswordDomain]:
+    """
+    If config["sync_interval"] is set, users and groups are synced periodically.
+    """
+    directory = LDAPDirectory(config, server=server, options=options)
+    subject_domain = LDAPSubjectDomain(directory=directory)
+    if interval := config.get("sync_interval"):
+        subject_domain.sync_task = LDAPSubjectSync(subject_domain, interval)
+        subject_domain.sync_task.start()
+    return subject_domain, LDAPPasswordDomain(directory=directory)
+
+
 # def slice(indexable, keys):
 #   return {k: indexable[k] for k in keys if k in indexable}
 
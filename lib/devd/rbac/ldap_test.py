@@ -0,0 +1,165 @@
+from contextlib import ExitStack
+import ldap3  # type: ignore
+from ldap3.core.exceptions import LDAPSocketOpenError  # type: ignore
+import pytest
+from .credential import UserPass
+from .auth import Authenticator
+from . import ldap as sut
+
+BASE_DN = "ou=Accounts,dc=test"
+SERVICE_DN = f"cn=svc,{BASE_DN}"
+BOB_DN = f"cn=bob,{BASE_DN}"
+
+
+@pytest.fixture(name="directory")
+def fixture_directory():
+    server = ldap3.Server("mock")
+    conn = ldap3.Connection(server, client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(SERVICE_DN, {"userPassword": "svcpw", "cn": "svc"})
+    conn.strategy.add_entry(
+        BOB_DN,
+        {
+            "userPassword": "b0b",
+            "sAMAccountName": "bob",
+            "memberOf": ["CN=Readers,ou=Groups,dc=test", "CN=Admins,ou=Groups,dc=test"],
+        },
+    )
+    config = {"base_dn": BASE_DN, "bind_user": SERVICE_DN, "bind_password": "svcpw"}
+    directory = sut.LDAPDirectory(
+        config,
+        server=server,
+        options=sut.LDAPPoolOptions(client_strategy=ldap3.MOCK_SYNC, pool_size=2),
+    )
+    yield directory
+    directory.close()
+
+
+def test_user_info_is_cached(directory):
+    info = directory.user_info("bob")
+    assert info == sut.LDAPUserInfo("bob", BOB_DN, ["Admins", "Readers"])
+    assert directory.user_info("bob") is info
+    assert directory.user_info("nobody") is None
+    assert directory.user_info("nobody") is None
+    assert directory.user_cache.stats()["hits"] == 2
+    assert directory.user_info("*") is None
+
+
+def test_verify_password(directory):
+    assert directory.verify_password("bob", "b0b")
+    assert not directory.verify_password("bob", "wrong")
+    assert not directory.verify_password("bob", "")
+    assert not directory.verify_password("nobody", "b0b")
+    assert directory.verify_password("bob", "b0b")
+    assert directory.bind_pool.idle.qsize() == 1
+
+
+def test_connection_pool_discards_failed_connections():
+    made = []
+    pool = sut.LDAPConnectionPool(lambda: made.append(object()) or made[-1], size=1)
+    with pool.connection() as conn:
+        first = conn
+    with pool.connection() as conn:
+        assert conn is first
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError()
+    with pool.connection() as conn:
+        assert conn is not first
+    assert len(made) == 2
+
+
+def test_authenticator(directory):
+    subject_domain = sut.LDAPSubjectDomain(directory=directory)
+    password_domain = sut.LDAPPasswordDomain(directory=directory)
+    bob = subject_domain.user_by_name("bob")
+    assert [group.name for group in bob.groups] == ["Admins", "Readers"]
+    assert subject_domain.user_by_name("bob") is bob
+    assert subject_domain.group_by_name("Readers") is bob.groups[1]
+    auth = Authenticator(subject_domain, password_domain, "key", "cookie")
+    assert auth.auth_userpass(UserPass("bob", "b0b")) == UserPass("bob", "b0b")
+    assert auth.auth_userpass(UserPass("bob", "bad")) is None
+    assert auth.auth_userpass(UserPass("nobody", "b0b")) is None
+
+
+def test_ldap_outage_fails_authentication(directory, caplog):
+    subject_domain = sut.LDAPSubjectDomain(directory=directory)
+    password_domain = sut.LDAPPasswordDomain(directory=directory)
+    auth = Authenticator(subject_domain, password_domain, "key", "cookie")
+
+    def connect():
+        raise LDAPSocketOpenError("unreachable")
+
+    directory.search_pool.connect = connect
+    assert subject_domain.user_by_name("bob") is None
+    assert "unreachable" in caplog.text
+    assert auth.auth_userpass(UserPass("bob", "b0b")) is None
+    assert not directory.verify_password("bob", "b0b")
+    assert len(directory.user_cache) == 0
+
+
+def test_exhausted_pool_fails_authentication(directory, caplog):
+    subject_domain = sut.LDAPSubjectDomain(directory=directory)
+    password_domain = sut.LDAPPasswordDomain(directory=directory)
+    auth = Authenticator(subject_domain, password_domain, "key", "cookie")
+
+    def exhaust(stack, pool):
+        pool.timeout = 0.01
+        for _ in range(pool.size):
+            stack.enter_context(pool.connection())
+
+    with ExitStack() as stack:
+        exhaust(stack, directory.search_pool)
+        assert subject_domain.user_by_name("bob") is None
+        assert "no connection" in caplog.text
+        assert auth.auth_userpass(UserPass("bob", "b0b")) is None
+    assert directory.user_info("bob")
+    with ExitStack() as stack:
+        exhaust(stack, directory.bind_pool)
+        assert not directory.verify_password("bob", "b0b")
+        assert auth.auth_userpass(UserPass("bob", "b0b")) is None
+    assert auth.auth_userpass(UserPass("bob", "b0b")) == UserPass("bob", "b0b")
+
+
+def test_sync(directory):
+    conn = ldap3.Connection(directory.server, client_strategy=ldap3.MOCK_SYNC)
+    conn.strategy.add_entry(
+        "CN=Readers,ou=Groups,dc=test", {"cn": "Readers", "objectClass": "group"}
+    )
+    conn.strategy.add_entry(
+        "CN=Empty,ou=Groups,dc=test", {"cn": "Empty", "objectClass": "group"}
+    )
+    conn.strategy.add_entry(
+        f"cn=carol,{BASE_DN}",
+        {"sAMAccountName": "carol", "memberOf": ["CN=Readers,ou=Groups,dc=test"]},
+    )
+    directory.config["base_dn"] = "dc=test"
+    directory.page_size = 1
+    subject_domain = sut.LDAPSubjectDomain(directory=directory)
+    assert subject_domain.current() is subject_domain
+    snapshot = subject_domain.sync()
+    assert subject_domain.current() is snapshot
+    assert sorted(user.name for user in snapshot.users) == ["bob", "carol"]
+    assert sorted(group.name for group in snapshot.groups) == [
+        "Admins",
+        "Empty",
+        "Readers",
+    ]
+    bob = subject_domain.user_by_name("bob")
+    carol = subject_domain.user_by_name("carol")
+    assert bob.groups[0] is carol.groups[0] is subject_domain.group_by_name("Readers")
+    assert subject_domain.user_by_name("nobody") is None
+    misses = directory.user_cache.misses
+    assert directory.verify_password("bob", "b0b")
+    assert directory.user_cache.misses == misses
+
+
+def test_sync_task_keeps_snapshot_on_failure(directory):
+    subject_domain = sut.LDAPSubjectDomain(directory=directory)
+    sync_task = sut.LDAPSubjectSync(subject_domain, interval=60)
+    directory.config["base_dn"] = "dc=test"
+    assert sync_task.run_once()
+    snapshot = subject_domain.snapshot
+    directory.close()
+    directory.search_pool.connect = lambda: 1 / 0
+    assert not sync_task.run_once()
+    assert subject_domain.snapshot is snapshot
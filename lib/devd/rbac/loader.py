@@ -1,7 +1,22 @@
-from typing import Any, Callable, Iterable, List, Type, IO
+"""
+Loaders for domain files and auth files.
+
+Each line is a keyword and whitespace-separated fields; "#" starts a comment.
+Lines are split with str methods, streamed, and parsed one at a time.
+Groups and roles are interned: each name has one object per TextLoader.
+Domain files above DomainFileLoader.parallel_threshold bytes
+are split into fields by a process pool, in chunks of whole lines.
+"""
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Type, IO
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
+import io as io_module
+import multiprocessing
+import os
 import re
+import sys
 import logging
 from .subject import User, Users, Group
 from .credential import UserPass, UserPasses
@@ -10,6 +25,7 @@ from .rbac import (
     Action,
     Rule,
     Rules,
+    RuleSet,
     Permission,
     Role,
     Membership,
@@ -26,23 +42,33 @@ from .util import getter, mapcat, clean_path, glob_to_regex
 @dataclass
 class TextLoader:
     prefix: str = field(default="")
+    # Interned by name:
+    groups: Dict[str, Group] = field(default_factory=dict)
+    roles: Dict[str, Role] = field(default_factory=dict)
+    members: Dict[str, User] = field(default_factory=dict)
+    permissions: Dict[str, Permission] = field(default_factory=dict)
+    # Action and Role patterns, by (constructor, pattern):
+    patterns: Dict[Tuple[Type, str], Any] = field(default_factory=dict)
+    # Groups of users, by their field in user lines:
+    group_tuples: Dict[str, Tuple[Group, ...]] = field(default_factory=dict)
 
     def read_rules(self, io: IO) -> Rules:
-        return parse_lines(io, RULE_RX, self.parse_rule_line)
+        return parse_lines(io, "rule", 4, self.parse_rule_line)
 
-    def parse_rule_line(self, m: re.Match) -> Rules:
+    def read_rule_set(self, io: IO) -> RuleSet:
+        return RuleSet(rules=list(self.read_rules(io)))
+
+    def parse_rule_line(self, fields: List[str]) -> Rules:
         result: List[Rule] = []
-        permission = Permission(m["permission"])
-        for action in parse_list(m["action"]):
-            for role in parse_list(m["role"]):
-                for resource in parse_list(m["resource"]):
+        permission_name, actions, roles, resources = fields
+        if (permission := self.permissions.get(permission_name)) is None:
+            permission = Permission(permission_name)
+            self.permissions[permission_name] = permission
+        for action in parse_list(actions):
+            for role in parse_list(roles):
+                for resource in parse_list(resources):
                     resource_path = clean_path(f"{self.prefix}{resource}")
-                    rule = Rule(
-                        permission=permission,
-                        action=self.parse_pattern(Action, action, True),
-                        role=self.parse_pattern(Role, role, True),
-                        resource=self.parse_pattern(Resource, resource_path, False),
-                    )
+                    rule = self.make_rule(permission, action, role, resource_path)
                     logging.debug(
                         "  rule: %s",
                         f"{rule.permission.name} {rule.action.name} "
@@ -52,6 +78,23 @@ class TextLoader:
                     result.append(rule)
         return result
 
+    def make_rule(
+        self, permission: Permission, action: str, role: str, resource: str
+    ) -> Rule:
+        return Rule(
+            permission=permission,
+            action=self.interned_pattern(Action, action),
+            role=self.interned_pattern(Role, role),
+            resource=self.parse_pattern(Resource, resource, False),
+        )
+
+    def interned_pattern(self, constructor: Type, pattern: str) -> Any:
+        """Patterns are not modified once parsed, so rules can share them."""
+        key = (constructor, pattern)
+        if (obj := self.patterns.get(key)) is None:
+            obj = self.patterns[key] = self.parse_pattern(constructor, pattern, True)
+        return obj
+
     def parse_pattern(
         self, constructor: Type, pattern: str, star_always_matches: bool
     ) -> Any:
@@ -71,53 +114,68 @@ class TextLoader:
             description = f"!{description}"
         obj = constructor(name=pattern, description=pattern, matcher=matcher)
         obj.regex = regex
+        obj.negated = negate
+        if not negate and not NON_LITERAL_RX.search(pattern):
+            obj.literal = pattern
         return obj
 
     ##############################
 
     def read_users(self, io: IO) -> Users:
-        return parse_lines(io, USER_RX, self.parse_user_line)
+        return parse_lines(io, "user", 2, self.parse_user_line)
 
-    def parse_user_line(self, m: re.Match) -> Users:
-        groups = [Group(group, group) for group in parse_list(m["groups"])]
+    def parse_user_line(self, fields: List[str]) -> Users:
+        users, group_names = fields
+        if (groups := self.group_tuples.get(group_names)) is None:
+            groups = tuple(self.group(name) for name in parse_list(group_names))
+            self.group_tuples[group_names] = groups
 
         def make_user(name):
-            return User(name, f"@{name}", groups=groups.copy())
+            return User(name, f"@{name}", groups=groups)
 
-        return [make_user(name) for name in parse_list(m["user"])]
+        return [make_user(name) for name in parse_list(users)]
+
+    def group(self, name: str) -> Group:
+        if (group := self.groups.get(name)) is None:
+            name = sys.intern(name)
+            group = self.groups[name] = Group(name, name)
+        return group
+
+    def role(self, name: str) -> Role:
+        if (role := self.roles.get(name)) is None:
+            name = sys.intern(name)
+            role = self.roles[name] = Role(name)
+        return role
 
     ##############################
 
     def read_memberships(self, io: IO) -> Memberships:
-        return parse_lines(io, MEMBERSHIP_RX, self.parse_membership_line)
+        return parse_lines(io, "member", 2, self.parse_membership_line)
 
-    def parse_membership_line(self, m: re.Match) -> Memberships:
-        role = Role(m["role"])
-        return [
-            self.make_membership(role, member) for member in parse_list(m["members"])
-        ]
+    def parse_membership_line(self, fields: List[str]) -> Memberships:
+        role_name, members = fields
+        role = self.role(role_name)
+        return [self.make_membership(role, member) for member in parse_list(members)]
 
     def make_membership(self, role: Role, description: str) -> Membership:
         if description.startswith("@"):
-            name = description.removeprefix("@")
-            return Membership(role=role, member=User(name, description))
-        return Membership(role=role, member=Group(description, description))
+            if (user := self.members.get(description)) is None:
+                name = description.removeprefix("@")
+                user = self.members[description] = User(name, description)
+            return Membership(role=role, member=user)
+        return Membership(role=role, member=self.group(description))
 
     ##############################
 
     def read_passwords(self, io: IO) -> UserPasses:
-        def make_password(m: re.Match):
-            return [UserPass(**m.groupdict())]
+        return parse_lines(io, "password", 2, self.parse_password_line)
 
-        return parse_lines(io, PASSWORD_RX, make_password)
+    def parse_password_line(self, fields: List[str]) -> UserPasses:
+        return [UserPass(*fields)]
 
 
-RULE_RX = re.compile(
-    r"rule\s+(?P<permission>\S+)\s+(?P<action>\S+)\s+(?P<role>\S+)\s+(?P<resource>\S+)"
-)
-MEMBERSHIP_RX = re.compile(r"member\s+(?P<role>\S+)\s+(?P<members>\S+)")
-USER_RX = re.compile(r"user\s+(?P<user>\S+)\s+(?P<groups>\S+)")
-PASSWORD_RX = re.compile(r"password\s+(?P<username>\S+)\s+(?P<password>\S+)")
+# Characters that glob_to_regex does not match literally:
+NON_LITERAL_RX = re.compile(r"[*?+()\[\]{}^$|\\]")
 
 
 def real_open_file(file: Path) -> IO | None:
@@ -127,6 +185,10 @@ def real_open_file(file: Path) -> IO | None:
         return None
 
 
+# Files larger than this are split into fields by a process pool:
+PARALLEL_THRESHOLD = 32 * 1024 * 1024
+
+
 @dataclass
 class DomainFileLoader:
     """
@@ -134,23 +196,22 @@ class DomainFileLoader:
     Creates a static Domain.
     """
 
+    parallel_threshold: int = field(default=PARALLEL_THRESHOLD)
+    # Defaults to the CPU count:
+    max_workers: int | None = field(default=None)
+
     def load_user_file(self, user_file: Path) -> SubjectDomain:
-        with open(user_file, encoding="utf-8") as io:
-            users = TextLoader().read_users(io)
-        group_by_name = {}
-        for user in users:
-            for group in user.groups:
-                group_by_name[group.name] = group
-        groups = sorted(group_by_name.values(), key=getter("name"))
+        loader = TextLoader()
+        users = self.read_file(user_file, "user", 2, loader.parse_user_line)
+        groups = sorted(loader.groups.values(), key=getter("name"))
         return SubjectDomain(users=users, groups=groups)
 
     def load_membership_file(self, memberships_file: Path) -> RoleDomain:
-        with open(memberships_file, encoding="utf-8") as io:
-            memberships = TextLoader().read_memberships(io)
-        role_by_name = {}
-        for member in memberships:
-            role_by_name[member.role.name] = member.role
-        roles = sorted(role_by_name.values(), key=getter("name"))
+        loader = TextLoader()
+        memberships = self.read_file(
+            memberships_file, "member", 2, loader.parse_membership_line
+        )
+        roles = sorted(loader.roles.values(), key=getter("name"))
         return RoleDomain(memberships=memberships, roles=roles)
 
     def load_rules_for_resource(
@@ -161,10 +222,25 @@ class DomainFileLoader:
         return RuleDomain(rules=rules)
 
     def load_password_file(self, password_file: Path) -> PasswordDomain:
-        with open(password_file, encoding="utf-8") as io:
-            passwords = TextLoader().read_passwords(io)
+        passwords = self.read_file(
+            password_file, "password", 2, TextLoader().parse_password_line
+        )
         return PasswordDomain(passwords=passwords)
 
+    def read_file(
+        self,
+        path: Path,
+        keyword: str,
+        field_count: int,
+        parse: Callable[[List[str]], Iterable[Any]],
+    ) -> List[Any]:
+        workers = self.max_workers or os.cpu_count() or 1
+        if workers > 1 and os.stat(path).st_size > self.parallel_threshold:
+            lines = parallel_split_file(path, keyword, field_count, workers)
+            return parse_fields(lines, str(path), parse)
+        with open(path, encoding="utf-8") as io:
+            return parse_lines(io, keyword, field_count, parse)
+
 
 @dataclass
 class FileSystemLoader:
@@ -176,14 +252,17 @@ class FileSystemLoader:
         return mapcat(self.load_auth_file, self.resource_paths(resource))
 
     def load_auth_file(self, path: Path) -> Rules:
+        return self.load_rule_set(path).rules
+
+    def load_rule_set(self, path: Path) -> RuleSet:
         auth_file = self.auth_file(path)
         io: IO = self.open_file(auth_file)
         if io:
             try:
-                return TextLoader(prefix=str(path) + "/").read_rules(io)
+                return TextLoader(prefix=str(path) + "/").read_rule_set(io)
             finally:
                 io.close()
-        return []
+        return RuleSet(rules=[])
 
     def resource_paths(self, resource: Path) -> Iterable[Path]:
         return list(resource.parents)
@@ -195,28 +274,128 @@ class FileSystemLoader:
 ###################################
 
 
+class ParseError(ValueError):
+    def __init__(self, name: str, line_number: int, message: str):
+        super().__init__(f"{name}:{line_number}: {message}")
+        self.name, self.line_number = name, line_number
+
+
+# (line number, fields):
+Line = Tuple[int, List[str]]
+
+
 def parse_lines(
-    io: IO, rx: re.Pattern, parse: Callable[[re.Match], Any]
-) -> Iterable[Any]:
-    result: List[Any] = []
-    while line := io.readline():
-        if m := rx.match(trim_line(line)):
-            result.extend(parse(m))
-    return result
+    io: IO,
+    keyword: str,
+    field_count: int,
+    parse: Callable[[List[str]], Iterable[Any]],
+) -> List[Any]:
+    """
+    The objects parsed from the fields of each line of io starting with keyword.
+    Other lines are ignored.
+    """
+    name = getattr(io, "name", "<input>")
+    return parse_fields(iter_lines(io, keyword, field_count, name), name, parse)
 
 
-def parse_list(val: str) -> Iterable[str]:
-    return re.split(PARSE_LIST_RX, val)
+def parse_fields(
+    lines: Iterable[Line], name: str, parse: Callable[[List[str]], Iterable[Any]]
+) -> List[Any]:
+    result: List[Any] = []
+    for line_number, fields in lines:
+        try:
+            result.extend(parse(fields))
+        # pylint: disable-next=broad-except
+        except Exception as exc:
+            raise ParseError(name, line_number, repr(exc)) from exc
+    return result
 
 
-PARSE_LIST_RX = re.compile(r"\s*,\s*")
+def iter_lines(
+    io: Iterable[str],
+    keyword: str,
+    field_count: int,
+    name: str = "<input>",
+    first_line_number: int = 1,
+) -> Iterator[Line]:
+    """
+    The fields after keyword of each line starting with it.
+    Fields after the first field_count are ignored;
+    lines with fewer are logged and skipped.
+    """
+    for line_number, line in enumerate(io, first_line_number):
+        if "#" in line:
+            line = line[: line.index("#")]
+        words = line.split(None, field_count + 1)
+        if not words or words[0] != keyword:
+            continue
+        if len(words) <= field_count:
+            logging.warning("%s:%d: expected %d fields", name, line_number, field_count)
+            continue
+        yield line_number, words[1 : field_count + 1]
+
+
+def parallel_split_file(
+    path: Path, keyword: str, field_count: int, workers: int
+) -> Iterator[Line]:
+    """iter_lines() of the file at path, run by a pool of workers on its chunks."""
+    chunks = chunk_offsets(path, workers * 4)
+    # Forking would copy the state of other threads, such as held locks:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        results = executor.map(
+            split_chunk,
+            [str(path)] * len(chunks),
+            [start for start, _ in chunks],
+            [end for _, end in chunks],
+            [keyword] * len(chunks),
+            [field_count] * len(chunks),
+        )
+        first_line_number = 1
+        for line_count, lines in results:
+            for line_index, fields in lines:
+                yield first_line_number + line_index, fields
+            first_line_number += line_count
+
+
+def chunk_offsets(path: Path, count: int) -> List[Tuple[int, int]]:
+    """About count (start, end) byte offsets of whole lines, covering the file."""
+    size = os.stat(path).st_size
+    offsets = [0]
+    with open(path, "rb") as io:
+        for i in range(1, count):
+            if (offset := size * i // count) <= offsets[-1]:
+                continue
+            io.seek(offset)
+            io.readline()
+            if (offset := io.tell()) >= size:
+                break
+            offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def split_chunk(
+    path: str, start: int, end: int, keyword: str, field_count: int
+) -> Tuple[int, List[Line]]:
+    """
+    The count of lines between offsets start and end of path,
+    and iter_lines() of them, numbered from 0.
+    """
+    with open(path, "rb") as io:
+        io.seek(start)
+        data = io.read(end - start)
+    # Newlines are translated as when reading in text mode:
+    text = io_module.StringIO(data.decode("utf-8"), newline=None)
+    lines = list(iter_lines(text, keyword, field_count, path, 0))
+    return text.getvalue().count("\n"), lines
 
 
-def trim_line(line: str) -> str:
-    line = line.removesuffix("\n")
-    line = re.sub(TRIM_SPACE_RX, "", line)
-    return re.sub(COMMENT_RX, "", line)
+def parse_list(val: str) -> List[str]:
+    if " " in val or "\t" in val:
+        return PARSE_LIST_RX.split(val)
+    # Fields contain no whitespace:
+    return val.split(",")
 
 
-COMMENT_RX = re.compile(r"#.*$")
-TRIM_SPACE_RX = re.compile(r"^\s+|\s+$")
+PARSE_LIST_RX = re.compile(r"\s*,\s*")
@@ -0,0 +1,89 @@
+from pathlib import Path
+import io
+import logging
+import pytest
+from . import loader as sut
+
+
+def test_iter_lines(caplog):
+    text = "\n".join(
+        [
+            "user alice Admins",
+            "  user\tbob   Readers,Writers  extra  # comment",
+            "# user carol Other",
+            "user dave",
+            "userx eve Other",
+            "member admin-role Admins",
+            "",
+            "user frank Wri#ters",
+        ]
+    )
+    with caplog.at_level(logging.WARNING):
+        lines = list(sut.iter_lines(io.StringIO(text), "user", 2, "user.txt"))
+    assert lines == [
+        (1, ["alice", "Admins"]),
+        (2, ["bob", "Readers,Writers"]),
+        (8, ["frank", "Wri"]),
+    ]
+    assert "user.txt:4: expected 2 fields" in caplog.text
+
+
+def test_parse_list():
+    assert sut.parse_list("a,b,,c") == ["a", "b", "", "c"]
+    assert sut.parse_list("a , b,c") == ["a", "b", "c"]
+
+
+def test_interning():
+    loader = sut.TextLoader()
+    users = loader.read_users(io.StringIO("user a G1,G2\nuser b G2\nuser c G1,G2\n"))
+    memberships = loader.read_memberships(
+        io.StringIO("member r G2\nmember r @a\nmember s @a\n")
+    )
+    assert users[0].groups[1] is users[1].groups[0] is memberships[0].member
+    assert users[0].groups is users[2].groups
+    assert memberships[0].role is memberships[1].role
+    assert memberships[1].member is memberships[2].member
+    assert sorted(loader.groups) == ["G1", "G2"]
+    assert list(loader.roles) == ["r", "s"]
+    rules = loader.read_rules(io.StringIO("rule allow GET r a\nrule allow GET r b\n"))
+    assert rules[0].permission is rules[1].permission
+    assert rules[0].action is rules[1].action
+    assert rules[0].role is rules[1].role
+    assert rules[0].resource is not rules[1].resource
+
+
+def test_parse_error():
+    def parse(fields):
+        if fields[0] == "bad":
+            raise KeyError(fields[0])
+        return [fields]
+
+    text = io.StringIO("x ok 1\n\nx bad 2\n")
+    with pytest.raises(sut.ParseError) as exc_info:
+        sut.parse_lines(text, "x", 2, parse)
+    assert str(exc_info.value) == "<input>:3: KeyError('bad')"
+    assert exc_info.value.line_number == 3
+
+
+def write_user_file(path: Path, count: int) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as io_:
+        for i in range(count):
+            end = "\r\n" if i % 7 == 0 else "\n"
+            io_.write(f"user u{i} G{i % 10},Gé{i % 3}  # {i}{end}")
+            if i % 5 == 0:
+                io_.write(f"# comment{end}")
+
+
+def test_parallel_load(tmp_path):
+    user_file = tmp_path / "user.txt"
+    write_user_file(user_file, 2000)
+    serial = sut.DomainFileLoader().load_user_file(user_file)
+    loader = sut.DomainFileLoader(parallel_threshold=1000, max_workers=2)
+    assert len(sut.chunk_offsets(user_file, 8)) == 8
+    parallel = loader.load_user_file(user_file)
+    assert parallel.users == serial.users
+    assert parallel.groups == serial.groups
+    assert len(parallel.groups) == 13
+    lines = list(sut.parallel_split_file(user_file, "user", 2, 2))
+    with open(user_file, encoding="utf-8") as io_:
+        assert lines == list(sut.iter_lines(io_, "user", 2))
@@ -0,0 +1,261 @@
+"""
+Counters and histograms, rendered in the Prometheus text format.
+
+Each labelled series is a child object created once and then updated
+under its own lock, so instrumentation costs about a microsecond:
+hot paths look up their child at import time, e.g.:
+
+  MATCH_TIMER = PHASE_SECONDS.labels("match")
+  with MATCH_TIMER.time():
+      ...
+
+Values are kept in process memory and not shared:
+under a PreforkServer, each worker counts and renders only its own requests,
+and a scrape of the shared port reaches one worker at random.
+Sum them by scraping each worker, or run a single worker where exact
+totals matter.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+from abc import ABC, abstractmethod
+import bisect
+import math
+import threading
+import time
+
+Labels = Tuple[str, ...]
+
+# Seconds, from 1us to 10s:
+TIME_BUCKETS = (
+    0.000001,
+    0.0000025,
+    0.000005,
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, value: float = 1.0) -> None:
+        with self.lock:
+            self.value += value
+
+
+class HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One count per bucket, and one for +Inf:
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+
+class Timer:
+    """Observes the seconds spent in a with block, by time.perf_counter."""
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: HistogramChild):
+        self.histogram = histogram
+        self.started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_args) -> None:
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Labels = ()):
+        self.name, self.help_text, self.label_names = name, help_text, label_names
+        self.children: Dict[Labels, CounterChild | HistogramChild] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *labels: str):
+        if (child := self.children.get(labels)) is None:
+            assert len(labels) == len(self.label_names)
+            with self.lock:
+                child = self.children.setdefault(labels, self.make_child())
+        return child
+
+    @abstractmethod
+    def make_child(self) -> CounterChild | HistogramChild:
+        pass
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, child in sorted(self.children.items()):
+            yield from self.render_child(labels, child)
+
+    @abstractmethod
+    def render_child(self, labels: Labels, child) -> Iterable[str]:
+        pass
+
+    def label_text(self, labels: Labels, extra: Labels = ()) -> str:
+        pairs = list(zip(self.label_names, labels)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        self.labels(*labels).inc(value)
+
+    def make_child(self) -> CounterChild:
+        return CounterChild()
+
+    def render_child(self, labels: Labels, child) -> Iterable[str]:
+        yield f"{self.name}{self.label_text(labels)} {format_value(child.value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Labels = (),
+        buckets: Iterable[float] = TIME_BUCKETS,
+    ):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        self.labels(*labels).observe(value)
+
+    def time(self, *labels: str) -> Timer:
+        return Timer(self.labels(*labels))
+
+    def make_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def render_child(self, labels: Labels, child) -> Iterable[str]:
+        with child.lock:
+            counts, total = list(child.counts), child.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = self.label_text(labels, ("le", format_value(bound)))
+            yield f"{self.name}_bucket{le} {cumulative}"
+        yield f"{self.name}_sum{self.label_text(labels)} {format_value(total)}"
+        yield f"{self.name}_count{self.label_text(labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def counter(self, name: str, help_text: str, label_names: Labels = ()) -> Counter:
+        return self.register(Counter(name, help_text, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Labels = (),
+        buckets: Iterable[float] = TIME_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help_text, label_names, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "devd_rbac_request_seconds",
+    "HTTP requests by method, route and status.",
+    ("method", "route", "status"),
+)
+PHASE_SECONDS = REGISTRY.histogram(
+    "devd_rbac_phase_seconds",
+    "Time spent in each phase of request handling.",
+    ("phase",),
+)
+AUTHENTICATIONS = REGISTRY.counter(
+    "devd_rbac_authentications_total",
+    "Authentications by credential type and result.",
+    ("credential", "result"),
+)
+AUTHENTICATION_SECONDS = REGISTRY.histogram(
+    "devd_rbac_authentication_seconds",
+    "Time spent authenticating, by credential type.",
+    ("credential",),
+)
+RULES_EVALUATED = REGISTRY.histogram(
+    "devd_rbac_rules_evaluated",
+    "Rules checked against a request, per rule lookup.",
+    buckets=COUNT_BUCKETS,
+)
+DECISION_CACHE = REGISTRY.counter(
+    "devd_rbac_decision_cache_total",
+    "Decision cache lookups by result.",
+    ("result",),
+)
+FILE_BYTES = REGISTRY.counter(
+    "devd_rbac_file_bytes_total",
+    "Resource file bytes by direction.",
+    ("direction",),
+)
@@ -0,0 +1,38 @@
+from . import metrics as sut
+
+
+def test_counter():
+    registry = sut.Registry()
+    counter = registry.counter("x_total", "Some xs.", ("kind",))
+    counter.inc("a")
+    counter.inc("a", value=2)
+    counter.labels('b"').inc(0.5)
+    assert registry.render() == (
+        "# HELP x_total Some xs.\n"
+        "# TYPE x_total counter\n"
+        'x_total{kind="a"} 3\n'
+        'x_total{kind="b\\""} 0.5\n'
+    )
+
+
+def test_histogram():
+    registry = sut.Registry()
+    histogram = registry.histogram("y", "Some ys.", buckets=(1, 2))
+    for value in (0.5, 1, 1.5, 3):
+        histogram.observe(value)
+    assert registry.render().splitlines()[2:] == [
+        'y_bucket{le="1"} 2',
+        'y_bucket{le="2"} 3',
+        'y_bucket{le="+Inf"} 4',
+        "y_sum 6",
+        "y_count 4",
+    ]
+
+
+def test_timer():
+    histogram = sut.Histogram("z_seconds", "Some time.", ("phase",))
+    with histogram.time("p"):
+        pass
+    child = histogram.labels("p")
+    assert sum(child.counts) == 1
+    assert 0 <= child.sum < 1
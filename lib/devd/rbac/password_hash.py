@@ -0,0 +1,88 @@
+"""
+Salted scrypt password hashes, as stored in password.txt:
+
+  password USERNAME scrypt$N$R$P$SALT$HASH
+
+SALT and HASH are URL-safe base64.
+Entries that are not hashes are compared as plaintext.
+"""
+
+from typing import List, Tuple
+import base64
+import getpass
+import hashlib
+import hmac
+import secrets
+import sys
+
+SCHEME = "scrypt"
+# About 50ms and 16MiB per hash:
+DEFAULT_N, DEFAULT_R, DEFAULT_P = 2**14, 8, 1
+SALT_LENGTH, HASH_LENGTH = 16, 32
+
+# (N, R, P):
+Cost = Tuple[int, int, int]
+
+
+def hash_password(
+    password: str,
+    n: int = DEFAULT_N,
+    r: int = DEFAULT_R,
+    p: int = DEFAULT_P,
+    salt: bytes | None = None,
+) -> str:
+    if salt is None:
+        salt = secrets.token_bytes(SALT_LENGTH)
+    digest = scrypt(password, salt, (n, r, p), HASH_LENGTH)
+    return "$".join(
+        (SCHEME, str(n), str(r), str(p), b64encode(salt), b64encode(digest))
+    )
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(SCHEME + "$")
+
+
+def check_password(stored: str, password: str) -> bool:
+    """Verify password against a stored hash or plaintext, in constant time."""
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        expected_digest = b64decode(expected)
+        cost = int(n), int(r), int(p)
+        digest = scrypt(password, b64decode(salt), cost, len(expected_digest))
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest, expected_digest)
+
+
+def scrypt(password: str, salt: bytes, cost: Cost, length: int) -> bytes:
+    n, r, p = cost
+    # scrypt needs 128 * n * r bytes:
+    maxmem = 128 * n * r * 2 + 1024 * 1024
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=length
+    )
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def main(argv: List[str]) -> None:
+    """
+    Usage: password_hash USERNAME
+    Prints a password.txt line for USERNAME, with the password read from a tty.
+    """
+    username = argv[1]
+    password = getpass.getpass(f"Password for {username}: ")
+    print(f"password {username} {hash_password(password)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
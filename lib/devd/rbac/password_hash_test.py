@@ -0,0 +1,17 @@
+from . import password_hash as sut
+
+
+def test_hash_and_check():
+    hashed = sut.hash_password("s3cret", n=2**4)
+    assert sut.is_hashed(hashed)
+    assert hashed.startswith("scrypt$16$8$1$")
+    assert hashed != sut.hash_password("s3cret", n=2**4)
+    assert sut.check_password(hashed, "s3cret")
+    assert not sut.check_password(hashed, "s3cre")
+
+
+def test_check_plaintext_and_malformed():
+    assert sut.check_password("s3cret", "s3cret")
+    assert not sut.check_password("s3cret", "wrong")
+    assert not sut.check_password("scrypt$16$8$1$!!$!!", "s3cret")
+    assert not sut.check_password("scrypt$15$8$1$AAAA$AAAA", "s3cret")
@@ -1,15 +1,22 @@
-from typing import Any, Self, Callable, Iterable
+from typing import Any, Self, Callable, Dict, Iterable, FrozenSet, List
 from dataclasses import dataclass, field
 import re
+import threading
 from .subject import User  # , Group
+from .util import MultiRegex
 
 
 class Matchable:
+    __slots__ = ("name", "description", "matcher", "regex", "literal", "negated")
+
     def __init__(self, name: str, description: str = "", matcher=None):
         self.name = name
         self.description = description
         self.matcher: Matcher = matcher or match_name
         self.regex = None
+        # The name matched exactly, if this only matches by name:
+        self.literal: str | None = None if matcher else name
+        self.negated = False
 
     def matches(self, other: Self) -> bool:
         return self.matcher(self, other)
@@ -52,23 +59,45 @@ def negate_matcher(matcher: Matcher) -> Matcher:
 
 
 class Resource(Matchable):
-    pass
+    __slots__ = ()
 
 
 class Action(Matchable):
-    pass
+    __slots__ = ()
 
 
 class Role(Matchable):
-    pass
+    """Roles have an integer id by name, for RoleSet bitsets."""
 
+    __slots__ = ("id",)
 
-@dataclass
+    def __init__(self, name: str, description: str = "", matcher=None):
+        super().__init__(name, description, matcher)
+        self.id = role_id(name)
+
+
+# Role name => id, for the life of the process.
+# Ids are not reused, so that RoleSets and RuleSets loaded at different times agree.
+# Role names come only from domain, auth and snapshot files, never from requests,
+# and reloading a file adds only names that are new to this process:
+# the table is bounded by the distinct role names ever loaded.
+ROLE_IDS: Dict[str, int] = {}
+ROLE_IDS_LOCK = threading.Lock()
+
+
+def role_id(name: str) -> int:
+    if (id_ := ROLE_IDS.get(name)) is None:
+        with ROLE_IDS_LOCK:
+            id_ = ROLE_IDS.setdefault(name, len(ROLE_IDS))
+    return id_
+
+
+@dataclass(frozen=True, slots=True)
 class Permission:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Rule:
     permission: Permission
     action: Action
@@ -80,12 +109,56 @@ class Rule:
         return f"({self.permission.name!r}, {self.action.name!r}, {self.role.name!r}, {self.resource.name!r})"
 
 
-@dataclass
+@dataclass(slots=True)
+class RuleSet:
+    """
+    The Rules of one auth file,
+    and one MultiRegex over all of their Resource patterns.
+    """
+
+    rules: List[Rule]
+    resource_regex: MultiRegex = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.resource_regex = MultiRegex(
+            (rule.resource.regex, rule.resource.negated) for rule in self.rules
+        )
+
+
+@dataclass(slots=True)
 class Membership:
     role: Role
     member: Any
 
 
+class RoleSet(frozenset):
+    """An immutable set of Roles with a bitset of their ids."""
+
+    __slots__ = ("bits",)
+
+    def __new__(cls, roles: Iterable[Role] = ()):
+        self = super().__new__(cls, roles)
+        bits = 0
+        for role in self:
+            bits |= 1 << role.id
+        self.bits = bits
+        return self
+
+    @property
+    def names(self) -> FrozenSet[str]:
+        return frozenset(role.name for role in self)
+
+
+def roles_match(pattern: Role, roles: Iterable[Role]) -> bool:
+    """True if the Role pattern matches any of roles."""
+    if pattern.literal is not None and isinstance(roles, RoleSet):
+        return bool(roles.bits >> pattern.id & 1)
+    for role in roles:
+        if pattern.matches(role):
+            return True
+    return False
+
+
 Resources = Iterable[Resource]
 Roles = Iterable[Role]
 Permissions = Iterable[Permission]
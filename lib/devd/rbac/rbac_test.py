@@ -1,6 +1,7 @@
 from pathlib import Path, PurePath
 from ..asserts import assert_output_by_key
 from . import Resource, Action, Request, Solver, Domain, TextLoader, DomainFileLoader
+from .rbac import Role, RoleSet, roles_match
 from .util import getter
 
 
@@ -135,3 +136,14 @@ def run_test(name, test_fun):
             test_fun(prt)
 
     assert_output_by_key(name, "tests/devd/output/rbac", proc)
+
+
+def test_role_set_bits():
+    admin, read = Role("admin-role"), Role("read-role")
+    roles = RoleSet([admin, read])
+    assert roles.bits == 1 << admin.id | 1 << read.id
+    assert roles.names == {"admin-role", "read-role"}
+    assert Role("admin-role").id == admin.id != read.id
+    assert roles_match(Role("read-role"), roles)
+    assert not roles_match(Role("write-role"), roles)
+    assert not hasattr(admin, "__dict__")
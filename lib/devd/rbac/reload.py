@@ -0,0 +1,280 @@
+"""
+Background reloading of domain and rule files.
+
+A Watcher reports changed paths: inotify on Linux, otherwise polling.
+The Reloader debounces bursts of changes, parses changed files
+in its own thread and swaps the results in whole:
+- domain files: the App's DomainState, by FileCache.refresh()
+- auth files: the RuleNode of their directory, by RuleTree.refresh()
+Request threads keep using the previous state until the swap
+and never wait for parsing.
+"""
+
+from typing import Any, Dict, Iterable, List, Set, Tuple
+from pathlib import Path
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from .rule_tree import FileKey, file_key
+
+# Reported when a Watcher lost events; everything must be checked:
+OVERFLOW = Path("/")
+
+
+class PollingWatcher:
+    """Compares the FileKeys of files every interval seconds."""
+
+    # Whether every directory is watched:
+    complete = True
+
+    def __init__(self, files: Iterable[Path], trees: Iterable[Path], file_name: str):
+        self.files, self.trees, self.file_name = list(files), list(trees), file_name
+        self.keys = self.scan()
+        self.closed = threading.Event()
+
+    def scan(self) -> Dict[Path, FileKey]:
+        keys = {path: file_key(path) for path in self.files}
+        for tree in self.trees:
+            for dir_path, _, file_names in os.walk(str(tree)):
+                if self.file_name in file_names:
+                    path = Path(dir_path) / self.file_name
+                    keys[path] = file_key(path)
+        return keys
+
+    def read(self, timeout: float | None) -> Set[Path]:
+        if self.closed.wait(timeout):
+            return set()
+        keys, old_keys = self.scan(), self.keys
+        self.keys = keys
+        return {
+            path
+            for path in keys.keys() | old_keys.keys()
+            if keys.get(path) != old_keys.get(path)
+        }
+
+    def close(self) -> None:
+        self.closed.set()
+
+
+class InotifyWatcher:
+    """
+    Watches the directories of files, and whole trees, with inotify.
+    Directories are watched rather than files,
+    so that files replaced by rename are seen.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+    WATCH_MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+    )
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, files: Iterable[Path], trees: Iterable[Path], file_name: str):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.file_name = file_name
+        self.paths: Dict[int, Path] = {}
+        # False once a directory could not be watched, e.g. for ENOSPC:
+        self.complete = True
+        for path in files:
+            self.watch(path.parent)
+        for tree in trees:
+            self.watch_tree(tree)
+
+    def watch(self, directory: Path) -> None:
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(str(directory)), self.WATCH_MASK
+        )
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch", str(directory))
+        self.paths[wd] = directory
+
+    def watch_tree(self, tree: Path) -> List[Path]:
+        """Watch tree and its subdirectories. Returns the auth files found."""
+        found = []
+        for dir_path, _, file_names in os.walk(str(tree)):
+            try:
+                self.watch(Path(dir_path))
+            except OSError as exc:
+                if self.complete:
+                    logging.warning("InotifyWatcher: %s", f"{exc!r}")
+                self.complete = False
+                continue
+            if self.file_name in file_names:
+                found.append(Path(dir_path) / self.file_name)
+        return found
+
+    def read(self, timeout: float | None) -> Set[Path]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed: Set[Path] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                changed.add(OVERFLOW)
+            elif mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+            elif (directory := self.paths.get(wd)) is not None:
+                path = directory / name if name else directory
+                changed.add(path)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    changed.update(self.watch_tree(path))
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def make_watcher(files: List[Path], trees: List[Path], file_name: str) -> Any:
+    try:
+        watcher = InotifyWatcher(files, trees, file_name)
+    except (OSError, AttributeError, TypeError) as exc:
+        logging.info("make_watcher: %s", f"polling: {exc!r}")
+        return PollingWatcher(files, trees, file_name)
+    if not watcher.complete:
+        logging.warning("make_watcher: %s", "polling: some directories not watched")
+        watcher.close()
+        return PollingWatcher(files, trees, file_name)
+    return watcher
+
+
+class Reloader:
+    """
+    Reloads an App's domain files and auth files when they change.
+    Changes are applied once no more arrive for debounce seconds.
+    While running, requests do not check files themselves,
+    even for directories without an auth file.
+    If the watcher stops seeing every directory, the Reloader polls instead.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        debounce: float = 0.2,
+        poll_interval: float = 1.0,
+        watcher: Any = None,
+    ):
+        self.app, self.debounce, self.poll_interval = app, debounce, poll_interval
+        self.domain_files = set(app.domain_files())
+        self.resource_root = app.resource_root
+        self.auth_file_name = app.rule_tree.loader.auth_file_name
+        self.watcher = watcher
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.reload_count = 0
+
+    def start(self) -> None:
+        if self.watcher is None:
+            self.watcher = make_watcher(*self.watch_args())
+        self.app.state_cache.check_interval = float("inf")
+        self.app.rule_tree.check_interval = float("inf")
+        self.thread = threading.Thread(target=self.run, name="Reloader", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.watcher.close()
+        self.app.state_cache.check_interval = self.app.rule_check_interval
+        self.app.rule_tree.check_interval = self.app.rule_check_interval
+
+    def run(self) -> None:
+        # Parse all auth files now, and pick up changes made before the watcher started:
+        self.apply({OVERFLOW, *self.auth_files()})
+        while not self.stopped.is_set():
+            if not self.watcher.complete:
+                self.fall_back()
+                continue
+            if not (changed := self.watcher.read(self.poll_interval)):
+                continue
+            # Wait for quiet, but not forever:
+            deadline = time.monotonic() + self.debounce * 10
+            while time.monotonic() < deadline and (
+                more := self.watcher.read(self.debounce)
+            ):
+                changed |= more
+            self.apply(changed)
+
+    def watch_args(self) -> Tuple[List[Path], List[Path], str]:
+        return sorted(self.domain_files), [self.resource_root], self.auth_file_name
+
+    def fall_back(self) -> None:
+        """Replace an incomplete watcher by a PollingWatcher."""
+        logging.warning("Reloader: %s", "polling: some directories not watched")
+        self.watcher.close()
+        self.watcher = PollingWatcher(*self.watch_args())
+        # Changes may have been missed:
+        self.apply({OVERFLOW})
+
+    def auth_files(self) -> Iterable[Path]:
+        for dir_path, _, file_names in os.walk(str(self.resource_root)):
+            if self.auth_file_name in file_names:
+                yield Path(dir_path) / self.auth_file_name
+
+    def apply(self, changed: Set[Path]) -> None:
+        try:
+            self.reload(changed)
+        # pylint: disable-next=broad-except
+        except Exception as exc:
+            logging.error("Reloader: %s", f"{exc!r}")
+
+    def reload(self, changed: Set[Path]) -> None:
+        """Reload the domain state and the rule nodes affected by changed paths."""
+        self.reload_count += 1
+        everything = OVERFLOW in changed
+        if everything or changed & self.domain_files:
+            self.app.state_cache.refresh()
+        rule_tree = self.app.rule_tree
+        directories = set(rule_tree.directories()) if everything else set()
+        for path in changed:
+            try:
+                relative = path.relative_to(self.resource_root)
+            except ValueError:
+                continue
+            if path.name == self.auth_file_name:
+                directories.add(Path("/") / relative.parent)
+            elif not everything:
+                # A directory may have been created, removed or renamed:
+                prefix = Path("/") / relative
+                directories.update(
+                    d for d in rule_tree.directories() if d.is_relative_to(prefix)
+                )
+        for directory in directories:
+            rule_tree.refresh(directory)
+        logging.info(
+            "Reloader: %s", f"{len(changed)} changes, {len(directories)} rule nodes"
+        )
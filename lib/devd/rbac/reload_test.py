@@ -0,0 +1,173 @@
+from pathlib import Path
+import shutil
+import threading
+import time
+import pytest
+from .app import App
+from .rbac import ROLE_IDS
+from . import reload as sut
+
+data_dir = Path("tests/data/rbac")
+
+
+@pytest.fixture(name="app")
+def fixture_app(tmp_path):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    return App(
+        resource_root=str(tmp_path / "root"), domain_root=str(tmp_path / "domain")
+    )
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_reload_swaps_domain_state(app):
+    reloader = sut.Reloader(app, watcher=sut.PollingWatcher([], [], ".rbac.txt"))
+    app.state_cache.check_interval = float("inf")
+    state = app.state
+    assert app.is_allowed("PUT", "/a/b/x.txt", "bob")[0] is False
+    role_file = app.domain_root / "role.txt"
+    role_file.write_text("member write-role Readers\n", encoding="utf-8")
+    assert app.state is state
+    reloader.reload({role_file})
+    assert app.state is not state
+    assert app.authenticator is app.state.authenticator
+    assert app.is_allowed("PUT", "/a/b/x.txt", "bob")[0] is True
+
+
+def test_reload_rule_nodes(app):
+    reloader = sut.Reloader(app, watcher=sut.PollingWatcher([], [], ".rbac.txt"))
+    app.rule_tree.check_interval = float("inf")
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is True
+    auth_file = app.resource_root / "a/b/.rbac.txt"
+    auth_file.write_text("rule deny PUT write-role *.txt\n", encoding="utf-8")
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is True
+    reloader.reload({auth_file})
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is False
+    shutil.rmtree(app.resource_root / "a/b")
+    reloader.reload({app.resource_root / "a"})
+    assert app.rule_tree.node(Path("/a/b")).rules == []
+
+
+def test_role_ids_are_bounded_across_reloads(app):
+    app.warm_up()
+    count = len(ROLE_IDS)
+    for _ in range(3):
+        app.state_cache.reload()
+        app.rule_tree.reload()
+        app.warm_up()
+    assert len(ROLE_IDS) == count
+    role_file = app.domain_root / "role.txt"
+    text = role_file.read_text(encoding="utf-8")
+    role_file.write_text(text + "member reload-test-role bob\n", encoding="utf-8")
+    for _ in range(3):
+        app.state_cache.reload()
+        app.warm_up()
+    assert len(ROLE_IDS) == count + 1
+
+
+def test_polling_watcher(tmp_path):
+    (tmp_path / "d").mkdir()
+    watcher = sut.PollingWatcher([tmp_path / "f.txt"], [tmp_path], ".rbac.txt")
+    assert watcher.read(0) == set()
+    (tmp_path / "f.txt").write_text("x")
+    (tmp_path / "d/.rbac.txt").write_text("x")
+    assert watcher.read(0) == {tmp_path / "f.txt", tmp_path / "d/.rbac.txt"}
+    watcher.close()
+    assert watcher.read(0) == set()
+
+
+def test_inotify_watcher(tmp_path):
+    watcher = sut.InotifyWatcher([], [tmp_path], ".rbac.txt")
+    try:
+        (tmp_path / "d").mkdir()
+        assert tmp_path / "d" in watcher.read(1.0)
+        (tmp_path / "d/.rbac.txt").write_text("x")
+        assert tmp_path / "d/.rbac.txt" in watcher.read(1.0)
+        assert watcher.read(0) == set()
+    finally:
+        watcher.close()
+
+
+def fail_watch(tmp_path, monkeypatch):
+    """Make inotify_add_watch fail for tmp_path/full, as if out of watches."""
+    watch = sut.InotifyWatcher.watch
+
+    def watch_or_fail(self, directory):
+        if directory.name == "full":
+            raise OSError(28, "inotify_add_watch", str(directory))
+        watch(self, directory)
+
+    monkeypatch.setattr(sut.InotifyWatcher, "watch", watch_or_fail)
+    (tmp_path / "full").mkdir()
+
+
+def test_make_watcher_falls_back_to_polling(tmp_path, monkeypatch, caplog):
+    fail_watch(tmp_path, monkeypatch)
+    watcher = sut.make_watcher([], [tmp_path], ".rbac.txt")
+    assert isinstance(watcher, sut.PollingWatcher)
+    assert "inotify_add_watch" in caplog.text
+    (tmp_path / "full" / ".rbac.txt").write_text("x")
+    assert watcher.read(0) == {tmp_path / "full" / ".rbac.txt"}
+
+
+def test_reloader_falls_back_to_polling(app, monkeypatch, caplog):
+    root = app.resource_root
+    watcher = sut.InotifyWatcher([], [root], ".rbac.txt")
+    reloader = sut.Reloader(app, debounce=0.01, poll_interval=0.05, watcher=watcher)
+    reloader.start()
+    try:
+        assert wait_for(lambda: reloader.reload_count >= 1)
+        fail_watch(root, monkeypatch)
+        assert wait_for(lambda: isinstance(reloader.watcher, sut.PollingWatcher))
+        assert "polling" in caplog.text
+        (root / "full" / ".rbac.txt").write_text("rule deny * * *\n")
+        assert wait_for(lambda: Path("/full") in app.rule_tree.directories())
+    finally:
+        reloader.stop()
+
+
+def test_requests_do_not_check_files_while_reloader_runs(app, monkeypatch):
+    reloader = sut.Reloader(app, watcher=sut.PollingWatcher([], [], ".rbac.txt"))
+    paths = ["/a/b/x.txt", "/a/missing/x.txt", "/pub/new/deeper/x.txt"]
+    reloader.start()
+    try:
+        for path in paths:
+            app.is_allowed("GET", path, "bob")
+        calls = []
+
+        def counting(file_key):
+            def wrapper(*args):
+                if threading.current_thread() is threading.main_thread():
+                    calls.append(args)
+                return file_key(*args)
+
+            return wrapper
+
+        for cache in (app.rule_tree, app.state_cache):
+            monkeypatch.setattr(cache, "file_key", counting(cache.file_key))
+        for path in paths:
+            app.is_allowed("GET", path, "bob")
+        assert not calls
+    finally:
+        reloader.stop()
+
+
+def test_start_reloader(app):
+    reloader = app.start_reloader(debounce=0.01, poll_interval=0.05)
+    try:
+        assert wait_for(lambda: reloader.reload_count >= 1)
+        assert Path("/pub") in app.rule_tree.directories()
+        user_file = app.domain_root / "user.txt"
+        user_file.write_text("user bob Writers\n", encoding="utf-8")
+        assert wait_for(lambda: app.subject_domain.user_by_name("alice") is None)
+        assert app.is_allowed("PUT", "/a/b/x.txt", "bob")[0] is True
+    finally:
+        reloader.stop()
+    assert app.rule_tree.check_interval == app.rule_check_interval
@@ -0,0 +1,171 @@
+from typing import Dict, Iterable, List, Self, Tuple
+from dataclasses import dataclass, field
+from .rbac import (
+    Request,
+    Resource,
+    Rule,
+    Rules,
+    RuleSet,
+    Roles,
+    roles_match,
+)
+from .util import MultiRegex, mapcat, getter
+from .domain import RuleDomain
+from .loader import NON_LITERAL_RX
+from .metrics import RULES_EVALUATED
+
+# Sets of rules are represented as int bitmasks of rule positions.
+RuleMask = int
+
+
+class TrieNode:
+    def __init__(self):
+        self.children: Dict[str, TrieNode] = {}
+        self.mask: RuleMask = 0
+
+
+class RuleIndex:
+    """
+    Index of candidate Rules for a Request:
+    - by literal action name
+    - by literal role name
+    - by the literal leading path segments of the resource pattern, in a trie
+    Rules with non-literal actions or roles are always candidates.
+    Candidates must still be verified by RuleDomain.rule_matches.
+    """
+
+    def __init__(self, rules: Rules):
+        self.all_mask: RuleMask = 0
+        self.action_masks: Dict[str, RuleMask] = {}
+        self.any_action_mask: RuleMask = 0
+        # By Role id:
+        self.role_masks: Dict[int, RuleMask] = {}
+        self.any_role_mask: RuleMask = 0
+        self.resource_trie = TrieNode()
+        for i, rule in enumerate(rules):
+            self.add(1 << i, rule)
+
+    def add(self, bit: RuleMask, rule: Rule) -> None:
+        self.all_mask |= bit
+        if (action := rule.action.literal) is not None:
+            self.action_masks[action] = self.action_masks.get(action, 0) | bit
+        else:
+            self.any_action_mask |= bit
+        if rule.role.literal is not None:
+            role = rule.role.id
+            self.role_masks[role] = self.role_masks.get(role, 0) | bit
+        else:
+            self.any_role_mask |= bit
+        node = self.resource_trie
+        for segment in literal_prefix(rule.resource):
+            node = node.children.setdefault(segment, TrieNode())
+        node.mask |= bit
+
+    def candidates(self, request: Request, roles: Roles) -> RuleMask:
+        mask = self.any_action_mask | self.action_masks.get(request.action.name, 0)
+        if not mask:
+            return 0
+        role_mask = self.any_role_mask
+        for role in roles:
+            role_mask |= self.role_masks.get(role.id, 0)
+        mask &= role_mask
+        if not mask:
+            return 0
+        return mask & self.resource_mask(request.resource.name)
+
+    def resource_mask(self, path: str) -> RuleMask:
+        node = self.resource_trie
+        mask = node.mask
+        for segment in path.split("/"):
+            if not (node := node.children.get(segment)):
+                break
+            mask |= node.mask
+        return mask
+
+
+def literal_prefix(resource: Resource) -> List[str]:
+    """
+    The leading path segments of a resource pattern
+    that any matching path must start with.
+    Negated patterns have no such prefix.
+    """
+    if resource.negated:
+        return []
+    prefix = []
+    for segment in resource.name.split("/"):
+        if NON_LITERAL_RX.search(segment):
+            break
+        prefix.append(segment)
+    return prefix
+
+
+def mask_positions(mask: RuleMask) -> Iterable[int]:
+    """Yield the positions of the bits in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+@dataclass
+class IndexedRuleDomain(RuleDomain):
+    """
+    A RuleDomain that only checks candidate Rules from a RuleIndex.
+    Resource patterns are matched by the MultiRegex of each RuleSet
+    that has candidates.
+    Results are identical to RuleDomain.find_rules,
+    which is available as linear_find_rules for cross-checking.
+    """
+
+    rule_sets: List[RuleSet] | None = field(default=None, repr=False, compare=False)
+    index: RuleIndex = field(init=False, repr=False, compare=False)
+    resource_regexes: List[Tuple[int, RuleMask, MultiRegex]] = field(
+        init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_rule_sets(cls, rule_sets: List[RuleSet]) -> Self:
+        return cls(rules=mapcat(getter("rules"), rule_sets), rule_sets=rule_sets)
+
+    def __post_init__(self):
+        self.rules = list(self.rules)
+        if self.rule_sets is None:
+            self.rule_sets = [RuleSet(rules=self.rules)]
+        self.index = RuleIndex(self.rules)
+        self.resource_regexes, offset = [], 0
+        for rule_set in self.rule_sets:
+            n_rules = len(rule_set.rules)
+            rule_set_mask = ((1 << n_rules) - 1) << offset
+            self.resource_regexes.append(
+                (offset, rule_set_mask, rule_set.resource_regex)
+            )
+            offset += n_rules
+        assert offset == len(self.rules)
+
+    def find_rules(
+        self, request: Request, roles: Roles, max_rules: int | None = None
+    ) -> Rules:
+        rules, evaluated = [], 0
+        if mask := self.index.candidates(request, roles):
+            mask &= self.resource_mask(request.resource.name, mask)
+        for i in mask_positions(mask):
+            evaluated += 1
+            rule = self.rules[i]
+            if rule.action.matches(request.action) and roles_match(rule.role, roles):
+                rules.append(rule)
+                if max_rules and len(rules) >= max_rules:
+                    break
+        RULES_EVALUATED.observe(evaluated)
+        return rules
+
+    def resource_mask(self, path: str, candidates: RuleMask) -> RuleMask:
+        mask = 0
+        for offset, rule_set_mask, resource_regex in self.resource_regexes:
+            if candidates & rule_set_mask:
+                mask |= resource_regex.match_mask(path) << offset
+        return mask
+
+    def linear_find_rules(
+        self, request: Request, roles: Roles, max_rules: int | None = None
+    ) -> Rules:
+        return RuleDomain.find_rules(self, request, roles, max_rules)
@@ -0,0 +1,94 @@
+from pathlib import Path
+import functools
+from . import Resource, Action, Request, DomainFileLoader, EffectiveRoles
+from .loader import FileSystemLoader
+from . import rule_index as sut
+
+base_dir = Path("tests/data/rbac")
+resource_root = base_dir / "root"
+domain_base = base_dir / "domain"
+
+resources = (
+    "/nope",
+    "/.hidden",
+    "/a/1",
+    "/a/.hidden",
+    "/a/writable.txt",
+    "/a/b/2",
+    "/a/b/c.txt",
+    "/a/b/.hidden",
+    "/pub/x",
+    "/pub/.x",
+    "/pub/d/x",
+    "/pub/d/.x",
+    "/.rbac.txt",
+    "/a/b/c/.rbac.txt",
+)
+actions = ("GET", "HEAD", "PUT", "DELETE")
+
+
+def checks():
+    """(resource, request, roles) for each resource, action, user and role lookup."""
+    loader = DomainFileLoader()
+    subject_domain = loader.load_user_file(domain_base / "user.txt")
+    role_domain = loader.load_membership_file(domain_base / "role.txt")
+    effective_roles = EffectiveRoles(subject_domain, role_domain)
+    for resource in resources:
+        for action in actions:
+            for user in subject_domain.users:
+                request = Request(Resource(resource), Action(action), user)
+                for roles in (
+                    effective_roles.roles_for_user(user),
+                    role_domain.roles_for_user(user),
+                ):
+                    yield resource, request, roles
+
+
+@functools.cache
+def rules_domain(resource: str) -> sut.IndexedRuleDomain:
+    rules = DomainFileLoader().load_rules_for_resource(resource_root, Path(resource))
+    return sut.IndexedRuleDomain(rules=rules.rules)
+
+
+@functools.cache
+def rule_sets_domain(resource: str) -> sut.IndexedRuleDomain:
+    loader = FileSystemLoader(resource_root=resource_root)
+    rule_sets = [
+        loader.load_rule_set(path) for path in loader.resource_paths(Path(resource))
+    ]
+    return sut.IndexedRuleDomain.from_rule_sets(rule_sets)
+
+
+def test_indexed_rule_domain_matches_linear():
+    n_checks = 0
+    for resource, request, roles in checks():
+        rule_domain = rules_domain(resource)
+        expected = rule_domain.linear_find_rules(request, roles)
+        assert rule_domain.find_rules(request, roles) == expected
+        assert rule_domain.find_rules(request, roles, 1) == expected[:1]
+        n_checks += 1
+    assert n_checks == len(resources) * len(actions) * 6 * 2
+
+
+def test_indexed_rule_domain_from_rule_sets():
+    for resource, request, roles in checks():
+        expected = rules_domain(resource).linear_find_rules(request, roles)
+        found = rule_sets_domain(resource).find_rules(request, roles)
+        assert briefs(found) == briefs(expected)
+
+
+def briefs(rules):
+    return [rule.brief() for rule in rules]
+
+
+def test_literal_prefix():
+    loader = DomainFileLoader()
+    rules = loader.load_rules_for_resource(resource_root, Path("/a/b/x")).rules
+    prefixes = ["/".join(sut.literal_prefix(rule.resource)) for rule in rules]
+    assert prefixes[:6] == ["/a/b", "/a/b", "/a/b", "/a", "/a", "/a/writable.txt"]
+    assert prefixes[-1] == ""
+
+
+def test_mask_positions():
+    assert not list(sut.mask_positions(0))
+    assert list(sut.mask_positions(0b101001)) == [0, 3, 5]
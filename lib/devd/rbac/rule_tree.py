@@ -0,0 +1,217 @@
+from typing import Any, Callable, Iterable, List, Tuple, Type
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import time
+import threading
+from .rbac import Rules, RuleSet
+from .domain import RuleDomain
+from .loader import FileSystemLoader
+from .cache import LRUCache
+from .metrics import PHASE_SECONDS
+
+FileKey = Tuple[int, int, int, int] | None
+
+LOAD_RULES_SECONDS = PHASE_SECONDS.labels("load.rules")
+COMPILE_RULES_SECONDS = PHASE_SECONDS.labels("compile.rules")
+
+
+def file_key(path: Path) -> FileKey:
+    """
+    Identify a version of a file by (device, inode, size, mtime).
+    Returns None if the file does not exist.
+    """
+    try:
+        stat = os.stat(str(path))
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+@dataclass(eq=False)
+class RuleNode:
+    """The compiled rules of one directory's auth file."""
+
+    directory: Path
+    file_key: FileKey
+    rule_set: RuleSet
+    checked_at: float
+
+    @property
+    def rules(self) -> Rules:
+        return self.rule_set.rules
+
+
+RuleNodes = Tuple[RuleNode, ...]
+
+
+class RuleTree:
+    """
+    Cache of compiled rules keyed by directory.
+
+    A node is revalidated against its auth file's FileKey
+    at most once every check_interval seconds.
+    A RuleDomain is cached for each parent directory
+    until any node in its ancestry is replaced.
+
+    Directories without an auth file get an empty node with file_key None,
+    revalidated like the others. Directories are named by clients,
+    so both caches are bounded.
+    """
+
+    def __init__(
+        self,
+        loader: FileSystemLoader,
+        check_interval: float = 1.0,
+        rule_domain_class: Type[RuleDomain] = RuleDomain,
+        max_nodes: int = 100_000,
+        max_domains: int = 10_000,
+    ):
+        self.loader = loader
+        self.check_interval = check_interval
+        self.rule_domain_class = rule_domain_class
+        self.clock = time.monotonic
+        self.file_key = file_key
+        # Directory => RuleNode:
+        self.nodes = LRUCache(max_size=max_nodes)
+        # Parent directory => (RuleNodes, RuleDomain):
+        self.domains = LRUCache(max_size=max_domains)
+        # Shared by the nodes of directories without an auth file:
+        self.empty_rule_set = RuleSet(rules=[])
+        self.lock = threading.Lock()
+        self.load_count = 0
+
+    def rule_domain_for_resource(self, resource: Path) -> RuleDomain:
+        paths = self.loader.resource_paths(resource)
+        key = paths[0] if paths else None
+        nodes = tuple(self.node(path) for path in paths)
+        if cached := self.domains.get(key):
+            cached_nodes, rule_domain = cached
+            if same_nodes(cached_nodes, nodes):
+                return rule_domain
+        rule_domain = self.make_rule_domain(nodes)
+        self.domains.put(key, (nodes, rule_domain))
+        return rule_domain
+
+    def make_rule_domain(self, nodes: RuleNodes) -> RuleDomain:
+        with COMPILE_RULES_SECONDS.time():
+            return self.rule_domain_class.from_rule_sets(
+                [node.rule_set for node in nodes]
+            )
+
+    def rules_for_resource(self, resource: Path) -> Rules:
+        return self.rule_domain_for_resource(resource).rules
+
+    def node(self, directory: Path) -> RuleNode:
+        now = self.clock()
+        node = self.nodes.get(directory)
+        if node and now - node.checked_at < self.check_interval:
+            return node
+        return self.refresh(directory, now)
+
+    def refresh(self, directory: Path, now: float | None = None) -> RuleNode:
+        """Revalidate the node of directory now, reloading it if its file changed."""
+        if now is None:
+            now = self.clock()
+        node = self.nodes.get(directory)
+        key = self.file_key(self.loader.auth_file(directory))
+        if node and node.file_key == key:
+            node.checked_at = now
+            return node
+        with self.lock:
+            node = self.nodes.get(directory)
+            if not (node and node.file_key == key):
+                node = self.load_node(directory, key, now)
+                self.nodes.put(directory, node)
+            return node
+
+    def directories(self) -> List[Path]:
+        """The directories with a cached node."""
+        return self.nodes.keys()
+
+    def load_node(self, directory: Path, key: FileKey, now: float) -> RuleNode:
+        if key is None:
+            rule_set = self.empty_rule_set
+        else:
+            self.load_count += 1
+            with LOAD_RULES_SECONDS.time():
+                rule_set = self.loader.load_rule_set(directory)
+        return RuleNode(
+            directory=directory, file_key=key, rule_set=rule_set, checked_at=now
+        )
+
+    def seed(self, directory: Path, key: FileKey, rule_set: RuleSet) -> None:
+        """
+        Add a node compiled elsewhere from the auth file with FileKey key.
+        It is revalidated on first use.
+        """
+        with self.lock:
+            self.nodes.put(
+                directory,
+                RuleNode(
+                    directory=directory,
+                    file_key=key,
+                    rule_set=rule_set,
+                    checked_at=float("-inf"),
+                ),
+            )
+
+    def reload(self, directories: Iterable[Path] | None = None) -> None:
+        """Drop cached nodes for directories, or all nodes."""
+        with self.lock:
+            if directories is None:
+                self.nodes.clear()
+                self.domains.clear()
+            else:
+                for directory in directories:
+                    self.nodes.pop(directory)
+
+
+class FileCache:
+    """
+    The result of loading a file,
+    reloaded when the file's FileKey changes.
+    The FileKey is checked at most once every check_interval seconds.
+    """
+
+    def __init__(
+        self, path: Path, load: Callable[[Path], Any], check_interval: float = 1.0
+    ):
+        self.path, self.load, self.check_interval = path, load, check_interval
+        self.clock = time.monotonic
+        self.file_key = file_key
+        self.key: FileKey = None
+        self.checked_at: float | None = None
+        self.value: Any = None
+        self.lock = threading.Lock()
+        self.load_count = 0
+
+    def get(self) -> Any:
+        now = self.clock()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return self.value
+        return self.refresh(now)
+
+    def refresh(self, now: float | None = None) -> Any:
+        """
+        Check the FileKey now, reloading if it changed.
+        The new value replaces the old one only after it is loaded.
+        """
+        if now is None:
+            now = self.clock()
+        key = self.file_key(self.path)
+        with self.lock:
+            if self.checked_at is None or key != self.key:
+                self.load_count += 1
+                self.value = self.load(self.path)
+                self.key = key
+            self.checked_at = now
+            return self.value
+
+    def reload(self) -> None:
+        with self.lock:
+            self.checked_at = None
+
+
+def same_nodes(a: RuleNodes, b: RuleNodes) -> bool:
+    return len(a) == len(b) and all(x is y for x, y in zip(a, b))
@@ -0,0 +1,77 @@
+from pathlib import Path
+import os
+from .loader import FileSystemLoader
+from . import rule_tree as sut
+
+
+def make_tree(root: Path) -> sut.RuleTree:
+    (root / "a").mkdir()
+    (root / ".rbac.txt").write_text("rule allow GET * **\n", encoding="utf-8")
+    (root / "a" / ".rbac.txt").write_text("rule deny PUT * *\n", encoding="utf-8")
+    return sut.RuleTree(FileSystemLoader(resource_root=root), check_interval=0)
+
+
+def test_rule_tree_caches_nodes(tmp_path):
+    tree = make_tree(tmp_path)
+    rules_1 = tree.rules_for_resource(Path("/a/f.txt"))
+    rules_2 = tree.rules_for_resource(Path("/a/f.txt"))
+    assert [rule.brief() for rule in rules_1] == [
+        "('deny', 'PUT', '*', '/a/*')",
+        "('allow', 'GET', '*', '/**')",
+    ]
+    assert rules_2 is rules_1
+    assert tree.load_count == 2
+    assert tree.rule_domain_for_resource(Path("/a/g.txt")) is (
+        tree.rule_domain_for_resource(Path("/a/f.txt"))
+    )
+
+
+def test_rule_tree_invalidates_changed_file(tmp_path):
+    tree = make_tree(tmp_path)
+    tree.rules_for_resource(Path("/a/f.txt"))
+    auth_file = tmp_path / "a" / ".rbac.txt"
+    auth_file.write_text("rule allow PUT * *.txt\nrule deny * * *\n", encoding="utf-8")
+    stat = auth_file.stat()
+    os.utime(auth_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    rules = tree.rules_for_resource(Path("/a/f.txt"))
+    assert len(rules) == 3
+    assert tree.load_count == 3
+
+
+def test_rule_tree_check_interval(tmp_path):
+    tree = make_tree(tmp_path)
+    tree.check_interval = 60
+    tree.rules_for_resource(Path("/a/f.txt"))
+    (tmp_path / "a" / ".rbac.txt").unlink()
+    assert len(tree.rules_for_resource(Path("/a/f.txt"))) == 2
+    tree.reload()
+    assert len(tree.rules_for_resource(Path("/a/f.txt"))) == 1
+    assert tree.load_count == 3
+
+
+def test_rule_tree_caches_missing_directories(tmp_path):
+    tree = make_tree(tmp_path)
+    tree.check_interval = 60
+    tree.rules_for_resource(Path("/a/missing/f.txt"))
+    calls = []
+    file_key = tree.file_key
+    tree.file_key = lambda path: calls.append(path) or file_key(path)
+    assert len(tree.rules_for_resource(Path("/a/missing/f.txt"))) == 2
+    assert not calls
+    assert tree.node(Path("/a/missing")).file_key is None
+    tree.nodes.max_size = 10
+    for i in range(100):
+        rules = tree.rules_for_resource(Path(f"/a/missing-{i}/x/f.txt"))
+        assert len(rules) == 2
+    assert len(tree.nodes) == 10
+    assert tree.load_count == 2
+
+
+def test_rule_tree_bounds_caches(tmp_path):
+    tree = make_tree(tmp_path)
+    tree.nodes.max_size = tree.domains.max_size = 1
+    for i in range(10):
+        (tmp_path / f"d{i}").mkdir()
+        (tmp_path / f"d{i}" / ".rbac.txt").write_text("rule deny * * *\n")
+        assert len(tree.rules_for_resource(Path(f"/d{i}/f.txt"))) == 2
+    assert len(tree.nodes) == len(tree.domains) == 1
@@ -0,0 +1,317 @@
+"""
+Pre-forked multi-process API server.
+
+The master process compiles the domain and rule files into a snapshot,
+loads an App from it, and forks workers that accept on one listening socket.
+Python objects cannot be placed in shared memory, so workers share
+the master's compiled state copy-on-write;
+gc.freeze() keeps the collector from touching, and so copying, those pages.
+
+On SIGHUP, or when a domain or auth file changes, the master
+recompiles the snapshot, reloads it once, freezes the new state,
+and replaces each worker by a fresh fork: the new worker starts
+accepting before the old one is sent SIGTERM and finishes its requests.
+So workers never hold private copies of the state.
+Workers that exit unexpectedly are replaced.
+"""
+
+from typing import Any, Dict, List, Set
+from dataclasses import dataclass
+from pathlib import Path
+import gc
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import uvicorn
+from .app import App
+from .reload import OVERFLOW, make_watcher
+from .snapshot import compile_snapshot, write_snapshot
+from ..util import parse_args, restart_log_queues, setup_logging
+
+
+@dataclass
+class ServerOptions:
+    host: str = "0.0.0.0"
+    port: int = 8888
+    # 0 for one per CPU:
+    workers: int = 0
+    # A temporary file if None:
+    snapshot_path: str | None = None
+    watch: bool = True
+    debounce: float = 0.2
+    poll_interval: float = 1.0
+    token_format: str = "compact"
+    # Workers share sessions only through a session_path:
+    session_path: str | None = None
+
+
+class PreforkServer:
+    def __init__(
+        self,
+        resource_root: str,
+        domain_root: str,
+        options: ServerOptions | None = None,
+    ):
+        options = options or ServerOptions()
+        self.resource_root, self.domain_root = Path(resource_root), Path(domain_root)
+        self.host, self.port = options.host, options.port
+        self.workers = options.workers or os.cpu_count() or 1
+        self.snapshot_dir: str | None = None
+        if not (snapshot_path := options.snapshot_path):
+            self.snapshot_dir = tempfile.mkdtemp(prefix="devd-rbac-")
+            snapshot_path = f"{self.snapshot_dir}/domain.snapshot"
+        self.snapshot_path = Path(snapshot_path)
+        self.watch, self.debounce = options.watch, options.debounce
+        self.poll_interval = options.poll_interval
+        self.token_format = options.token_format
+        self.session_path = options.session_path
+        self.sock: socket.socket | None = None
+        self.app: Any = None
+        # Worker pid => index:
+        self.pids: Dict[int, int] = {}
+        # Replaced workers, finishing their requests:
+        self.retiring: Set[int] = set()
+        self.stopping = False
+        self.reload_requested = False
+        self.reload_count = 0
+
+    def run(self) -> None:
+        """Serve until SIGTERM or SIGINT."""
+        self.sock = socket.create_server((self.host, self.port), backlog=2048)
+        self.sock.set_inheritable(True)
+        if (
+            self.token_format == "session"
+            and self.workers > 1
+            and not self.session_path
+        ):
+            logging.warning("PreforkServer: sessions are not shared by workers")
+        self.compile()
+        self.app = self.make_app()
+        self.freeze()
+        signal.signal(signal.SIGHUP, self.on_reload_signal)
+        signal.signal(signal.SIGTERM, self.on_stop_signal)
+        signal.signal(signal.SIGINT, self.on_stop_signal)
+        try:
+            for index in range(self.workers):
+                self.spawn(index)
+            self.supervise()
+        finally:
+            self.shutdown()
+
+    def compile(self) -> None:
+        write_snapshot(
+            self.snapshot_path, compile_snapshot(self.domain_root, self.resource_root)
+        )
+
+    def make_app(self) -> App:
+        app = App(
+            resource_root=str(self.resource_root),
+            domain_root=str(self.domain_root),
+            snapshot_path=str(self.snapshot_path),
+            token_format=self.token_format,
+            session_path=self.session_path,
+        )
+        # Files are checked by the master only:
+        app.watch_files = False
+        app.state_cache.check_interval = float("inf")
+        app.rule_tree.check_interval = float("inf")
+        app.warm_up()
+        return app
+
+    def freeze(self) -> None:
+        """Move the compiled state out of the collector's reach, before forking."""
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    ######################################
+    # Master
+
+    def supervise(self) -> None:
+        watcher = None
+        if self.watch:
+            watcher = make_watcher(
+                self.app.domain_files(),
+                [self.resource_root],
+                self.app.rule_tree.loader.auth_file_name,
+            )
+        try:
+            while not self.stopping:
+                changed: Set[Path] = set()
+                if watcher:
+                    changed = self.relevant(watcher.read(self.poll_interval))
+                    while changed and (more := watcher.read(self.debounce)):
+                        changed |= self.relevant(more)
+                else:
+                    time.sleep(self.poll_interval)
+                if (changed or self.reload_requested) and not self.stopping:
+                    self.reload_requested = False
+                    self.reload()
+                self.reap()
+        finally:
+            if watcher:
+                watcher.close()
+
+    def relevant(self, changed: Set[Path]) -> Set[Path]:
+        """
+        Changes that can affect the snapshot:
+        not writes to resources, nor to the snapshot itself.
+        """
+        domain_files = set(self.app.domain_files())
+        auth_file_name = self.app.rule_tree.loader.auth_file_name
+        return {
+            path
+            for path in changed
+            if path == OVERFLOW
+            or path in domain_files
+            or path.name == auth_file_name
+            or (path.is_relative_to(self.resource_root) and path.is_dir())
+        }
+
+    def reload(self) -> None:
+        """Recompile the snapshot, reload it here, and replace the workers."""
+        try:
+            self.compile()
+        # pylint: disable-next=broad-except
+        except Exception as exc:
+            logging.error("PreforkServer: reload: %r", exc)
+            return
+        self.reload_count += 1
+        # Workers forked from now on start with the new state:
+        self.app.reload_snapshot()
+        self.app.warm_up()
+        self.freeze()
+        self.replace_workers()
+        logging.info("PreforkServer: reload %d", self.reload_count)
+
+    def replace_workers(self) -> None:
+        """Fork a new worker for each, then stop the old one gracefully."""
+        for pid, index in list(self.pids.items()):
+            self.spawn(index)
+            del self.pids[pid]
+            self.retiring.add(pid)
+            self.signal_worker(pid, signal.SIGTERM)
+
+    def reap(self) -> None:
+        while self.pids or self.retiring:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.pids.clear()
+                self.retiring.clear()
+                return
+            if not pid:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            index = self.pids.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+            logging.error("PreforkServer: worker %d exited: status %d", index, status)
+            self.spawn(index)
+
+    def shutdown(self) -> None:
+        self.stopping = True
+        for pid in list(self.pids):
+            self.signal_worker(pid, signal.SIGTERM)
+        deadline = time.monotonic() + 10.0
+        while (self.pids or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in [*self.pids, *self.retiring]:
+            self.signal_worker(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.pids.clear()
+        self.retiring.clear()
+        if self.sock:
+            self.sock.close()
+        if self.snapshot_dir:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    def signal_worker(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def on_reload_signal(self, _signum: int, _frame: Any) -> None:
+        self.reload_requested = True
+
+    def on_stop_signal(self, _signum: int, _frame: Any) -> None:
+        self.stopping = True
+
+    ######################################
+    # Workers
+
+    def spawn(self, index: int) -> None:
+        if pid := os.fork():
+            self.pids[pid] = index
+            return
+        status = 1
+        try:
+            self.worker(index)
+            status = 0
+        # pylint: disable-next=broad-except
+        except BaseException as exc:
+            logging.error("PreforkServer: worker %d: %r", index, exc)
+        finally:
+            os._exit(status)  # pylint: disable=protected-access
+
+    def worker(self, index: int) -> None:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        # The master reloads, and replaces this worker:
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        listeners = restart_log_queues(logging.getLogger())
+        # pylint: disable-next=import-outside-toplevel
+        from . import api as api_module
+
+        api_module.app = self.app
+        logging.info("PreforkServer: worker %d: pid %d", index, os.getpid())
+        config = uvicorn.Config(
+            api_module.api, lifespan="on", access_log=False, log_config=None
+        )
+        try:
+            uvicorn.Server(config).run(sockets=[self.sock])
+        finally:
+            for listener in listeners:
+                listener.stop()
+
+
+def serve(**opts: Any) -> None:
+    """
+    Run a PreforkServer. Options, as strings from devd.main:
+    resource_root, domain_root, host, port, workers, snapshot, watch,
+    token_format, sessions (an SQLite file, for token_format=session).
+    """
+    options = ServerOptions(
+        host=opts.get("host", "0.0.0.0"),
+        port=int(opts.get("port", 8888)),
+        workers=int(opts.get("workers", 0)),
+        snapshot_path=opts.get("snapshot"),
+        watch=str(opts.get("watch", True)).lower() not in ("0", "false", "no"),
+        token_format=opts.get("token_format", "compact"),
+        session_path=opts.get("sessions"),
+    )
+    PreforkServer(
+        resource_root=opts.get("resource_root", "tests/data/rbac/root"),
+        domain_root=opts.get("domain_root", "tests/data/rbac/domain"),
+        options=options,
+    ).run()
+
+
+def main(argv: List[str]) -> None:
+    """Usage: server [--option=value ...]; see serve()."""
+    _, opts = parse_args(argv[1:], {})
+    setup_logging(level=logging.INFO)
+    serve(**opts)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,113 @@
+from pathlib import Path
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import httpx
+import pytest
+from .snapshot import compile_snapshot, write_snapshot
+from . import server as sut
+
+data_dir = Path("tests/data/rbac")
+
+
+@pytest.fixture(name="roots")
+def fixture_roots(tmp_path):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    return tmp_path / "domain", tmp_path / "root"
+
+
+def wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_app_reload_snapshot(roots, tmp_path):
+    domain_root, resource_root = roots
+    server = sut.PreforkServer(
+        str(resource_root),
+        str(domain_root),
+        sut.ServerOptions(snapshot_path=str(tmp_path / "s")),
+    )
+    server.compile()
+    app = server.app = server.make_app()
+    assert app.is_allowed("PUT", "/a/b/x.txt", "bob")[0] is False
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is True
+    (domain_root / "role.txt").write_text("member write-role Readers\n")
+    (resource_root / "a/b/.rbac.txt").write_text("rule deny PUT write-role *.txt\n")
+    assert server.relevant({domain_root / "role.txt", resource_root / "a/f1.txt"}) == {
+        domain_root / "role.txt"
+    }
+    # Not until reloaded:
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is True
+    write_snapshot(server.snapshot_path, compile_snapshot(domain_root, resource_root))
+    load_count = app.rule_tree.load_count
+    assert app.reload_snapshot()
+    assert app.rule_tree.load_count == load_count
+    assert app.is_allowed("PUT", "/a/b/x.txt", "frank")[0] is False
+    (resource_root / "a/b/.rbac.txt").unlink()
+    # Stale in the snapshot, so checked against the file system:
+    assert app.reload_snapshot()
+    assert app.rule_tree.node(Path("/a/b")).file_key is None
+    assert app.rule_tree.node(Path("/a/b")).rules == []
+
+
+def test_prefork_server(roots, tmp_path):
+    domain_root, resource_root = roots
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/__/access/PUT/a/b/x.txt"
+
+    def status() -> int:
+        try:
+            return httpx.get(url, auth=("bob", "b0b3r7")).status_code
+        except httpx.TransportError:
+            return 0
+
+    log_path = tmp_path / "server.log"
+
+    def log_count(text: str) -> int:
+        return log_path.read_text(encoding="utf-8").count(text)
+
+    with open(log_path, "w", encoding="utf-8") as log:
+        # From outside the repository, where its relative data paths do not exist:
+        # pylint: disable-next=consider-using-with
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "devd.rbac.server",
+                f"--resource-root={resource_root}",
+                f"--domain-root={domain_root}",
+                "--host=127.0.0.1",
+                f"--port={port}",
+                "--workers=2",
+            ],
+            env=os.environ | {"PYTHONPATH": str(Path("lib").absolute())},
+            cwd=tmp_path,
+            stderr=log,
+        )
+        try:
+            assert wait_for(lambda: status() == 401)
+            (domain_root / "role.txt").write_text("member write-role Readers\n")
+            # Every worker is replaced by a fork of the reloaded master:
+            assert wait_for(lambda: all(status() == 200 for _ in range(8)))
+            assert wait_for(lambda: log_count("worker 0: pid") == 2)
+            assert wait_for(lambda: log_count("worker 1: pid") == 2)
+            assert wait_for(lambda: log_count("Finished server process") == 2)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            assert process.wait(timeout=15) == 0
+    assert "exited" not in log_path.read_text(encoding="utf-8")
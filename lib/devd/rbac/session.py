@@ -0,0 +1,288 @@
+"""
+Server-side sessions.
+
+A session id is a random, opaque string naming a Session held here,
+in a SessionStore sharded by id: each shard is a dict with its own lock,
+so lookups are O(1) and writers rarely contend.
+Sessions can be revoked one at a time or by user.
+
+A SqliteSessionBackend keeps sessions across restarts
+and shares them between the workers of a PreforkServer:
+sessions missing from memory are looked up there,
+and sessions in memory are looked up again after backend_ttl seconds.
+So a session revoked by one worker stays valid in the others
+for at most backend_ttl seconds.
+Unknown ids are remembered for backend_ttl seconds too,
+so that forged ids do not each cost a query.
+
+Lookups only compare expiry; expired sessions are removed by sweep(),
+which a Sweeper runs in a background thread.
+"""
+
+from typing import Callable, Dict, List, Set, Tuple
+from dataclasses import dataclass
+from abc import ABC, abstractmethod
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from .cache import LRUCache
+
+
+@dataclass(frozen=True, slots=True)
+class Session:
+    session_id: str
+    username: str
+    created: float
+    # 0 if none:
+    expiry: float
+
+
+# A Session, and when to look it up in the backend again:
+Entry = Tuple[Session, float]
+
+
+class SessionStore:
+    def __init__(
+        self,
+        shard_count: int = 16,
+        backend: "SessionBackend | None" = None,
+        id_bytes: int = 24,
+        backend_ttl: float = 1.0,
+    ):
+        self.shards: List[Dict[str, Entry]] = [{} for _ in range(shard_count)]
+        self.locks = [threading.Lock() for _ in range(shard_count)]
+        self.backend = backend
+        self.id_bytes = id_bytes
+        self.backend_ttl = backend_ttl
+        # Ids not found in the backend:
+        self.misses = LRUCache(max_size=10_000, ttl=backend_ttl)
+        self.clock = time.time
+
+    def create(self, username: str, expiry: float = 0) -> Session:
+        """A new Session for username, expiring at expiry (0 for never)."""
+        session = Session(
+            secrets.token_urlsafe(self.id_bytes), username, self.clock(), expiry
+        )
+        if self.backend:
+            self.backend.put(session)
+        i = self.shard(session.session_id)
+        with self.locks[i]:
+            self.shards[i][session.session_id] = (session, self.fresh_until())
+        return session
+
+    def get(self, session_id: str) -> Session | None:
+        """The current Session named by session_id, or None."""
+        i = self.shard(session_id)
+        now = self.clock()
+        # dict.get is atomic; readers do not take the lock:
+        entry = self.shards[i].get(session_id)
+        if entry is None or entry[1] <= now:
+            session = self.fetch(i, session_id)
+        else:
+            session = entry[0]
+        if session is None or (session.expiry and now >= session.expiry):
+            return None
+        return session
+
+    def fetch(self, i: int, session_id: str) -> Session | None:
+        """Look session_id up in the backend, and keep the result in shard i."""
+        if not self.backend or self.misses.get(session_id):
+            return None
+        session = self.backend.get(session_id)
+        with self.locks[i]:
+            if session is None:
+                self.shards[i].pop(session_id, None)
+            else:
+                self.shards[i][session_id] = (session, self.fresh_until())
+        if session is None:
+            self.misses.put(session_id, True)
+        return session
+
+    def fresh_until(self) -> float:
+        """When a Session kept in memory now must be looked up again."""
+        return self.clock() + self.backend_ttl if self.backend else float("inf")
+
+    def revoke(self, session_id: str) -> bool:
+        i = self.shard(session_id)
+        with self.locks[i]:
+            found = self.shards[i].pop(session_id, None) is not None
+        if self.backend:
+            found = self.backend.delete(session_id) or found
+        return found
+
+    def revoke_user(self, username: str) -> int:
+        """Revoke all sessions of username. Returns how many there were."""
+        count = self.remove_if(lambda session: session.username == username)
+        if self.backend:
+            count = self.backend.delete_user(username)
+        return count
+
+    def sweep(self) -> int:
+        """
+        Remove expired sessions, and sessions revoked by other processes.
+        Returns how many were removed from memory.
+        """
+        now = self.clock()
+        if not self.backend:
+            return self.remove_if(lambda session: 0 < session.expiry <= now)
+        self.backend.delete_expired(now)
+        live = self.backend.session_ids()
+        return self.remove_if(lambda session: session.session_id not in live)
+
+    def remove_if(self, pred: Callable[[Session], bool]) -> int:
+        count = 0
+        for shard, lock in zip(self.shards, self.locks):
+            with lock:
+                ids = [id_ for id_, (session, _) in shard.items() if pred(session)]
+                for id_ in ids:
+                    del shard[id_]
+            count += len(ids)
+        return count
+
+    def shard(self, session_id: str) -> int:
+        return hash(session_id) % len(self.shards)
+
+    def close(self) -> None:
+        if self.backend:
+            self.backend.close()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+
+class SessionBackend(ABC):
+    """Persistent storage for a SessionStore."""
+
+    @abstractmethod
+    def put(self, session: Session) -> None:
+        pass
+
+    @abstractmethod
+    def get(self, session_id: str) -> Session | None:
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete_user(self, username: str) -> int:
+        pass
+
+    @abstractmethod
+    def delete_expired(self, now: float) -> int:
+        pass
+
+    @abstractmethod
+    def session_ids(self) -> Set[str]:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    Sessions in an SQLite database file, shared by processes.
+    Each process opens its own connection on first use,
+    so a backend can be created before forking.
+    """
+
+    SCHEMA = """
+      CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        created REAL NOT NULL,
+        expiry REAL NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username);
+      CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expiry);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db: sqlite3.Connection | None = None
+        self.pid = 0
+        self.lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        if self.db is None or self.pid != os.getpid():
+            db = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False, timeout=5.0
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(self.SCHEMA)
+            self.db, self.pid = db, os.getpid()
+        return self.db
+
+    def execute(self, sql: str, *params) -> int:
+        """Returns the count of rows changed."""
+        with self.lock:
+            return self.connection().execute(sql, params).rowcount
+
+    def query(self, sql: str, *params) -> List[Tuple]:
+        with self.lock:
+            return self.connection().execute(sql, params).fetchall()
+
+    def put(self, session: Session) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+            session.session_id,
+            session.username,
+            session.created,
+            session.expiry,
+        )
+
+    def get(self, session_id: str) -> Session | None:
+        rows = self.query("SELECT * FROM sessions WHERE session_id = ?", session_id)
+        return Session(*rows[0]) if rows else None
+
+    def delete(self, session_id: str) -> bool:
+        sql = "DELETE FROM sessions WHERE session_id = ?"
+        return self.execute(sql, session_id) > 0
+
+    def delete_user(self, username: str) -> int:
+        return self.execute("DELETE FROM sessions WHERE username = ?", username)
+
+    def delete_expired(self, now: float) -> int:
+        sql = "DELETE FROM sessions WHERE expiry > 0 AND expiry <= ?"
+        return self.execute(sql, now)
+
+    def session_ids(self) -> Set[str]:
+        return {row[0] for row in self.query("SELECT session_id FROM sessions")}
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None and self.pid == os.getpid():
+                self.db.close()
+            self.db = None
+
+
+class Sweeper:
+    """Runs SessionStore.sweep() every interval seconds, in a background thread."""
+
+    def __init__(self, store: SessionStore, interval: float = 60.0):
+        self.store, self.interval = store, interval
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="Sweeper", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                count = self.store.sweep()
+                logging.debug("Sweeper: removed %d sessions", count)
+            # pylint: disable-next=broad-except
+            except Exception as exc:
+                logging.error("Sweeper: %r", exc)
@@ -0,0 +1,117 @@
+import pytest
+from . import session as sut
+
+
+def make_store(backend=None) -> sut.SessionStore:
+    store = sut.SessionStore(shard_count=4, backend=backend)
+    store.clock = lambda: 1000.0
+    return store
+
+
+def test_session_store():
+    store = make_store()
+    bob = store.create("bob", 1060)
+    alice = store.create("alice")
+    assert len(bob.session_id) == 32 and bob.session_id != alice.session_id
+    assert store.get(bob.session_id) == bob
+    assert store.get(alice.session_id) == alice
+    assert store.get("unknown") is None
+    assert len(store) == 2
+    assert store.revoke(bob.session_id) is True
+    assert store.revoke(bob.session_id) is False
+    assert store.get(bob.session_id) is None
+    store.create("bob")
+    store.create("bob")
+    assert store.revoke_user("bob") == 2
+    assert len(store) == 1
+
+
+def test_sweep():
+    store = make_store()
+    bob = store.create("bob", 1060)
+    alice = store.create("alice")
+    store.clock = lambda: 1060.0
+    assert store.get(bob.session_id) is None
+    assert len(store) == 2
+    assert store.sweep() == 1
+    assert len(store) == 1
+    assert store.get(alice.session_id) == alice
+
+
+def test_sqlite_backend(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = make_store(sut.SqliteSessionBackend(path))
+    bob = store.create("bob", 1060)
+    alice = store.create("alice")
+    store.close()
+    # Another process, or a restart:
+    other = make_store(sut.SqliteSessionBackend(path))
+    assert len(other) == 0
+    assert other.get(bob.session_id) == bob
+    assert other.get(alice.session_id) == alice
+    assert len(other) == 2
+    store = make_store(sut.SqliteSessionBackend(path))
+    assert store.get(bob.session_id) == bob
+    assert store.revoke(bob.session_id) is True
+    # Revoked sessions are dropped from other processes after backend_ttl:
+    assert other.get(bob.session_id) == bob
+    other.clock = lambda: 1001.0
+    assert other.get(bob.session_id) is None
+    assert other.get(alice.session_id) == alice
+    # ... or by sweeps:
+    carol = other.create("carol")
+    assert store.revoke(carol.session_id) is True
+    assert other.sweep() == 1
+    assert other.get(carol.session_id) is None
+    other.clock = lambda: 2000.0
+    store.create("dave", 1060)
+    assert other.sweep() == 0
+    assert other.backend.session_ids() == {alice.session_id}
+    assert store.revoke_user("alice") == 1
+    assert other.sweep() == 1
+    assert len(other) == 0
+    store.close()
+    other.close()
+
+
+class CountingBackend(sut.SqliteSessionBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.get_count = 0
+
+    def get(self, session_id):
+        self.get_count += 1
+        return super().get(session_id)
+
+
+def test_unknown_ids_are_remembered(tmp_path):
+    backend = CountingBackend(str(tmp_path / "sessions.db"))
+    store = make_store(backend)
+    for _ in range(3):
+        assert store.get("forged") is None
+    assert backend.get_count == 1
+    store.misses.clear()
+    assert store.get("forged") is None
+    assert backend.get_count == 2
+    assert len(store) == 0
+    store.close()
+
+
+def test_session_backend_is_abstract():
+    with pytest.raises(TypeError):
+        # pylint: disable-next=abstract-class-instantiated
+        sut.SessionBackend()
+
+
+def test_sweeper():
+    store = make_store()
+    store.create("bob", 1060)
+    store.clock = lambda: 2000.0
+    sweeper = sut.Sweeper(store, interval=0.01)
+    sweeper.start()
+    for _ in range(500):
+        if len(store) == 0:
+            break
+        sweeper.stopped.wait(0.01)
+    sweeper.stop()
+    assert len(store) == 0
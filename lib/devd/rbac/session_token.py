@@ -0,0 +1,106 @@
+"""
+Compact session tokens.
+
+Binary layout, sent as URL-safe base64 without padding:
+- version: 1 byte
+- key id: 2 bytes, big-endian
+- nonce: 12 bytes
+- AES-GCM ciphertext of:
+  - issued: 4 bytes, seconds since the epoch
+  - expiry: 4 bytes, 0 if none
+  - username: UTF-8, the rest
+- AES-GCM tag: 16 bytes
+
+The version and key id are authenticated as associated data.
+Tokens carry no password.
+Several keys can be active, for rotation: tokens name the key they were sealed with.
+"""
+
+from typing import Dict, Tuple
+import base64
+import hashlib
+import secrets
+import struct
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .metrics import PHASE_SECONDS
+
+VERSION = 1
+HEADER = struct.Struct("!BH")
+CLAIMS = struct.Struct("!II")
+NONCE_LENGTH = 12
+
+# username, issued, expiry:
+Claims = Tuple[str, int, int]
+
+ENCODE_SECONDS = PHASE_SECONDS.labels("token.encode")
+DECODE_SECONDS = PHASE_SECONDS.labels("token.decode")
+
+
+class TokenCodec:
+    """
+    Seals and opens compact tokens.
+    New tokens use key_id; tokens sealed with any added key are accepted.
+    """
+
+    def __init__(self, keys: Dict[int, str | bytes], key_id: int | None = None):
+        self.primitives: Dict[int, AESGCM] = {}
+        for id_, key in keys.items():
+            self.add_key(id_, key)
+        self.key_id = max(keys) if key_id is None else key_id
+
+    def add_key(self, key_id: int, key: str | bytes) -> None:
+        """Accept tokens sealed with key. Set key_id to also seal new tokens with it."""
+        if not 0 <= key_id <= 0xFFFF:
+            raise ValueError(f"TokenCodec: invalid {key_id=}")
+        self.primitives[key_id] = AESGCM(derive_key(key))
+
+    def remove_key(self, key_id: int) -> None:
+        """Reject tokens sealed with key_id."""
+        if key_id == self.key_id:
+            raise ValueError(f"TokenCodec: {key_id=} is in use")
+        self.primitives.pop(key_id, None)
+
+    def encode(self, username: str, issued: int, expiry: int) -> str:
+        with ENCODE_SECONDS.time():
+            header = HEADER.pack(VERSION, self.key_id)
+            nonce = secrets.token_bytes(NONCE_LENGTH)
+            plaintext = CLAIMS.pack(issued, expiry) + username.encode()
+            sealed = self.primitives[self.key_id].encrypt(nonce, plaintext, header)
+            return b64encode(header + nonce + sealed)
+
+    def decode(self, token: str) -> Claims | None:
+        """The claims of token, or None if it is malformed, forged or its key is unknown."""
+        with DECODE_SECONDS.time():
+            try:
+                data = b64decode(token)
+                version, key_id = HEADER.unpack_from(data)
+                if version != VERSION or not (primitive := self.primitives.get(key_id)):
+                    return None
+                nonce_end = HEADER.size + NONCE_LENGTH
+                plaintext = primitive.decrypt(
+                    data[HEADER.size : nonce_end], data[nonce_end:], data[: HEADER.size]
+                )
+                issued, expiry = CLAIMS.unpack_from(plaintext)
+                return plaintext[CLAIMS.size :].decode(), issued, expiry
+            except (ValueError, struct.error, InvalidTag):
+                return None
+
+
+def derive_key(key: str | bytes) -> bytes:
+    """A 256-bit AES key: 32 bytes as is, otherwise their SHA-256."""
+    if isinstance(key, str):
+        key = key.encode()
+    if len(key) == 32:
+        return key
+    return hashlib.sha256(key).digest()
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(text: str) -> bytes:
+    return base64.b64decode(
+        text + "=" * (-len(text) % 4), altchars=b"-_", validate=True
+    )
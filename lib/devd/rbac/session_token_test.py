@@ -0,0 +1,54 @@
+import pytest
+from .cipher import Cipher
+from . import session_token as sut
+
+
+def test_encode_decode():
+    codec = sut.TokenCodec({1: "key"})
+    token = codec.encode("bob", 1000, 2000)
+    assert codec.decode(token) == ("bob", 1000, 2000)
+    assert codec.decode(codec.encode("bøb", 1000, 0)) == ("bøb", 1000, 0)
+    # Nonces differ:
+    assert codec.encode("bob", 1000, 2000) != token
+    assert set(token) <= set(
+        "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+    )
+
+
+def test_decode_invalid():
+    codec = sut.TokenCodec({1: "key"})
+    token = codec.encode("bob", 1000, 2000)
+    data = bytearray(sut.b64decode(token))
+    for i in range(len(data)):
+        tampered = bytearray(data)
+        tampered[i] ^= 1
+        assert codec.decode(sut.b64encode(bytes(tampered))) is None
+    assert codec.decode(token[:-1]) is None
+    assert codec.decode("") is None
+    assert codec.decode("not a token!") is None
+    assert sut.TokenCodec({1: "other"}).decode(token) is None
+
+
+def test_key_rotation():
+    codec = sut.TokenCodec({1: "old"})
+    old_token = codec.encode("bob", 1000, 0)
+    codec.add_key(2, "new")
+    codec.key_id = 2
+    new_token = codec.encode("bob", 1000, 0)
+    assert codec.decode(old_token) == ("bob", 1000, 0)
+    assert codec.decode(new_token) == ("bob", 1000, 0)
+    assert sut.TokenCodec({2: "new"}).decode(new_token) == ("bob", 1000, 0)
+    with pytest.raises(ValueError):
+        codec.remove_key(2)
+    codec.remove_key(1)
+    assert codec.decode(old_token) is None
+    assert codec.decode(new_token) == ("bob", 1000, 0)
+    assert sut.TokenCodec({1: "a", 3: "b"}).key_id == 3
+
+
+def test_shorter_than_cipher_tokens():
+    token = sut.TokenCodec({1: "key"}).encode("bob", 1000, 2000)
+    # header + nonce + claims + username + tag:
+    assert len(sut.b64decode(token)) == 3 + 12 + 8 + 3 + 16
+    enciphered = Cipher("key").encipher("5:bob:1000:1000:2000:b0b3r7")
+    assert len(token) < len(enciphered)
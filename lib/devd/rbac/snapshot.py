@@ -0,0 +1,253 @@
+"""
+Compiled snapshots of the domain and rule files.
+
+A snapshot holds the parsed users, memberships, passwords
+and the rules of each directory,
+with the FileKey, and optionally the SHA-256, of each source file.
+It is written atomically with marshal and loaded with one read.
+Each part is used only while its source file is unchanged;
+callers fall back to parsing the text file otherwise.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+from pathlib import Path
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import sys
+from .subject import User, Group
+from .credential import UserPass
+from .rbac import Rule, RuleSet, Role, Membership, Permission
+from .domain import SubjectDomain, RoleDomain, PasswordDomain
+from .loader import DomainFileLoader, FileSystemLoader, TextLoader
+from .rule_tree import RuleTree, FileKey, file_key
+from .stream import AtomicFileWriter
+
+MAGIC = b"devd.rbac.snapshot:1\n"
+
+# (FileKey, SHA-256 hex digest or None):
+SourceKey = Tuple[FileKey, str | None]
+# (permission, action, role, resource) patterns:
+RuleSource = Tuple[str, str, str, str]
+
+
+def compile_snapshot(
+    domain_root: Path,
+    resource_root: Path,
+    auth_file_name: str = ".rbac.txt",
+    hashes: bool = False,
+) -> dict:
+    """Parse the domain files and every auth file under resource_root."""
+    sources: Dict[str, SourceKey | None] = {}
+
+    def source(path: Path) -> str:
+        # Taken before parsing: a file changed meanwhile will be stale.
+        name = source_name(path)
+        sources[name] = source_key(path, hashes)
+        return name
+
+    loader = DomainFileLoader()
+    data: Dict[str, Any] = {"sources": sources}
+    data["user_file"] = source(user_file := domain_root / "user.txt")
+    subject_domain = loader.load_user_file(user_file)
+    data["users"] = [
+        (user.name, user.description, tuple(group.name for group in user.groups))
+        for user in subject_domain.users
+    ]
+    data["groups"] = [
+        (group.name, group.description) for group in subject_domain.groups
+    ]
+    data["role_file"] = source(role_file := domain_root / "role.txt")
+    data["memberships"] = [
+        (
+            membership.role.name,
+            isinstance(membership.member, User),
+            membership.member.name,
+            membership.member.description,
+        )
+        for membership in loader.load_membership_file(role_file).memberships
+    ]
+    data["password_file"] = source(password_file := domain_root / "password.txt")
+    data["passwords"] = [
+        (password.username, password.password)
+        for password in loader.load_password_file(password_file).passwords
+    ]
+    data["rules"] = compile_rules(resource_root, auth_file_name, source)
+    return data
+
+
+def compile_rules(
+    resource_root: Path, auth_file_name: str, source: Callable[[Path], str]
+) -> List[Tuple[str, str, List[RuleSource]]]:
+    """(directory, source name, rule sources) of every auth file under resource_root."""
+    fs_loader = FileSystemLoader(
+        resource_root=resource_root, auth_file_name=auth_file_name
+    )
+    rules = []
+    for dir_path, _, file_names in os.walk(str(resource_root)):
+        if auth_file_name not in file_names:
+            continue
+        directory = Path("/") / Path(dir_path).relative_to(resource_root)
+        auth_file = source(fs_loader.auth_file(directory))
+        rule_set = fs_loader.load_rule_set(directory)
+        rules.append(
+            (str(directory), auth_file, [rule_source(r) for r in rule_set.rules])
+        )
+    return rules
+
+
+def write_snapshot(path: Path, data: dict) -> None:
+    # Snapshots contain passwords:
+    with AtomicFileWriter(path, mode=0o600) as writer:
+        writer.write(MAGIC + marshal.dumps(data))
+
+
+def load_snapshot(path: Path, verify_hashes: bool = False) -> "DomainSnapshot | None":
+    """
+    Returns None if the snapshot is missing or unreadable.
+    The file is mapped rather than read, which avoids one copy of its bytes
+    while loading; the unmarshalled objects are private to each process.
+    """
+    try:
+        with open(str(path), "rb") as io, mmap.mmap(
+            io.fileno(), 0, access=mmap.ACCESS_READ
+        ) as content:
+            if content[: len(MAGIC)] != MAGIC:
+                raise ValueError("bad magic")
+            with memoryview(content)[len(MAGIC) :] as view:
+                data = marshal.loads(view)
+    except (OSError, ValueError, EOFError, TypeError) as exc:
+        logging.info("load_snapshot: %s", f"{path}: {exc!r}")
+        return None
+    return DomainSnapshot(data, verify_hashes)
+
+
+class DomainSnapshot:
+    """The parts of a compiled snapshot whose source files are unchanged."""
+
+    def __init__(self, data: dict, verify_hashes: bool = False):
+        self.data, self.verify_hashes = data, verify_hashes
+
+    def is_current(self, name: str) -> bool:
+        if not (source := self.data["sources"].get(name)):
+            return False
+        key, digest = source
+        path = Path(name)
+        if file_key(path) != key:
+            return False
+        return not (self.verify_hashes and digest) or file_sha256(path) == digest
+
+    def has_current(self, part: str, path: Path) -> bool:
+        """True if the snapshot's part was compiled from path, as it is now."""
+        name = source_name(path)
+        if self.data[part] != name or not self.is_current(name):
+            logging.info("DomainSnapshot: %s", f"stale: {path}")
+            return False
+        return True
+
+    def subject_domain(self, user_file: Path) -> SubjectDomain | None:
+        if not self.has_current("user_file", user_file):
+            return None
+        group_by_name: Dict[str, Group] = {}
+        for name, description in self.data["groups"]:
+            group_by_name[name] = Group(name, description)
+        # Users with the same groups share one tuple of them:
+        group_tuples: Dict[Tuple[str, ...], Tuple[Group, ...]] = {}
+
+        def groups(names: Tuple[str, ...]) -> Tuple[Group, ...]:
+            if (result := group_tuples.get(names)) is None:
+                result = group_tuples[names] = tuple(
+                    group_by_name.setdefault(g, Group(g, g)) for g in names
+                )
+            return result
+
+        users = [
+            User(name, description, groups=groups(tuple(group_names)))
+            for name, description, group_names in self.data["users"]
+        ]
+        return SubjectDomain(users=users, groups=group_by_name.values())
+
+    def role_domain(self, role_file: Path) -> RoleDomain | None:
+        if not self.has_current("role_file", role_file):
+            return None
+        role_by_name: Dict[str, Role] = {}
+        memberships: List[Membership] = []
+        for role_name, is_user, name, description in self.data["memberships"]:
+            role = role_by_name.setdefault(role_name, Role(role_name))
+            member = User(name, description) if is_user else Group(name, description)
+            memberships.append(Membership(role=role, member=member))
+        roles = sorted(role_by_name.values(), key=lambda role: role.name)
+        return RoleDomain(memberships=memberships, roles=roles)
+
+    def password_domain(self, password_file: Path) -> PasswordDomain | None:
+        if not self.has_current("password_file", password_file):
+            return None
+        return PasswordDomain(
+            passwords=[UserPass(*password) for password in self.data["passwords"]]
+        )
+
+    def rule_sets(self) -> Iterable[Tuple[Path, FileKey, RuleSet]]:
+        """(directory, auth file FileKey, RuleSet) of each current auth file."""
+        loader = TextLoader()
+        for directory, auth_file, sources in self.data["rules"]:
+            if not self.is_current(auth_file):
+                continue
+            rules = [
+                loader.make_rule(Permission(permission), action, role, resource)
+                for permission, action, role, resource in sources
+            ]
+            key = self.data["sources"][auth_file][0]
+            yield Path(directory), key, RuleSet(rules=rules)
+
+    def seed_rule_tree(self, rule_tree: RuleTree) -> int:
+        """Seed rule_tree with the current rule sets. Returns their number."""
+        count = 0
+        for directory, key, rule_set in self.rule_sets():
+            rule_tree.seed(directory, key, rule_set)
+            count += 1
+        return count
+
+
+def rule_source(rule: Rule) -> RuleSource:
+    def pattern(obj: Any) -> str:
+        return f"!{obj.name}" if obj.negated else obj.name
+
+    return (
+        rule.permission.name,
+        pattern(rule.action),
+        pattern(rule.role),
+        pattern(rule.resource),
+    )
+
+
+def source_name(path: Path) -> str:
+    return os.path.abspath(str(path))
+
+
+def source_key(path: Path, hashes: bool) -> SourceKey | None:
+    if (key := file_key(path)) is None:
+        return None
+    return key, file_sha256(path) if hashes else None
+
+
+def file_sha256(path: Path) -> str | None:
+    try:
+        with open(str(path), "rb") as io:
+            return hashlib.file_digest(io, "sha256").hexdigest()
+    except OSError:
+        return None
+
+
+def main(argv: List[str]) -> None:
+    """Usage: snapshot DOMAIN_ROOT RESOURCE_ROOT OUTPUT [--hashes]"""
+    domain_root, resource_root, output, *opts = argv[1:]
+    data = compile_snapshot(
+        Path(domain_root), Path(resource_root), hashes="--hashes" in opts
+    )
+    write_snapshot(Path(output), data)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
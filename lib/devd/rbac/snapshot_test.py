@@ -0,0 +1,93 @@
+from pathlib import Path
+import shutil
+import pytest
+from .loader import DomainFileLoader, FileSystemLoader
+from .rule_tree import RuleTree
+from .app import App
+from . import snapshot as sut
+
+data_dir = Path("tests/data/rbac")
+
+
+@pytest.fixture(name="roots")
+def fixture_roots(tmp_path):
+    shutil.copytree(data_dir, tmp_path, dirs_exist_ok=True)
+    return tmp_path / "domain", tmp_path / "root"
+
+
+def write_and_load(roots, tmp_path, hashes=False):
+    path = tmp_path / "domain.snapshot"
+    sut.write_snapshot(path, sut.compile_snapshot(*roots, hashes=hashes))
+    assert path.stat().st_mode & 0o777 == 0o600
+    return sut.load_snapshot(path, verify_hashes=hashes)
+
+
+def memberships(role_domain):
+    return [
+        (membership.role.name, membership.member)
+        for membership in role_domain.memberships
+    ]
+
+
+def test_domains_match_text(roots, tmp_path):
+    domain_root, _ = roots
+    snapshot = write_and_load(roots, tmp_path)
+    loader = DomainFileLoader()
+    assert snapshot.subject_domain(domain_root / "user.txt") == loader.load_user_file(
+        domain_root / "user.txt"
+    )
+    assert memberships(snapshot.role_domain(domain_root / "role.txt")) == (
+        memberships(loader.load_membership_file(domain_root / "role.txt"))
+    )
+    assert snapshot.password_domain(domain_root / "password.txt") == (
+        loader.load_password_file(domain_root / "password.txt")
+    )
+    (domain_root / "role.txt").write_text("member read-role bob\n", encoding="utf-8")
+    assert snapshot.role_domain(domain_root / "role.txt") is None
+    assert snapshot.subject_domain(domain_root / "password.txt") is None
+
+
+def test_rule_tree_seed(roots, tmp_path):
+    _, resource_root = roots
+    snapshot = write_and_load(roots, tmp_path, hashes=True)
+    text_tree = RuleTree(FileSystemLoader(resource_root=resource_root))
+    rule_tree = RuleTree(FileSystemLoader(resource_root=resource_root))
+    assert snapshot.seed_rule_tree(rule_tree) == 4
+    resource = Path("/a/b/x.txt")
+    assert [rule.brief() for rule in rule_tree.rules_for_resource(resource)] == [
+        rule.brief() for rule in text_tree.rules_for_resource(resource)
+    ]
+    assert rule_tree.load_count == 0
+    auth_file = resource_root / "a/.rbac.txt"
+    auth_file.write_text("rule deny * * *\n", encoding="utf-8")
+    directories = sorted(str(directory) for directory, _, _ in snapshot.rule_sets())
+    assert directories == ["/", "/a/b", "/pub"]
+
+
+def test_load_snapshot_rejects_garbage(tmp_path):
+    path = tmp_path / "domain.snapshot"
+    assert sut.load_snapshot(path) is None
+    path.write_bytes(b"garbage")
+    assert sut.load_snapshot(path) is None
+    path.write_bytes(sut.MAGIC + b"\xff")
+    assert sut.load_snapshot(path) is None
+
+
+def test_app_uses_snapshot(roots, tmp_path):
+    domain_root, resource_root = roots
+    path = tmp_path / "domain.snapshot"
+    sut.write_snapshot(path, sut.compile_snapshot(domain_root, resource_root))
+    app = App(
+        resource_root=str(resource_root),
+        domain_root=str(domain_root),
+        snapshot_path=str(path),
+    )
+    text_app = App(resource_root=str(resource_root), domain_root=str(domain_root))
+    for action, resource, user in [
+        ("PUT", "a/b/x.txt", "frank"),
+        ("GET", "a/b/x.txt", "bob"),
+        ("GET", "pub/y.txt", "alice"),
+    ]:
+        assert app.is_allowed(action, resource, user) == text_app.is_allowed(
+            action, resource, user
+        )
@@ -0,0 +1,109 @@
+from typing import Any, Iterator, List
+from dataclasses import dataclass, field
+from pathlib import Path
+import os
+import tempfile
+from .metrics import PHASE_SECONDS, FILE_BYTES
+
+READ_SECONDS = PHASE_SECONDS.labels("file.read")
+WRITE_SECONDS = PHASE_SECONDS.labels("file.write")
+READ_BYTES = FILE_BYTES.labels("read")
+WRITE_BYTES = FILE_BYTES.labels("write")
+
+
+@dataclass
+class FileSegment:
+    """length bytes of path, starting at offset."""
+
+    path: Path
+    offset: int
+    length: int
+
+
+BodyPart = bytes | FileSegment
+
+
+@dataclass
+class StreamBody:
+    """
+    A response body of literal bytes and FileSegments,
+    read in chunks of at most chunk_size bytes as it is iterated.
+    """
+
+    parts: List[BodyPart]
+    chunk_size: int = field(default=64 * 1024)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self.parts:
+            if isinstance(part, FileSegment):
+                yield from self.segment_chunks(part)
+            elif part:
+                yield part
+
+    def segment_chunks(self, segment: FileSegment) -> Iterator[bytes]:
+        fd = os.open(str(segment.path), os.O_RDONLY)
+        try:
+            offset, remaining = segment.offset, segment.length
+            while remaining > 0:
+                with READ_SECONDS.time():
+                    chunk = os.pread(fd, min(self.chunk_size, remaining), offset)
+                READ_BYTES.inc(len(chunk))
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    def content_length(self) -> int:
+        return sum(
+            part.length if isinstance(part, FileSegment) else len(part)
+            for part in self.parts
+        )
+
+
+class AtomicFileWriter:
+    """
+    Writes to a hidden temporary file next to path.
+    commit() renames it over path; abort() removes it.
+    As a context manager, commits unless an exception is raised.
+    """
+
+    def __init__(self, path: Path, mode: int = 0o644):
+        self.path = path
+        try:
+            mode = os.stat(str(path)).st_mode & 0o7777
+        except OSError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(
+            dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp"
+        )
+        os.fchmod(fd, mode)
+        self.tmp_path = Path(tmp_path)
+        self.io = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        WRITE_BYTES.inc(len(data))
+        with WRITE_SECONDS.time():
+            return self.io.write(data)
+
+    def commit(self) -> None:
+        with WRITE_SECONDS.time():
+            self.io.close()
+            os.replace(str(self.tmp_path), str(self.path))
+
+    def abort(self) -> None:
+        self.io.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "AtomicFileWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *_args: Any) -> None:
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -2,7 +2,7 @@ from typing import Iterable
 from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Group:
     name: str
     description: str = field(default="")
@@ -11,7 +11,7 @@ class Group:
 Groups = Iterable[Group]
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     name: str
     description: str = field(default="")
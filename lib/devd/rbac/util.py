@@ -2,7 +2,7 @@
 # devdriven/path.py
 # devdriven/glob.py
 
-from typing import Any, Callable, Iterable, List
+from typing import Any, Callable, Dict, Iterable, List, Tuple
 import re
 
 Composable = Callable[..., Any]
@@ -100,3 +100,64 @@ def glob_to_regex(glob: str, deep_matches_empty: bool = False) -> re.Pattern:
         return None
 
     return re.compile("^(?:" + re.sub(GLOB_RX, scan, glob) + ")$")
+
+
+class MultiRegex:
+    """
+    Matches a string against many anchored regexes in one pass.
+    match_mask returns an int bitmask of the positions of the items that match.
+    Items are (regex, negated) pairs;
+    a None regex always matches.
+    Each distinct regex is an optional, capturing lookahead in a single regex.
+    """
+
+    def __init__(self, items: Iterable[Tuple[re.Pattern | None, bool]]):
+        self.always_mask = 0
+        positive: Dict[str, int] = {}
+        negative: Dict[str, int] = {}
+        for i, (regex, negated) in enumerate(items):
+            bit = 1 << i
+            if regex is None:
+                if not negated:
+                    self.always_mask |= bit
+            else:
+                masks = negative if negated else positive
+                masks[regex.pattern] = masks.get(regex.pattern, 0) | bit
+                (positive if negated else negative).setdefault(regex.pattern, 0)
+        self.patterns = list(positive)
+        self.positive_masks = [positive[pattern] for pattern in self.patterns]
+        self.negative_masks = [negative[pattern] for pattern in self.patterns]
+        self.negative_mask = 0
+        for mask in self.negative_masks:
+            self.negative_mask |= mask
+        self.regex = re.compile(
+            "".join(
+                f"(?=(?P<r{j}>{anchored_body(pattern)}))?"
+                for j, pattern in enumerate(self.patterns)
+            )
+        )
+        # Patterns may contain their own capturing groups:
+        self.group_numbers: List[int] | None = [
+            self.regex.groupindex[f"r{j}"] for j in range(len(self.patterns))
+        ]
+        if self.group_numbers == list(range(1, len(self.patterns) + 1)):
+            self.group_numbers = None
+
+    def match_mask(self, string: str) -> int:
+        mask = self.always_mask | self.negative_mask
+        groups = self.regex.match(string).groups()  # type: ignore
+        if self.group_numbers is not None:
+            groups = tuple(groups[n - 1] for n in self.group_numbers)
+        for group, positive, negative in zip(
+            groups, self.positive_masks, self.negative_masks
+        ):
+            if group is not None:
+                mask = (mask | positive) & ~negative
+        return mask
+
+
+def anchored_body(pattern: str) -> str:
+    """Make a "^..." regex usable after the start of another regex."""
+    if not pattern.startswith("^"):
+        raise ValueError(f"MultiRegex: expected anchored regex: {pattern!r}")
+    return pattern.removeprefix("^")
@@ -3,7 +3,7 @@
 # devdriven/glob_test.py
 
 import re
-from .util import clean_path, glob_to_regex
+from .util import clean_path, glob_to_regex, MultiRegex
 
 
 def test_clean_path():
@@ -61,6 +61,23 @@ def test_glob_star_star():
     assert fut(glob, "/d/a.c") is True
 
 
+def test_multi_regex():
+    multi_regex = MultiRegex(
+        [
+            (glob_to_regex("/a/**"), False),
+            (glob_to_regex("**/.*"), True),
+            (None, False),
+            (glob_to_regex("/a/**"), True),
+            (re.compile(r"^(x)y$"), False),
+            (None, True),
+        ]
+    )
+    assert multi_regex.match_mask("/a/b") == 0b000111
+    assert multi_regex.match_mask("/a/.b") == 0b000101
+    assert multi_regex.match_mask("xy") == 0b011110
+    assert multi_regex.match_mask("/b") == 0b001110
+
+
 def fut(glob, path):
     rx = glob_to_regex(glob)
     # print('')
@@ -1,7 +1,11 @@
 from typing import Any, List, Dict, Tuple, Callable, Iterable, Generator
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import sys
 import re
+import time
 import traceback
 from pathlib import Path
 from datetime import datetime, timezone
@@ -47,15 +51,23 @@ def output_response(response: Any, fmt: str, stream=None):
 
 #############################################
 
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 
-def setup_logging(**kwargs):
+
+def setup_logging(**kwargs) -> QueueListener | None:
+    """
+    Configure the root logger.
+    If queue is true, records are formatted and written by a background thread:
+    see use_log_queue.
+    """
     kwargs = {
         "stream": sys.stderr,
         "level": logging.INFO,
         "format": "%(asctime)s %(levelname)-8s %(message)s",
-        "datefmt": "%Y-%m-%dT%H:%M:%S%z",
+        "datefmt": DATE_FORMAT,
     } | kwargs
     formatter = kwargs.pop("formatter", None)
+    log_queue = kwargs.pop("queue", False)
     logging.basicConfig(**kwargs)
     if formatter:
         if formatter == "json":
@@ -66,6 +78,68 @@ def setup_logging(**kwargs):
         set_logger_formatter(logging.getLogger(), formatter)
         for log in all_loggers():
             set_logger_formatter(log, formatter)
+    if log_queue:
+        listener = use_log_queue(logging.getLogger())
+        atexit.register(listener.stop)
+        return listener
+    return None
+
+
+def use_log_queue(logger: logging.Logger) -> QueueListener:
+    """
+    Move the handlers of logger behind a QueueHandler,
+    so that logging threads never block on formatting or I/O.
+    The handlers are called by the returned, started, QueueListener;
+    stop() it to flush the queue.
+    """
+    handlers = [
+        handler for handler in logger.handlers if not isinstance(handler, QueueHandler)
+    ]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    logger.addHandler(queue_handler)
+    return queue_handler.start(handlers)
+
+
+def restart_log_queues(logger: logging.Logger) -> List[QueueListener]:
+    """
+    In a forked process: restart the QueueListeners of logger's LazyQueueHandlers,
+    whose threads were not forked, on new queues.
+    Returns the started QueueListeners.
+    """
+    listeners = []
+    for handler in logger.handlers:
+        if isinstance(handler, LazyQueueHandler) and handler.listener:
+            handler.queue = queue.SimpleQueue()
+            listeners.append(handler.start(handler.listener.handlers))
+    return listeners
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueues records unformatted:
+    messages and their arguments are formatted by the QueueListener's thread.
+    Arguments must therefore not be mutated after logging.
+    """
+
+    def __init__(self, records: queue.SimpleQueue):
+        super().__init__(records)
+        self.listener: QueueListener | None = None
+
+    def start(self, handlers: Iterable[logging.Handler]) -> QueueListener:
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        return self.listener
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.exc_text = record.exc_text or (
+            logging.Formatter().formatException(record.exc_info)
+            if record.exc_info
+            else None
+        )
+        record.exc_info = None
+        return record
 
 
 def set_logger_formatter(logger, formatter):
@@ -91,15 +165,19 @@ class LoggingCallbackHandler(logging.Handler):
         self.level = level
         self.filters = []
         self.lock = None
+        self.time_formatter = logging.Formatter()
 
     def emit(self, record):
         try:
+            # Records sent to a LazyQueueHandler are not yet formatted:
+            if not hasattr(record, "asctime"):
+                record.asctime = self.time_formatter.formatTime(record, DATE_FORMAT)
             basic = [
                 record.asctime,
                 # record.created,
                 record.levelname,
                 record.name,
-                record.message,
+                record.getMessage(),
             ]
             self.callback(basic)
         except (KeyboardInterrupt, SystemExit):
@@ -128,16 +206,22 @@ def with_timing(
     fun: Callable[[], Any],
     tz: timezone | None = None,
 ) -> WithTimingResult:
+    """
+    Call fun, returning its result or exception, its start and stop times,
+    and the elapsed seconds, measured by time.perf_counter.
+    """
     tz = tz or timezone.utc
     t0 = datetime.now(tz)
+    started = time.perf_counter()
     result = exc = None
     try:
         result = fun()
     # pylint: disable-next=broad-exception-caught
     except Exception as e:
         exc = e
+    elapsed_sec = time.perf_counter() - started
     t1 = datetime.now(tz)
-    return result, exc, t0, t1, (t1 - t0).total_seconds()
+    return result, exc, t0, t1, elapsed_sec
 
 
 def process_result(with_timing_result: WithTimingResult) -> dict:
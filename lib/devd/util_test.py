@@ -1,4 +1,5 @@
 from time import sleep
+import logging
 from datetime import datetime
 from . import util as sut
 
@@ -29,3 +30,20 @@ def test_with_timing():
     result, exc, t0, t1, dt_sec = sut.with_timing(g)
     assert result is None
     assert isinstance(exc, ValueError)
+
+
+def test_use_log_queue():
+    logger = logging.getLogger("devd.util_test.queue")
+    messages = []
+    handler = sut.LoggingCallbackHandler(lambda basic: messages.append(basic[3]))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = sut.use_log_queue(logger)
+    try:
+        assert [type(h) for h in logger.handlers] == [sut.LazyQueueHandler]
+        logger.info("x=%d", 1)
+    finally:
+        listener.stop()
+        logger.handlers.clear()
+    assert messages == ["x=1"]